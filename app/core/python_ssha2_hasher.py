@@ -1,8 +1,18 @@
+import asyncio
 import hashlib
 import secrets
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional, Tuple
 
+# 密码校验进程数；hashlib 对短输入不释放 GIL，线程池无法并行，因此使用进程池
+PASSWORD_VERIFY_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# 同时在排队和计算中的校验请求上限，超过时直接拒绝而不是无限排队
+PASSWORD_VERIFY_QUEUE_SIZE = 32
+
 
 class Ssha2Hash:
     """
@@ -95,14 +105,13 @@ class Ssha2Hasher:
         # 将字符串转换为UTF-8字节数组
         password_bytes = plaintext_chars.encode('utf-8')
         
-        # 使用SHA-512进行迭代哈希，而不是PBKDF2
+        # 使用SHA-512进行迭代哈希，而不是PBKDF2：digest = SHA512(digest + salt)
+        # 循环体只做一次拼接和一次哈希调用，结果与逐次 update 相同
+        sha512 = hashlib.sha512
         digest_bytes = password_bytes
         
-        for i in range(iterations):
-            hasher = hashlib.sha512()
-            hasher.update(digest_bytes)
-            hasher.update(salt)
-            digest_bytes = hasher.digest()
+        for _ in range(iterations):
+            digest_bytes = sha512(digest_bytes + salt).digest()
         
         return digest_bytes
     
@@ -152,6 +161,43 @@ class Ssha2Hasher:
             print(f"验证过程中出错: {e}")
             return False
 
+    async def verify_async(self, arg_digest: str, plaintext_chars: str) -> bool:
+        """
+        在进程池中验证密码，不阻塞事件循环
+
+        Raises:
+            PasswordVerifyBusy: 排队的校验请求已达到 PASSWORD_VERIFY_QUEUE_SIZE
+        """
+        global _verify_executor, _verify_slots
+        if _verify_slots is None:
+            _verify_slots = asyncio.Semaphore(PASSWORD_VERIFY_QUEUE_SIZE)
+        if _verify_slots.locked():
+            raise PasswordVerifyBusy("Too many concurrent password verifications")
+
+        async with _verify_slots:
+            if _verify_executor is None:
+                _verify_executor = ProcessPoolExecutor(max_workers=PASSWORD_VERIFY_WORKERS)
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(_verify_executor, _verify_in_worker, arg_digest, plaintext_chars)
+            except BrokenProcessPool:
+                # 工作进程异常退出，下次调用时重建进程池
+                _verify_executor = None
+                raise
+
+
+class PasswordVerifyBusy(Exception):
+    """密码校验队列已满"""
+
+
+_verify_executor = None
+_verify_slots = None
+
+
+def _verify_in_worker(arg_digest: str, plaintext_chars: str) -> bool:
+    # 在工作进程中执行，必须是模块级函数
+    return Ssha2Hasher().verify(arg_digest, plaintext_chars)
+
 
 def test_python_ssha2_hasher():
     """测试Python实现的Ssha2Hasher"""
@@ -180,6 +226,79 @@ def test_python_ssha2_hasher():
     print(f"密码验证: {'✓ 成功' if verify_result else '✗ 失败'}")
     return verify_result
 
-#
-# if __name__ == "__main__":
-#     test_python_ssha2_hasher()
\ No newline at end of file
+
+def _calc_digest_reference(plaintext_chars: str, salt: bytes, iterations: int) -> bytes:
+    """原始逐次 update 实现，用于基准测试中核对结果"""
+    digest_bytes = plaintext_chars.encode('utf-8')
+    for i in range(iterations):
+        hasher = hashlib.sha512()
+        hasher.update(digest_bytes)
+        hasher.update(salt)
+        digest_bytes = hasher.digest()
+    return digest_bytes
+
+
+async def _benchmark_logins(hasher: "Ssha2Hasher", encrypted_password: str, plain_password: str,
+                            concurrency: int, use_pool: bool) -> Tuple[float, float]:
+    """并发登录基准：返回 (每秒登录数, 事件循环最大阻塞毫秒数)"""
+    max_stall = 0.0
+    running = True
+
+    async def heartbeat():
+        # 每 10ms 醒来一次，记录实际间隔超出的部分
+        nonlocal max_stall
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            max_stall = max(max_stall, (time.perf_counter() - started - 0.01) * 1000)
+
+    async def login():
+        if use_pool:
+            return await hasher.verify_async(encrypted_password, plain_password)
+        return hasher.verify(encrypted_password, plain_password)
+
+    monitor = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    results = await asyncio.gather(*[login() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    running = False
+    await monitor
+    assert all(results)
+    return concurrency / elapsed, max_stall
+
+
+def benchmark(concurrency: int = 16):
+    """
+    对比事件循环内同步校验与进程池校验的并发登录吞吐量
+
+    用法: python -m app.core.python_ssha2_hasher [并发数]
+    """
+    hasher = Ssha2Hasher()
+    plain_password = "123456"
+    encrypted_password = hasher.hash(plain_password)
+    parsed = Ssha2Hash(encrypted_password)
+
+    started = time.perf_counter()
+    reference = _calc_digest_reference(plain_password, parsed.get_salt(), parsed.get_iterations())
+    reference_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    fast = hasher.calc_digest(plain_password, parsed.get_salt(), parsed.get_iterations())
+    fast_seconds = time.perf_counter() - started
+    assert reference == fast == parsed.get_digest()
+    print(f"单次摘要: 原实现 {reference_seconds * 1000:.1f}ms, 当前实现 {fast_seconds * 1000:.1f}ms")
+
+    async def run():
+        # 预热进程池，避免把进程启动时间计入结果
+        await asyncio.gather(*[hasher.verify_async(encrypted_password, plain_password)
+                               for _ in range(PASSWORD_VERIFY_WORKERS)])
+        for use_pool in (False, True):
+            throughput, max_stall = await _benchmark_logins(hasher, encrypted_password, plain_password,
+                                                            min(concurrency, PASSWORD_VERIFY_QUEUE_SIZE), use_pool)
+            mode = f"进程池({PASSWORD_VERIFY_WORKERS} 进程)" if use_pool else "事件循环内同步"
+            print(f"{mode}: {throughput:.1f} 次登录/秒, 事件循环最大阻塞 {max_stall:.1f}ms")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 16)
\ No newline at end of file
@@ -5,8 +5,7 @@ from typing import Optional, Union
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
-
+from app.database import AsyncSQLServerSession
 from app.services.access_service import verify_password
 
 from app.utils.logger import app_logger
@@ -60,8 +59,13 @@ async def get_current_user(
             "primary_group": payload.get("primary_group", '')}
 
 
+def can_manage_cache(current_user: dict) -> bool:
+    """缓存失效接口只允许 admin 或有 approve 权限的用户调用"""
+    return current_user['user_code'] == 'admin' or bool(current_user.get('approve'))
+
+
 async def authenticate_user(
-        session: Session,
+        session: AsyncSQLServerSession,
         user_code: str,
         password: str
 ) -> Optional[dict]:
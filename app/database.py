@@ -1,3 +1,7 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
 import yaml
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
@@ -75,14 +79,18 @@ async def get_db():
                 app_logger.error(f"Error closing MySQL session: {e}")
 
 
+# SQL Server 连接池大小；pyodbc 是同步驱动，调用都在专用线程池中执行，线程数与连接数一致
+SQLSERVER_POOL_SIZE = 10
+SQLSERVER_MAX_OVERFLOW = 10
+
 # 创建SQL Server数据库引擎
 try:
     ms_engine = create_engine(
         f'mssql+pyodbc://{sqlserver_config["username"]}:{sqlserver_config["password"]}'
         f'@{sqlserver_config["host"]}:{sqlserver_config["port"]}/{sqlserver_config["name"]}'
         f'?driver=ODBC+Driver+17+for+SQL+Server',
-        pool_size=10,
-        max_overflow=10,
+        pool_size=SQLSERVER_POOL_SIZE,
+        max_overflow=SQLSERVER_MAX_OVERFLOW,
         pool_recycle=3600,
         pool_pre_ping=True
     )
@@ -106,9 +114,41 @@ except Exception as e:
     raise
 
 
+sqlserver_executor = ThreadPoolExecutor(max_workers=SQLSERVER_POOL_SIZE + SQLSERVER_MAX_OVERFLOW,
+                                        thread_name_prefix="sqlserver")
+
+
+class AsyncSQLServerSession:
+    """
+    SQL Server 会话的异步封装
+
+    同步 Session 的每次调用都提交到 sqlserver_executor 执行，事件循环只等待结果，
+    SQL Server 响应慢时不影响其他（MySQL）请求。同一会话内的调用按顺序执行。
+    """
+
+    def __init__(self, session_factory=None):
+        self._session = (session_factory or SQLServerSessionLocal)()
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """在线程池中执行 fn(session, *args, **kwargs)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(sqlserver_executor,
+                                          functools.partial(fn, self._session, *args, **kwargs))
+
+    async def fetchall(self, statement, params: dict = None) -> list:
+        """执行查询并在线程池中取回全部结果行"""
+        return await self.run_sync(lambda session: session.execute(statement, params or {}).fetchall())
+
+    async def fetchone(self, statement, params: dict = None):
+        return await self.run_sync(lambda session: session.execute(statement, params or {}).fetchone())
+
+    async def close(self):
+        await self.run_sync(lambda session: session.close())
+
+
 async def get_sqlserver_db():
-    """获取SQL Server数据库会话"""
-    ms_session = SQLServerSessionLocal()
+    """获取SQL Server数据库会话（AsyncSQLServerSession）"""
+    ms_session = AsyncSQLServerSession()
     try:
         yield ms_session
     except SQLAlchemyError as e:
@@ -119,6 +159,6 @@ async def get_sqlserver_db():
         raise
     finally:
         try:
-            ms_session.close()
+            await ms_session.close()
         except Exception as e:
             app_logger.error(f"Error closing SQL Server session: {e}")
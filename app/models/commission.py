@@ -233,3 +233,34 @@ class CommissionRuleAssignmentModel(Base):
 
     # 可以添加唯一约束确保同一店铺类型和岗位不会重复分配规则
     # __table_args__ = (UniqueConstraint('store_type', 'position_code', name='uq_store_position_rule'),)
+
+
+class CommissionDirtyGroupModel(Base):
+    """
+    待重算的佣金分组
+    考勤/品类销售/门店目标/开店天数变更后记录受影响的 (门店, 财月, 岗位)，增量计算时只重算这些分组
+    position 为 '*' 表示整店重算
+    """
+    __tablename__ = "commissions_dirty_group"
+
+    store_code = Column(String(30), primary_key=True)
+    fiscal_month = Column(String(50), primary_key=True)
+    position = Column(String(100), primary_key=True)
+    reason = Column(String(60))
+    marked_at = Column(DateTime, default=datetime.now)
+
+
+class CommissionStaffSummaryModel(Base):
+    """
+    员工月度佣金汇总：commissions_staff_detail 按 (财月, 门店, 员工, rule_class) 汇总的金额
+    由 CommissionSummaryService 在佣金计算、调整、审批完成时刷新，报表直接按键读取
+    rule_class 为空的规则汇总在 '' 下
+    """
+    __tablename__ = "commissions_staff_summary"
+
+    fiscal_month = Column(String(50), primary_key=True)
+    store_code = Column(String(30), primary_key=True)
+    staff_code = Column(String(30), primary_key=True)
+    rule_class = Column(String(30), primary_key=True)
+    amount = Column(DECIMAL(16, 2))
+    refreshed_at = Column(DateTime, default=datetime.now)
@@ -1,9 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.commission import CommissionStaffCreate, BatchApprovedCommission, FiscalPeriodUpdate, StoreTypeUpdate, \
-    WithdrawnCommission, UpdateOpeningDay
+    WithdrawnCommission, UpdateOpeningDay, BatchCalculateCommission, MonthEndRunCreate
 from app.schemas.target import StaffAttendanceUpdate, StaffPlannedAttendanceUpdate
 from app.services.commission_service import CommissionService, CommissionDataHubService
+from app.services.commission_batch_service import CommissionBatchService
+from app.services.rule_catalog_service import CommissionRuleCatalog
+from app.services.commission_run_service import CommissionRunService
+from app.services.commission_summary_service import CommissionSummaryService
+from app.services.report_cache_service import ReportCache
 from app.database import get_db
 from sqlalchemy.exc import SQLAlchemyError
 from app.core.security import get_current_user
@@ -40,9 +45,10 @@ async def update_commission(attendance_update: StaffAttendanceUpdate,
     try:
         role_code = current_user['user_code']
         if await CommissionService.update_commission(db, attendance_update, role_code):
-            data = await CommissionService.calculate_commissions_for_store(db, attendance_update.store_code,
-                                                                           attendance_update.fiscal_month, role_code)
-            return {"code": 200, "data": data, "msg": "Success"}
+            recalc = await CommissionService.recalculate_dirty_groups(db, attendance_update.store_code,
+                                                                     attendance_update.fiscal_month, role_code)
+            ReportCache.invalidate(attendance_update.fiscal_month)
+            return {"code": 200, "data": True, "recalc": recalc, "msg": "Success"}
         else:
             app_logger.warning(f"An error occurred while fetching targets")
             return {"code": 500, "msg": "An error occurred while fetching targets"}
@@ -54,6 +60,85 @@ async def update_commission(attendance_update: StaffAttendanceUpdate,
         return {"code": 500, "msg": "An error occurred while fetching targets"}
 
 
+@router.post("/batch_calculate")
+async def batch_calculate_commission(request: BatchCalculateCommission,
+                                     db: AsyncSession = Depends(get_db),
+                                     current_user: dict = Depends(get_current_user)):
+    try:
+        role_code = current_user['user_code']
+        data = await CommissionBatchService.calculate_commissions_for_month(db, request.fiscal_month,
+                                                                            request.store_codes, role_code)
+        ReportCache.invalidate(request.fiscal_month)
+        return {"code": 200, "data": data, "msg": "Success"}
+    except SQLAlchemyError as e:
+        app_logger.error(f"batch_calculate_commission Database error: {str(e)}")
+        return {"code": 500, "msg": "Database error occurred while calculating commissions"}
+    except Exception as e:
+        app_logger.error(f"batch_calculate_commission An error occurred: {str(e)}")
+        return {"code": 500, "msg": f"An error occurred while calculating commissions: {str(e)}"}
+
+
+@router.post("/month_end_run")
+async def start_month_end_run(request: MonthEndRunCreate,
+                              current_user: dict = Depends(get_current_user)):
+    try:
+        role_code = current_user['user_code']
+        data = await CommissionRunService.start_month_end_run(request.fiscal_month, request.store_codes,
+                                                              role_code, request.concurrency)
+        return {"code": 200, "data": data, "msg": "Success"}
+    except SQLAlchemyError as e:
+        app_logger.error(f"start_month_end_run Database error: {str(e)}")
+        return {"code": 500, "msg": "Database error occurred while starting month end run"}
+    except Exception as e:
+        app_logger.error(f"start_month_end_run An error occurred: {str(e)}")
+        return {"code": 500, "msg": f"An error occurred while starting month end run: {str(e)}"}
+
+
+@router.get("/month_end_run")
+async def list_month_end_runs(fiscal_month: str = None, current_user: dict = Depends(get_current_user)):
+    return {"code": 200, "data": CommissionRunService.list_runs(fiscal_month)}
+
+
+@router.get("/month_end_run/{run_id}")
+async def get_month_end_run(run_id: str, with_stores: bool = False,
+                            current_user: dict = Depends(get_current_user)):
+    data = CommissionRunService.get_run(run_id, with_stores)
+    if data is None:
+        return {"code": 404, "msg": f"Run {run_id} not found"}
+    return {"code": 200, "data": data}
+
+
+@router.post("/rule_catalog/refresh")
+async def refresh_rule_catalog(db: AsyncSession = Depends(get_db),
+                               current_user: dict = Depends(get_current_user)):
+    try:
+        CommissionRuleCatalog.invalidate()
+        catalog = await CommissionRuleCatalog.get(db)
+        return {"code": 200, "data": {"rules": len(catalog.rules), "assignments": len(catalog.assignments)},
+                "msg": "Success"}
+    except SQLAlchemyError as e:
+        app_logger.error(f"refresh_rule_catalog Database error: {str(e)}")
+        return {"code": 500, "msg": "Database error occurred while refreshing rule catalog"}
+
+
+@router.post("/summary/refresh")
+async def refresh_commission_summary(fiscal_month: str, db: AsyncSession = Depends(get_db),
+                                     current_user: dict = Depends(get_current_user)):
+    try:
+        await CommissionSummaryService.refresh(db, fiscal_month)
+        await db.commit()
+        ReportCache.invalidate(fiscal_month)
+        return {"code": 200, "msg": "Success"}
+    except SQLAlchemyError as e:
+        await db.rollback()
+        app_logger.error(f"refresh_commission_summary Database error: {str(e)}")
+        return {"code": 500, "msg": "Database error occurred while refreshing commission summary"}
+    except Exception as e:
+        await db.rollback()
+        app_logger.error(f"refresh_commission_summary Exception: {str(e)}")
+        return {"code": 500, "msg": f"An error occurred while refreshing commission summary: {str(e)}"}
+
+
 @router.get("/list")
 async def get_commissions_by_key(fiscal_month: str, key_word: str = None, status: str = 'All',
                                  db: AsyncSession = Depends(get_db),
@@ -116,6 +201,7 @@ async def update_planned_attendance(request: StaffPlannedAttendanceUpdate,
             request.planned_attendance
         )
         if result:
+            ReportCache.invalidate(request.fiscal_month)
             return {"code": 200, "msg": "Planned attendance updated successfully"}
         else:
             return {"code": 404, "msg": "Staff record not found"}
@@ -179,6 +265,7 @@ async def delete_adjustment(fiscal_month: str, store_code: str, staff_code: str,
         # 调用服务层删除调整记录
         result = await CommissionService.delete_adjustment(db, fiscal_month, store_code, staff_code)
         if result:
+            ReportCache.invalidate(fiscal_month)
             return {"code": 200, "msg": "Adjustment deleted successfully"}
         else:
             return {"code": 404, "msg": "No adjustment found for the given parameters"}
@@ -194,6 +281,7 @@ async def delete_adjustment(fiscal_month: str, store_code: str, staff_code: str,
 async def add_adjustment(add_adjustment: CommissionStaffCreate, db: AsyncSession = Depends(get_db)):
     try:
         data = await CommissionService.create_add_adjustment(db, add_adjustment)
+        ReportCache.invalidate(add_adjustment.fiscal_month)
         return {"code": 200, "data": data, "msg": "Success"}
 
     except SQLAlchemyError as e:
@@ -209,6 +297,7 @@ async def update_opening_day(request: UpdateOpeningDay, db: AsyncSession = Depen
     try:
         data = await CommissionService.update_opening_day(db, request.fiscal_month, request.store_code,
                                                           request.opening_days)
+        ReportCache.invalidate(request.fiscal_month)
         return {"code": 200, "data": data, "msg": "Success"}
 
     except SQLAlchemyError as e:
@@ -224,6 +313,7 @@ async def batch_audit_commission(request: BatchApprovedCommission, db: AsyncSess
         result = await CommissionService.batch_approved_commission_by_store_codes(
             db, request, role_code
         )
+        ReportCache.invalidate(request.fiscal_month)
         return {"code": 200, "data": result, "msg": f"Successfully {request.status} commissions"}
     except ValueError as e:
         return {"code": 404, "msg": str(e)}
@@ -240,6 +330,7 @@ async def withdrawn_commission(request: WithdrawnCommission, db: AsyncSession =
         result = await CommissionService.withdrawn_commission(request.fiscal_month, request.store_code,
                                                               db
                                                               )
+        ReportCache.invalidate(request.fiscal_month)
         return {"code": 200, "data": result, "msg": f"Successfully withdrawn commission"}
     except ValueError as e:
         return {"code": 404, "msg": str(e)}
@@ -252,6 +343,7 @@ async def update_store_type(request: StoreTypeUpdate, db: AsyncSession = Depends
         result = await CommissionService.update_store_type(
             db, request.fiscal_month, request.store_code, request.store_type
         )
+        ReportCache.invalidate(request.fiscal_month)
         return {"code": 200, "data": result, "msg": f"Successfully updated store type"}
     except ValueError as e:
         app_logger.error(f"update_store_type An error occurred while fetching targets: {str(e)}")
@@ -265,6 +357,7 @@ async def up_fiscal_period(request: FiscalPeriodUpdate, db: AsyncSession = Depen
         result = await CommissionService.update_fiscal_period(
             db, request.fiscal_month, request.store_code, request.fiscal_period
         )
+        ReportCache.invalidate(request.fiscal_month)
         return {"code": 200, "data": result, "msg": f"Successfully updated fiscal period"}
     except ValueError as e:
         app_logger.error(f"update_fiscal_period An error occurred while fetching targets: {str(e)}")
@@ -281,6 +374,7 @@ async def add_month_end(fiscal_month: str, db: AsyncSession = Depends(get_db),
     try:
         role_code = current_user['user_code']
         result = await CommissionService.add_month_end(db, fiscal_month, role_code)
+        ReportCache.invalidate(fiscal_month)
         return {"code": 200, "data": result, "msg": "Month end record created/updated successfully"}
     except SQLAlchemyError as e:
         app_logger.error(f"add_month_end Database error: {str(e)}")
@@ -5,6 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 
 from app.services.dimension_service import DimensionService
+from app.services.fiscal_calendar_service import FiscalCalendar
 
 router = APIRouter()
 
@@ -85,3 +86,15 @@ async def get_document_status(template_type: str = "target"):
         return {"code": 200, "data": data}
     except Exception as e:
         return {"message": str(e)}
+
+
+@router.post("/fiscal_calendar/refresh")
+async def refresh_fiscal_calendar(db: AsyncSession = Depends(get_db)):
+    """维护 dimension_dayweek 后立即重新加载进程内财历"""
+    try:
+        FiscalCalendar.invalidate()
+        calendar = await FiscalCalendar.get(db)
+        return {"code": 200, "data": {"days": len(calendar.days), "months": len(calendar.month_ranges)},
+                "msg": "Success"}
+    except SQLAlchemyError as e:
+        return {"code": 500, "msg": str(e)}
@@ -1,16 +1,16 @@
 # routes/excel_upload.py
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Iterable, AsyncIterable
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from pydantic import BaseModel
-from sqlalchemy import delete, text, select,update
+from sqlalchemy import delete, text, select,update, func
+from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 import pandas as pd
-import io
+import os
 
 from app.database import get_db
-from app.models.dimension import DimensionDayWeek
 from app.models.dimension import ProductSku, ProductCategory
 from app.models.sales import ECSalesModel
 from app.models.staff import StaffAttendanceModel
@@ -18,16 +18,28 @@ from app.models.target import TargetStoreMain
 from app.services.budget_service import BudgetService
 from app.services.target_service import TargetStoreService, StaffTargetCalculator
 from app.models.commission import StaffSalesCategory
+from app.services.commission_dirty_service import CommissionDirtyService
+from app.services.excel_import_job_service import ExcelImportJobService
+from app.services.fiscal_calendar_service import FiscalCalendar
+from app.services.report_cache_service import ReportCache
+from app.utils.excel_reader import (EXCEL_PREVIEW_ROWS, spool_upload, aiter_excel_chunks, read_excel_columns,
+                                     read_excel_preview)
 from app.utils.logger import app_logger
 from decimal import Decimal
 
 router = APIRouter(prefix="/excel", tags=["excel"])
 
+# 批量写入时每条语句的行数
+IMPORT_CHUNK_SIZE = 1000
+# 支持导入的数据类型
+IMPORT_DATA_TYPES = ('target', 'budget', 'ec_sales')
+
 
 class ExcelPreviewResponse(BaseModel):
     data_type: str
     preview_data: List[Dict[str, Any]]
     total_rows: int
+    total_rows_estimated: bool = False  # total_rows 取自工作表范围，可能包含空行
     columns: List[str]
     errors: List[str]
 
@@ -79,12 +91,73 @@ def parse_datetime_field(value) -> datetime:
     return None
 
 
+def _chunked(items: list, size: int = IMPORT_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _ec_column(df: pd.DataFrame, name: str, alias: str, default=None) -> pd.Series:
+    """按中文列名或英文列名取列，都不存在时返回默认值"""
+    if name in df.columns:
+        return df[name]
+    if alias in df.columns:
+        return df[alias]
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _ec_text(series: pd.Series, length: int, nullable: bool = True) -> pd.Series:
+    """转为字符串并截断，空值为 None（nullable=False 时为空字符串）"""
+    values = series.astype(object).where(series.notna(), '').astype(str).str.slice(0, length)
+    if nullable:
+        return values.where(values != '', None)
+    return values
+
+
+def _ec_number(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, errors='coerce').fillna(0)
+
+
+def _ec_flag(series: pd.Series) -> pd.Series:
+    return series.where(series.notna(), False).astype(bool)
+
+
+async def _async_chunks(chunks: Iterable[pd.DataFrame]) -> AsyncIterable[pd.DataFrame]:
+    for df in chunks:
+        yield df
+
+
 class ExcelImportService:
     """Excel导入服务类"""
 
+    @staticmethod
+    async def import_file_chunks(data_type: str, chunks: AsyncIterable[pd.DataFrame],
+                                 db: AsyncSession) -> ImportResult:
+        """按数据类型导入数据块，导入后（包括部分成功）使报表缓存失效"""
+        try:
+            # 目标、预算导入会先把整个财月清零，必须收集全部数据块后一次写入
+            if data_type == 'target':
+                target_updates = [update_data async for df in chunks
+                                  for update_data in ExcelImportService._target_updates(df)]
+                return await ExcelImportService.apply_target_updates(db, target_updates)
+            if data_type == 'budget':
+                budget_updates = [update_data async for df in chunks
+                                  for update_data in ExcelImportService._budget_updates(df)]
+                return await ExcelImportService.apply_budget_updates(db, budget_updates)
+            if data_type == 'ec_sales':
+                return await ExcelImportService.import_ec_sales_chunks(chunks, db)
+            raise ValueError(f"无法识别的数据类型: {data_type}")
+        finally:
+            # 导入数据可能跨多个财月
+            ReportCache.invalidate()
+
     @staticmethod
     async def import_target_data(df: pd.DataFrame, db: AsyncSession) -> ImportResult:
         """导入目标数据"""
+        return await ExcelImportService.apply_target_updates(db, ExcelImportService._target_updates(df))
+
+    @staticmethod
+    def _target_updates(df: pd.DataFrame) -> list:
+        """解析目标数据行"""
         target_updates = []
 
         for _, row in df.iterrows():
@@ -98,7 +171,11 @@ class ExcelImportService:
                     'fiscal_month': str(fiscal_month),
                     'target_value': float(target_value) if target_value else 0
                 })
+        return target_updates
 
+    @staticmethod
+    async def apply_target_updates(db: AsyncSession, target_updates: list) -> ImportResult:
+        """写入门店目标并重新分配员工目标"""
         updated_targets = await TargetStoreService.batch_update_target_value(db, target_updates)
 
         await ExcelImportService._recalculate_staff_targets(db, target_updates)
@@ -113,52 +190,22 @@ class ExcelImportService:
     @staticmethod
     async def _recalculate_staff_targets(db: AsyncSession, target_updates: list):
         """
-        当门店目标值更新后，重新计算相关员工的目标值
+        当门店目标值更新后，重新计算相关员工的目标值（全部门店一次批量分配）
         """
-        for update_data in target_updates:
-            store_code = update_data.get('store_code')
-            fiscal_month = update_data.get('fiscal_month')
-            store_target_value = update_data.get('target_value')
-
-            # 获取该门店该财月的所有员工考勤记录
-            result = await db.execute(
-                select(StaffAttendanceModel)
-                    .where(
-                    StaffAttendanceModel.store_code == store_code,
-                    StaffAttendanceModel.fiscal_month == fiscal_month
-                )
-            )
-            staff_attendances = result.scalars().all()
-
-            if not staff_attendances:
-                continue
-
-            # 提取所有员工的比例
-            ratios = [attendance.target_value_ratio for attendance in staff_attendances if
-                      attendance.target_value_ratio is not None]
-
-            # 如果没有比例数据，跳过计算
-            if not ratios:
-                continue
-
-            # 使用工具类计算新的员工目标值
-            new_staff_targets = StaffTargetCalculator.calculate_staff_targets(store_target_value, ratios)
-
-            # 更新每个员工的目标值
-            for i, attendance in enumerate(staff_attendances):
-                if i < len(new_staff_targets):
-                    attendance.target_value = new_staff_targets[i]
-                    attendance.updated_at = datetime.now()
-
-            await db.commit()
-
-            # 刷新对象
-            for attendance in staff_attendances:
-                await db.refresh(attendance)
+        store_targets = {
+            (update_data.get('store_code'), update_data.get('fiscal_month')): update_data.get('target_value')
+            for update_data in target_updates
+        }
+        await StaffTargetCalculator.redistribute_staff_targets(db, store_targets)
 
     @staticmethod
     async def import_budget_data(df: pd.DataFrame, db: AsyncSession) -> ImportResult:
         """导入预算数据"""
+        return await ExcelImportService.apply_budget_updates(db, ExcelImportService._budget_updates(df))
+
+    @staticmethod
+    def _budget_updates(df: pd.DataFrame) -> list:
+        """解析预算数据行"""
         budget_updates = []
 
         for _, row in df.iterrows():
@@ -172,7 +219,11 @@ class ExcelImportService:
                     'fiscal_month': str(fiscal_month),
                     'budget_value': budget_value if budget_value else 0
                 })
+        return budget_updates
 
+    @staticmethod
+    async def apply_budget_updates(db: AsyncSession, budget_updates: list) -> ImportResult:
+        """写入门店预算"""
         updated_budgets = await BudgetService.batch_update_budget_value(db, budget_updates)
 
         return ImportResult(
@@ -184,38 +235,119 @@ class ExcelImportService:
 
     @staticmethod
     async def import_ec_sales_data(df: pd.DataFrame, db: AsyncSession) -> ImportResult:
-        """导入电商销售数据"""
-        processed_count = 0
-        error_count = 0
-        errors = []
+        """导入电商销售数据（整表）"""
+        return await ExcelImportService.import_ec_sales_chunks(_async_chunks([df]), db)
+
+    @staticmethod
+    async def import_ec_sales_chunks(chunks: AsyncIterable[pd.DataFrame], db: AsyncSession) -> ImportResult:
+        """
+        分块导入电商销售数据
+
+        每块在 pandas 中完成列映射、SKU 品类匹配、付款周 -> 财月关联，订单直接写入 ec_sales；
+        员工/门店/品类汇总跨块累加，全部块处理完后统一重置并写入。
+        写入使用分批的 INSERT ... ON DUPLICATE KEY UPDATE，全部在一个事务中提交。
 
+        Args:
+            chunks: 数据块，索引为 Excel 数据行号
+            db: 数据库会话
+
+        Returns:
+            ImportResult: 导入结果
+        """
+        state = {
+            "processed_count": 0,
+            "error_count": 0,
+            "row_errors": [],
+            "warning_data": [],
+            "sku_to_level_code_4": {},
+            "level_code_4_to_level_value_1": {},
+            "missing_sku_set": set(),
+            "no_category_sku_set": set(),
+            "calendar_frame": None,
+            "order_ids": set(),
+            "ec_sales_summary": {},
+            "ec_sales_category_summary": {},
+        }
+
+        def result_errors():
+            errors = []
+            if state["missing_sku_set"]:
+                errors.append(
+                    f"以下商品SKU编码在系统中不存在({len(state['missing_sku_set'])}个): "
+                    f"{', '.join(list(state['missing_sku_set'])[:20])}"
+                )
+            if state["no_category_sku_set"]:
+                errors.append(
+                    f"以下商品SKU未关联商品品类({len(state['no_category_sku_set'])}个): "
+                    f"{', '.join(list(state['no_category_sku_set'])[:20])}"
+                )
+            return errors + state["row_errors"]
+
+        try:
+            async for df in chunks:
+                records = await ExcelImportService._prepare_ec_chunk(df, db, state)
+                await ExcelImportService._write_ec_records(db, records, state)
+
+            await ExcelImportService._write_ec_summaries(db, state)
+            await db.commit()
+
+            warning_data = state["warning_data"]
+            return ImportResult(
+                success=True,
+                message="成功导入电商销售数据" if not warning_data else "成功导入电商销售数据，但存在警告",
+                data_type="ec_sales",
+                warning_table=warning_data,
+                rows_processed=state["processed_count"],
+                rows_with_errors=state["error_count"],
+                errors=result_errors()[:10]
+            )
+        except Exception as e:
+            await db.rollback()
+            errors = result_errors()
+            errors.append(f"数据库提交失败: {str(e)}")
+            return ImportResult(
+                success=False,
+                message=f"导入电商销售数据失败: {str(e)}",
+                data_type="ec_sales",
+                rows_processed=state["processed_count"],
+                rows_with_errors=state["error_count"] + 1,
+                errors=errors[:10]
+            )
+
+    @staticmethod
+    async def _prepare_ec_chunk(df: pd.DataFrame, db: AsyncSession, state: dict) -> pd.DataFrame:
+        """校验并映射一个数据块，累加线上销售汇总，返回待写入 ec_sales 的记录"""
         sku_column = '商品SKU编码' if '商品SKU编码' in df.columns else 'product_sku'
-        unique_skus = df[sku_column].dropna().astype(str).str.strip().unique()
-        unique_skus = [s for s in unique_skus if s]
+        skus = _ec_column(df, sku_column, sku_column)
+        skus = skus.where(skus.notna(), '').astype(str).str.strip()
 
-        warning_data = []
+        sku_to_level_code_4 = state["sku_to_level_code_4"]
+        level_code_4_to_level_value_1 = state["level_code_4_to_level_value_1"]
+        level_value_1 = pd.Series('', index=df.index, dtype=object)
 
+        unique_skus = [s for s in skus.unique() if s]
         if unique_skus:
-            sku_query = select(ProductSku.upc, ProductSku.sku_code, ProductSku.level_code_4).where(
-                ProductSku.upc.in_(unique_skus)
-            )
-            sku_result = await db.execute(sku_query)
-            sku_to_level_code_4 = {row[0]: row[2] for row in sku_result.fetchall()}
+            # 只查询前面数据块中没有出现过的 SKU
+            known_skus = state["missing_sku_set"] | sku_to_level_code_4.keys()
+            new_skus = [s for s in unique_skus if s not in known_skus]
+            new_level_code_4_values = set()
+            for sku_chunk in _chunked(new_skus):
+                sku_result = await db.execute(
+                    select(ProductSku.upc, ProductSku.level_code_4).where(ProductSku.upc.in_(sku_chunk))
+                )
+                for upc, level_code_4 in sku_result.fetchall():
+                    sku_to_level_code_4[upc] = level_code_4
+                    if level_code_4 and level_code_4 not in level_code_4_to_level_value_1:
+                        new_level_code_4_values.add(level_code_4)
 
-            level_code_4_values = set(v for v in sku_to_level_code_4.values() if v)
-            if level_code_4_values:
+            if new_level_code_4_values:
                 cat_query = select(
                     ProductCategory.level_code_4, ProductCategory.level_value_1
                 ).where(
-                    ProductCategory.level_code_4.in_(level_code_4_values)
+                    ProductCategory.level_code_4.in_(new_level_code_4_values)
                 ).distinct()
                 cat_result = await db.execute(cat_query)
-                cat_rows = cat_result.fetchall()
-                valid_level_code_4_set = {row[0] for row in cat_rows}
-                level_code_4_to_level_value_1 = {row[0]: row[1] for row in cat_rows}
-            else:
-                valid_level_code_4_set = set()
-                level_code_4_to_level_value_1 = {}
+                level_code_4_to_level_value_1.update({row[0]: row[1] for row in cat_result.fetchall()})
 
             missing_sku_set = set()
             no_category_sku_set = set()
@@ -224,369 +356,297 @@ class ExcelImportService:
                     missing_sku_set.add(sku)
                 else:
                     level_code_4 = sku_to_level_code_4.get(sku)
-                    if not level_code_4 or level_code_4 not in valid_level_code_4_set:
+                    if not level_code_4 or level_code_4 not in level_code_4_to_level_value_1:
                         no_category_sku_set.add(sku)
+            state["missing_sku_set"].update(missing_sku_set)
+            state["no_category_sku_set"].update(no_category_sku_set)
 
             if missing_sku_set or no_category_sku_set:
-                warning_rows = []
-                for index, row in df.iterrows():
-                    sku_val = str(row.get(sku_column, '') or '').strip()
-                    if sku_val in missing_sku_set:
-                        row_data = row.to_dict()
-                        row_data = {'匹配状态': '未匹配到商品', **row_data}
-                        warning_rows.append(row_data)
-                    elif sku_val in no_category_sku_set:
-                        row_data = row.to_dict()
-                        row_data = {'匹配状态': '未匹配到商品分类', **row_data}
-                        warning_rows.append(row_data)
-
-                warning_data = warning_rows
-
-                error_messages = []
-                if missing_sku_set:
-                    error_messages.append(
-                        f"以下商品SKU编码在系统中不存在({len(missing_sku_set)}个): {', '.join(list(missing_sku_set)[:20])}"
-                    )
-                if no_category_sku_set:
-                    error_messages.append(
-                        f"以下商品SKU未关联商品品类({len(no_category_sku_set)}个): {', '.join(list(no_category_sku_set)[:20])}"
-                    )
-                errors.extend(error_messages)
-
-            df['_level_value_1'] = df[sku_column].astype(str).str.strip().map(
+                match_status = pd.Series('', index=df.index, dtype=object)
+                match_status[skus.isin(no_category_sku_set)] = '未匹配到商品分类'
+                match_status[skus.isin(missing_sku_set)] = '未匹配到商品'
+                warning_rows = df.loc[match_status != '']
+                warning_rows.insert(0, '匹配状态', match_status[match_status != ''])
+                state["warning_data"].extend(warning_rows.to_dict('records'))
+
+            level_value_1 = skus.map(
                 lambda upc: level_code_4_to_level_value_1.get(sku_to_level_code_4.get(upc, ''), '')
             )
-        # 收集所有订单号用于批量删除
         app_logger.debug(f"开始处理电商销售数据{df.head()}")
-        order_ids = set()
-        valid_rows = []
 
-        # 第一步：验证数据并收集订单ID
-        for index, row in df.iterrows():
-            try:
-                order_id = row.get('订单号') or row.get('order_id')
-                if not order_id:
-                    errors.append(f"第{index + 1}行: 订单号为空")
-                    error_count += 1
-                    continue
-
-                order_ids.add(str(order_id))
-                valid_rows.append((index, row))
-
-            except Exception as e:
-                errors.append(f"第{index + 1}行处理出错: {str(e)}")
-                error_count += 1
-                continue
-
-        # 第二步：删除已存在的记录
-        if order_ids:
-            stmt = delete(ECSalesModel).where(
-                ECSalesModel.order_id.in_(list(order_ids))
-            )
-            await db.execute(stmt)
-
-        # 第三步：批量插入新数据
-        records_to_add = []
-        ec_sales_summary = {}
-        ec_sales_category_summary = {}
-        for index, row in valid_rows:
-            try:
-                # 提取并处理字段数据
-                order_id = str(row.get('订单号') or row.get('order_id'))
-                is_return = bool(row.get('是否退货', row.get('is_return', False)))
-                recipient_name = str(row.get('收件人姓名', row.get('recipient_name', '')))[:60] or None
-                order_source = str(row.get('订单来源', row.get('order_source', '')))[:30] or None
-                payment_method = str(row.get('支付方式', row.get('payment_method', '')))[:30] or None
-                order_status = str(row.get('订单状态', row.get('order_status', '')))[:30] or None
-                quantity = int(row.get('数量', row.get('quantity', 0)) or 0)
-                product_code = str(row.get('商品编码', row.get('product_code', '')))[:30] or None
-                product_sku = str(row.get('商品SKU编码', row.get('product_sku', '')))[:30] or ''
-                product_name = str(row.get('商品名称', row.get('product_name', '')))[:80] or None
-                product_size = str(row.get('商品尺码', row.get('product_size', '')))[:30] or None
-                total_amount_with_tax = row.get('订单含税金额', row.get('total_amount_tax', 0.0)) or 0.0
-                total_amount = row.get('订单不含税金额', row.get('total_amount', 0.0)) or 0.0
-                staff_code = str(row.get('员工ID', row.get('staff_code', '')))[:30] or ''
-                store_code = str(row.get('门店ID', row.get('store_code', '')))[:30] or ''
-                area = str(row.get('Area', row.get('area', '')))[:30] or None
-                week = row.get('Week') or row.get('week')
-                year = row.get('年份') or row.get('year')
-                is_wechat = bool(row.get('是否企微', row.get('is_wechat', False)))
-
-                # 处理时间字段
-                payment_time = parse_datetime_field(row.get('付款时间') or row.get('payment_time'))
-                # shipping_time = parse_datetime_field(row.get('发货时间') or row.get('退货时间') or row.get('shipping_time'))
-
-                # 创建记录对象
-                record = ECSalesModel(
-                    order_id=order_id,
-                    is_return=is_return,
-                    recipient_name=recipient_name,
-                    order_source=order_source,
-                    payment_method=payment_method,
-                    order_status=order_status,
-                    quantity=quantity,
-                    product_code=product_code,
-                    product_sku=product_sku,
-                    product_name=product_name,
-                    product_size=product_size,
-                    total_amount_with_tax=total_amount_with_tax,
-                    total_amount=total_amount,
-                    staff_code=staff_code,
-                    store_code=store_code,
-                    area=area,
-                    payment_time=payment_time,
-                    # shipping_time=shipping_time,
-                    week=week,
-                    year=year,
-                    is_wechat=is_wechat
-                )
-
-                records_to_add.append(record)
-                processed_count += 1
-
-                # 如果有付款时间，则计算财月并汇总线上销售数据
-                if payment_time and staff_code and store_code and week and year:
-                    # 格式化付款时间为年月日格式
-                    # payment_date_str = payment_time.strftime('%Y-%m-%d')
-
-                    # 根据付款日期查找财月
-                    query = select(DimensionDayWeek.fiscal_month).where(
-                        DimensionDayWeek.week_number == week,
-                        DimensionDayWeek.finance_year == year
-                    )
-                    result = await db.execute(query)
-                    fiscal_month_result = result.fetchone()
-
-                    if fiscal_month_result:
-                        fiscal_month = fiscal_month_result[0]
-
-                        # 汇总线上销售数据
-                        key = (staff_code, store_code, fiscal_month)
-                        total_amount = Decimal(str(total_amount))
-                        if key in ec_sales_summary:
-                            ec_sales_summary[key] += total_amount
-                        else:
-                            ec_sales_summary[key] = total_amount
-
-                        # 按品类维度汇总线上销售数据
-                        level_value_1 = str(row.get('_level_value_1', '') or '').strip()
-                        # app_logger.debug(f"商品品类: {level_value_1}")
-                        if level_value_1:
-                            cat_key = (staff_code, store_code, fiscal_month, level_value_1)
-                            if cat_key in ec_sales_category_summary:
-                                ec_sales_category_summary[cat_key] += Decimal(str(total_amount))
-                            else:
-                                ec_sales_category_summary[cat_key] = Decimal(str(total_amount))
-
-            except Exception as e:
-                errors.append(f"第{index + 1}行处理出错: {str(e)}")
-                error_count += 1
-                continue
-        try:
-            # 批量添加记录
-            if records_to_add:
-                db.add_all(records_to_add)
-
-            # 提交事务
-            await db.commit()
-
-            updated_attendances = 0
-
-            store_sales_summary = {}
-
-            fiscal_months = set([fiscal_month for (_, _, fiscal_month) in ec_sales_summary.keys()])
-            if fiscal_months:
-                app_logger.debug(f"重置以下财月的员工电商销售数据: {fiscal_months}")
-                # 查询这些财月的所有员工考勤记录
-                reset_stmt = select(StaffAttendanceModel).where(
-                    StaffAttendanceModel.fiscal_month.in_(list(fiscal_months))
-                )
-                reset_result = await db.execute(reset_stmt)
-                reset_records = reset_result.scalars().all()
+        # 订单号为空的行不导入
+        order_ids = _ec_column(df, '订单号', 'order_id')
+        order_ids = order_ids.where(order_ids.notna(), '').astype(str)
+        missing_order = order_ids.str.strip() == ''
+        # 结果中只返回前 10 条错误
+        error_slots = 10 - len(state["row_errors"])
+        if error_slots > 0:
+            state["row_errors"].extend(
+                f"第{index + 1}行: 订单号为空" for index in df.index[missing_order][:error_slots])
+        state["error_count"] += int(missing_order.sum())
+
+        valid = df.loc[~missing_order]
+        state["processed_count"] += len(valid)
+
+        # 列映射
+        week = pd.to_numeric(_ec_column(valid, 'Week', 'week'), errors='coerce').astype('Int64')
+        year = pd.to_numeric(_ec_column(valid, '年份', 'year'), errors='coerce').astype('Int64')
+        payment_time = _ec_column(valid, '付款时间', 'payment_time')
+        if not pd.api.types.is_datetime64_any_dtype(payment_time):
+            payment_time = payment_time.map(parse_datetime_field)
+
+        records = pd.DataFrame({
+            'order_id': order_ids[~missing_order].str.slice(0, 60),
+            'is_return': _ec_flag(_ec_column(valid, '是否退货', 'is_return', False)),
+            'recipient_name': _ec_text(_ec_column(valid, '收件人姓名', 'recipient_name'), 60),
+            'order_source': _ec_text(_ec_column(valid, '订单来源', 'order_source'), 30),
+            'payment_method': _ec_text(_ec_column(valid, '支付方式', 'payment_method'), 30),
+            'order_status': _ec_text(_ec_column(valid, '订单状态', 'order_status'), 30),
+            'quantity': _ec_number(_ec_column(valid, '数量', 'quantity', 0)).astype(int),
+            'product_code': _ec_text(_ec_column(valid, '商品编码', 'product_code'), 30),
+            'product_sku': _ec_text(_ec_column(valid, '商品SKU编码', 'product_sku'), 30, nullable=False),
+            'product_name': _ec_text(_ec_column(valid, '商品名称', 'product_name'), 80),
+            'product_size': _ec_text(_ec_column(valid, '商品尺码', 'product_size'), 30),
+            'total_amount_with_tax': _ec_number(_ec_column(valid, '订单含税金额', 'total_amount_tax', 0.0)),
+            'total_amount': _ec_number(_ec_column(valid, '订单不含税金额', 'total_amount', 0.0)),
+            'staff_code': _ec_text(_ec_column(valid, '员工ID', 'staff_code'), 30, nullable=False),
+            'store_code': _ec_text(_ec_column(valid, '门店ID', 'store_code'), 30, nullable=False),
+            'area': _ec_text(_ec_column(valid, 'Area', 'area'), 30),
+            'payment_time': payment_time,
+            'week': _ec_text(week, 30),
+            'year': _ec_text(year, 30),
+            'is_wechat': _ec_flag(_ec_column(valid, '是否企微', 'is_wechat', False)),
+        }, index=valid.index)
+
+        # 付款周关联财月，按员工和品类汇总线上销售
+        sales = pd.DataFrame({
+            'staff_code': records['staff_code'],
+            'store_code': records['store_code'],
+            'week': week,
+            'year': year,
+            'total_amount': records['total_amount'],
+            'level_value_1': level_value_1[valid.index].where(level_value_1[valid.index].notna(), '')
+                .astype(str).str.strip(),
+        })
+        sales = sales[payment_time.notna() & (sales['staff_code'] != '') & (sales['store_code'] != '')
+                      & sales['week'].notna() & sales['year'].notna()]
+        if sales.empty:
+            return records
+
+        # (周数, 财年) -> 财月 取自进程内财历，每次导入只构建一次
+        calendar_frame = state["calendar_frame"]
+        if calendar_frame is None:
+            calendar = await FiscalCalendar.get(db)
+            calendar_frame = pd.DataFrame(
+                [(week_number, finance_year, fiscal_month)
+                 for (week_number, finance_year), fiscal_month in calendar.week_months.items()],
+                columns=['week', 'year', 'fiscal_month']
+            ).astype({'week': 'Int64', 'year': 'Int64'})
+            state["calendar_frame"] = calendar_frame
+        sales = sales.merge(calendar_frame, on=['week', 'year'], how='inner')
+
+        # 金额按 Decimal 累加，与逐行汇总结果一致
+        sales['total_amount'] = sales['total_amount'].map(lambda value: Decimal(str(value)))
+        ec_sales_summary = state["ec_sales_summary"]
+        for key, value in sales.groupby(
+                ['staff_code', 'store_code', 'fiscal_month'], sort=False)['total_amount'].sum().items():
+            ec_sales_summary[key] = ec_sales_summary.get(key, Decimal('0')) + value
+        ec_sales_category_summary = state["ec_sales_category_summary"]
+        category_sales = sales[sales['level_value_1'] != '']
+        for key, value in category_sales.groupby(
+                ['staff_code', 'store_code', 'fiscal_month', 'level_value_1'], sort=False)['total_amount'].sum().items():
+            ec_sales_category_summary[key] = ec_sales_category_summary.get(key, Decimal('0')) + value
+        return records
 
-                # 重置所有相关记录的电商销售数据
-                for record in reset_records:
-                    record.sales_value_ec = Decimal('0')
-                    # 销售总额设为线下销售额(如果没有则为0)
-                    record.sales_value = Decimal(str(record.sales_value_store or 0))
-
-                reset_store_stmt = select(TargetStoreMain).where(
-                    TargetStoreMain.fiscal_month.in_(list(fiscal_months))
-                )
-                reset_store_result = await db.execute(reset_store_stmt)
-                reset_store_records = reset_store_result.scalars().all()
-
-                # 重置所有相关门店记录的电商销售数据
-                for record in reset_store_records:
-                    record.sales_value_ec = Decimal('0')
-                    # 销售总额设为线下销售额(如果没有则为0)
-                    record.sales_value = Decimal(str(record.sales_value_store or 0))
-
-                # 提交重置操作
-                await db.commit()
-                app_logger.debug(f"已重置 {len(reset_records)} 条员工考勤记录")
-
-            for (staff_code, store_code, fiscal_month), sales_value_ec in ec_sales_summary.items():
-                # 更新或创建员工考勤记录
-                query = select(StaffAttendanceModel).where(
-                    StaffAttendanceModel.staff_code == staff_code,
-                    StaffAttendanceModel.store_code == store_code,
-                    StaffAttendanceModel.fiscal_month == fiscal_month
-                )
-                result = await db.execute(query)
-                attendance_record = result.scalar_one_or_none()
-
-                if attendance_record:
-                    # 如果记录存在，更新线上销售金额
-                    attendance_record.sales_value_ec = Decimal(str(sales_value_ec))
-                    attendance_record.sales_value = round((Decimal(
-                        str(attendance_record.sales_value_store)) if attendance_record.sales_value_store else Decimal(
-                        '0')) + Decimal(str(sales_value_ec)))
-                    updated_attendances += 1
-                else:
-                    app_logger.warning(
-                        f"未找到员工考勤记录，将创建新的记录: staff_code={staff_code}, store_code={store_code}, fiscal_month={fiscal_month}")
-
-                    new_attendance_record = StaffAttendanceModel(
-                        staff_code=staff_code,
-                        store_code=store_code,
-                        fiscal_month=fiscal_month,
-                        sales_value_ec=Decimal(str(sales_value_ec)),
-                        sales_value=round(Decimal(str(sales_value_ec))),  # 初始总销售额等于电商销售额
-                        deletable=True,
-                        created_at=datetime.now()
-                        # 其他必要字段需要根据业务需求设置默认值
-                    )
-                    db.add(new_attendance_record)
-                    updated_attendances += 1
-
-                store_key = (store_code, fiscal_month)
-                if store_key in store_sales_summary:
-                    store_sales_summary[store_key] += sales_value_ec
-                else:
-                    store_sales_summary[store_key] = sales_value_ec
-
-            # 更新门店目标表中的电商销售数据
-            for (store_code, fiscal_month), total_sales_value_ec in store_sales_summary.items():
-                # 查询现有的门店目标记录
-                query = select(TargetStoreMain).where(
-                    TargetStoreMain.store_code == store_code,
-                    TargetStoreMain.fiscal_month == fiscal_month
-                )
-                result = await db.execute(query)
-                target_store_record = result.scalar_one_or_none()
-
-                if target_store_record:
-                    # 更新电商销售金额和总销售金额
-                    target_store_record.sales_value_ec = Decimal(str(total_sales_value_ec))
-                    # 统一使用 Decimal 类型进行计算
-                    store_sales_value = Decimal(str(target_store_record.sales_value_store or 0))
-                    ec_sales_value = Decimal(str(total_sales_value_ec))
-                    target_store_record.sales_value = round(store_sales_value + ec_sales_value)
-                else:
-                    app_logger.warning(
-                        f"未找到门店目标记录: store_code={store_code}, fiscal_month={fiscal_month}")
-
-            # 提交员工考勤更新和门店目标更新
-            if ec_sales_summary:
-                await db.commit()
-                app_logger.debug(f"已保存 {len(ec_sales_summary)} 条员工电商销售数据")
-
-            # app_logger.debug(f"已更新 {updated_attendances} 条员工考勤记录")
-            if ec_sales_category_summary:
-                category_fiscal_months = set(k[2] for k in ec_sales_category_summary.keys())
-
-                app_logger.debug(f"将重置以下财月的员工品类电商销售数据: {category_fiscal_months}")
+    @staticmethod
+    async def _write_ec_records(db: AsyncSession, records: pd.DataFrame, state: dict):
+        """删除文件中订单的已有记录并写入新数据；同一订单跨数据块时只在第一次出现时删除"""
+        new_order_ids = [order_id for order_id in records['order_id'].unique() if order_id not in state["order_ids"]]
+        state["order_ids"].update(new_order_ids)
+        for id_chunk in _chunked(new_order_ids):
+            await db.execute(delete(ECSalesModel).where(ECSalesModel.order_id.in_(id_chunk)))
+
+        ec_rows = records.astype(object).where(records.notna(), None).to_dict('records')
+        await ExcelImportService._bulk_upsert(
+            db, ECSalesModel, ec_rows,
+            [column for column in records.columns if not ECSalesModel.__table__.c[column].primary_key]
+        )
 
-                reset_ec_stmt = (
-                    update(StaffSalesCategory)
-                    .where(StaffSalesCategory.fiscal_month.in_(list(category_fiscal_months)))
-                    .values(sales_value_ec=Decimal('0'))
-                )
-                await db.execute(reset_ec_stmt)
-                await db.commit()
-
-                app_logger.debug(f"已重置 {len(category_fiscal_months)} 个财月的员工品类电商销售数据")
-
-                updated_category_count = 0
-                for (staff_code, store_code, fiscal_month,
-                     level_value_1), sales_value_ec in ec_sales_category_summary.items():
-                    query = select(StaffSalesCategory).where(
-                        StaffSalesCategory.staff_code == staff_code,
-                        StaffSalesCategory.store_code == store_code,
-                        StaffSalesCategory.fiscal_month == fiscal_month,
-                        StaffSalesCategory.level_value_1 == level_value_1
-                    )
-                    result = await db.execute(query)
-                    category_record = result.scalar_one_or_none()
-
-                    if category_record:
-                        category_record.sales_value_ec = sales_value_ec
-                        category_record.updated_at = datetime.now()
-                    else:
-                        new_record = StaffSalesCategory(
-                            staff_code=staff_code,
-                            store_code=store_code,
-                            fiscal_month=fiscal_month,
-                            level_value_1=level_value_1,
-                            sales_value_ec=sales_value_ec,
-                            sales_value_store=Decimal('0'),
-                            created_at=datetime.now()
-                        )
-                        db.add(new_record)
-                    updated_category_count += 1
-
-                await db.commit()
-                app_logger.debug(f"已保存 {len(ec_sales_category_summary)} 条员工品类销售数据")
+    @staticmethod
+    async def _write_ec_summaries(db: AsyncSession, state: dict):
+        """按财月重置线上销售，再写入员工、门店和品类汇总，不提交事务"""
+        ec_sales_summary = state["ec_sales_summary"]
+        ec_sales_category_summary = state["ec_sales_category_summary"]
+
+        fiscal_months = sorted(set(fiscal_month for (_, _, fiscal_month) in ec_sales_summary.keys()))
+        store_sales_value_store = {}
+        staff_sales_value_store = {}
+        if fiscal_months:
+            app_logger.debug(f"重置以下财月的员工电商销售数据: {fiscal_months}")
+            reset_result = await db.execute(
+                select(StaffAttendanceModel.staff_code, StaffAttendanceModel.store_code,
+                       StaffAttendanceModel.fiscal_month, StaffAttendanceModel.sales_value_store)
+                .where(StaffAttendanceModel.fiscal_month.in_(fiscal_months))
+            )
+            reset_records = reset_result.fetchall()
+            staff_sales_value_store = {
+                (row.staff_code, row.store_code, row.fiscal_month): row.sales_value_store for row in reset_records
+            }
+
+            reset_store_result = await db.execute(
+                select(TargetStoreMain.store_code, TargetStoreMain.fiscal_month, TargetStoreMain.sales_value_store)
+                .where(TargetStoreMain.fiscal_month.in_(fiscal_months))
+            )
+            reset_store_records = reset_store_result.fetchall()
+            store_sales_value_store = {
+                (row.store_code, row.fiscal_month): row.sales_value_store for row in reset_store_records
+            }
+
+            # 电商销售按财月整体重置，销售总额设为线下销售额(如果没有则为0)
+            await db.execute(
+                update(StaffAttendanceModel)
+                .where(StaffAttendanceModel.fiscal_month.in_(fiscal_months))
+                .values(sales_value_ec=Decimal('0'),
+                        sales_value=func.coalesce(StaffAttendanceModel.sales_value_store, 0))
+            )
+            await db.execute(
+                update(TargetStoreMain)
+                .where(TargetStoreMain.fiscal_month.in_(fiscal_months))
+                .values(sales_value_ec=Decimal('0'),
+                        sales_value=func.coalesce(TargetStoreMain.sales_value_store, 0))
+            )
 
-            return ImportResult(
-                success=True,
-                message="成功导入电商销售数据" if not warning_data else "成功导入电商销售数据，但存在警告",
-                data_type="ec_sales",
-                warning_table=warning_data,
-                rows_processed=processed_count,
-                rows_with_errors=error_count,
-                errors=errors[:10]
+            # 涉及的门店全部整店重算佣金
+            await CommissionDirtyService.mark_stores(
+                db,
+                [(row.store_code, row.fiscal_month) for row in reset_store_records] +
+                [(row.store_code, row.fiscal_month) for row in reset_records],
+                "ec_sales"
             )
-        except Exception as e:
-            await db.rollback()
-            errors.append(f"数据库提交失败: {str(e)}")
-            return ImportResult(
-                success=False,
-                message=f"导入电商销售数据失败: {str(e)}",
-                data_type="ec_sales",
-                rows_processed=processed_count,
-                rows_with_errors=error_count + 1,
-                errors=errors[:10]
+            app_logger.debug(f"已重置 {len(reset_records)} 条员工考勤记录")
+
+        # 更新或创建员工考勤记录
+        now = datetime.now()
+        attendance_rows = []
+        missing_attendances = []
+        store_sales_summary = {}
+        for (staff_code, store_code, fiscal_month), sales_value_ec in ec_sales_summary.items():
+            key = (staff_code, store_code, fiscal_month)
+            if key not in staff_sales_value_store:
+                missing_attendances.append(key)
+            sales_value_store = staff_sales_value_store.get(key)
+            attendance_rows.append({
+                "staff_code": staff_code,
+                "store_code": store_code,
+                "fiscal_month": fiscal_month,
+                "sales_value_ec": sales_value_ec,
+                "sales_value": round(
+                    (Decimal(str(sales_value_store)) if sales_value_store else Decimal('0')) + sales_value_ec),
+                "deletable": True,
+                "created_at": now,
+                "updated_at": now
+            })
+
+            store_key = (store_code, fiscal_month)
+            store_sales_summary[store_key] = store_sales_summary.get(store_key, Decimal('0')) + sales_value_ec
+
+        if missing_attendances:
+            app_logger.warning(
+                f"未找到员工考勤记录，将创建 {len(missing_attendances)} 条新的记录: {missing_attendances[:20]}")
+        await ExcelImportService._bulk_upsert(
+            db, StaffAttendanceModel, attendance_rows, ["sales_value_ec", "sales_value", "updated_at"])
+
+        # 更新门店目标表中的电商销售数据，只更新已存在的门店目标
+        target_store_rows = []
+        for (store_code, fiscal_month), total_sales_value_ec in store_sales_summary.items():
+            if (store_code, fiscal_month) not in store_sales_value_store:
+                app_logger.warning(
+                    f"未找到门店目标记录: store_code={store_code}, fiscal_month={fiscal_month}")
+                continue
+            store_sales_value = Decimal(str(store_sales_value_store[(store_code, fiscal_month)] or 0))
+            target_store_rows.append({
+                "store_code": store_code,
+                "fiscal_month": fiscal_month,
+                "sales_value_ec": total_sales_value_ec,
+                "sales_value": round(store_sales_value + total_sales_value_ec),
+                "updated_at": now
+            })
+        for rows_chunk in _chunked(target_store_rows):
+            await db.execute(update(TargetStoreMain), rows_chunk)
+
+        if ec_sales_summary:
+            app_logger.debug(f"已保存 {len(ec_sales_summary)} 条员工电商销售数据")
+
+        if ec_sales_category_summary:
+            category_fiscal_months = sorted(set(k[2] for k in ec_sales_category_summary.keys()))
+
+            app_logger.debug(f"将重置以下财月的员工品类电商销售数据: {category_fiscal_months}")
+
+            reset_ec_stmt = (
+                update(StaffSalesCategory)
+                .where(StaffSalesCategory.fiscal_month.in_(category_fiscal_months))
+                .values(sales_value_ec=Decimal('0'))
             )
+            await db.execute(reset_ec_stmt)
+
+            category_rows = [
+                {
+                    "staff_code": staff_code,
+                    "store_code": store_code,
+                    "fiscal_month": fiscal_month,
+                    "level_value_1": level_value,
+                    "sales_value_ec": sales_value_ec,
+                    "sales_value_store": Decimal('0'),
+                    "created_at": now,
+                    "updated_at": now
+                }
+                for (staff_code, store_code, fiscal_month, level_value), sales_value_ec
+                in ec_sales_category_summary.items()
+            ]
+            await ExcelImportService._bulk_upsert(
+                db, StaffSalesCategory, category_rows, ["sales_value_ec", "updated_at"])
+            app_logger.debug(f"已保存 {len(ec_sales_category_summary)} 条员工品类销售数据")
+
+    @staticmethod
+    async def _bulk_upsert(db: AsyncSession, model, rows: list, update_columns: list):
+        """分批 INSERT ... ON DUPLICATE KEY UPDATE，不提交事务"""
+        for rows_chunk in _chunked(rows):
+            stmt = insert(model).values(rows_chunk)
+            stmt = stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in update_columns})
+            await db.execute(stmt)
 
 
 @router.post("/preview", response_model=ExcelPreviewResponse)
-async def preview_excel(file: UploadFile = File(...)):
-    """预览Excel文件"""
+async def preview_excel(file: UploadFile = File(...), preview_rows: int = EXCEL_PREVIEW_ROWS):
+    """预览Excel文件：只读取表头和前 preview_rows 行，数据类型按表头识别"""
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="只支持Excel文件格式")
 
+    path = None
     try:
-        contents = await file.read()
-        df = pd.read_excel(io.BytesIO(contents))
-        data_type = identify_excel_type(df)
+        path = await spool_upload(file)
+        columns, df, total_rows, estimated = read_excel_preview(path, max(preview_rows, 0))
+        data_type = identify_excel_type(pd.DataFrame(columns=columns))
         df = df.fillna('')
 
         for col in df.columns:
-            if df[col].dtype == 'datetime64[ns]':
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
                 df[col] = df[col].astype(str).replace('NaT', '')
 
         return ExcelPreviewResponse(
             data_type=data_type,
             preview_data=df.to_dict('records'),
-            total_rows=len(df),
-            columns=list(df.columns),
+            total_rows=total_rows if total_rows is not None else len(df),
+            total_rows_estimated=estimated,
+            columns=columns,
             errors=[]
         )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"处理文件时出错: {str(e)}")
+    finally:
+        if path:
+            os.remove(path)
 
 
 @router.post("/import")
@@ -594,24 +654,17 @@ async def import_excel_data(
         file: UploadFile = File(...),
         db: AsyncSession = Depends(get_db)
 ):
-    """导入Excel数据"""
+    """导入Excel数据：上传文件先写入临时文件，再按块读取、校验和写入"""
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="只支持Excel文件格式")
 
+    path = None
     try:
-        # 读取并处理Excel文件
-        contents = await file.read()
-        df = pd.read_excel(io.BytesIO(contents))
-        data_type = identify_excel_type(df)
+        path = await spool_upload(file)
+        data_type = identify_excel_type(pd.DataFrame(columns=read_excel_columns(path)))
 
         # 根据数据类型调用相应的处理函数
-        if data_type == 'target':
-            result = await ExcelImportService.import_target_data(df, db)
-        elif data_type == 'budget':
-            result = await ExcelImportService.import_budget_data(df, db)
-        elif data_type == 'ec_sales':
-            result = await ExcelImportService.import_ec_sales_data(df, db)
-        else:
+        if data_type not in IMPORT_DATA_TYPES:
             return ImportResult(
                 success=True,
                 message=f"无法识别的数据类型",
@@ -619,7 +672,50 @@ async def import_excel_data(
                 rows_processed=0
             )
 
-        return result
+        return await ExcelImportService.import_file_chunks(data_type, aiter_excel_chunks(path), db)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"导入失败: {str(e)}")
+    finally:
+        if path:
+            os.remove(path)
+
+
+@router.post("/import_jobs")
+async def submit_import_job(file: UploadFile = File(...)):
+    """提交后台导入任务，立即返回任务记录，通过 GET /import_jobs/{job_id} 查询进度"""
+    if not file.filename.endswith(('.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="只支持Excel文件格式")
+
+    path = None
+    try:
+        path = await spool_upload(file)
+        data_type = identify_excel_type(pd.DataFrame(columns=read_excel_columns(path)))
+        if data_type not in IMPORT_DATA_TYPES:
+            os.remove(path)
+            return {"code": 400, "msg": "无法识别的数据类型", "data_type": data_type}
+
+        # 临时文件由任务结束时删除
+        data = ExcelImportJobService.submit(
+            path, file.filename, data_type,
+            lambda chunks, db: ExcelImportService.import_file_chunks(data_type, chunks, db)
+        )
+        return {"code": 200, "data": data, "msg": "Success"}
+    except Exception as e:
+        app_logger.error(f"submit_import_job An error occurred: {str(e)}")
+        if path and os.path.exists(path):
+            os.remove(path)
+        return {"code": 500, "msg": f"An error occurred while submitting import job: {str(e)}"}
+
+
+@router.get("/import_jobs")
+async def list_import_jobs(data_type: str = None):
+    return {"code": 200, "data": ExcelImportJobService.list_jobs(data_type)}
+
+
+@router.get("/import_jobs/{job_id}")
+async def get_import_job(job_id: str, with_warnings: bool = False):
+    data = ExcelImportJobService.get_job(job_id, with_warnings)
+    if data is None:
+        return {"code": 404, "msg": f"Import job {job_id} not found"}
+    return {"code": 200, "data": data}
@@ -3,11 +3,14 @@ import re
 
 from fastapi import APIRouter, Depends
 
-from app.core.security import get_current_user
+from app.core.security import get_current_user, can_manage_cache
 
 router = APIRouter()
 
-from app.database import get_sqlserver_db
+from app.database import AsyncSQLServerSession, get_sqlserver_db
+from app.services.access_service import UserProfileCache
+from app.services.report_cache_service import ReportCache
+from app.utils.permissions import RoleStoreAccess
 from app.utils.logger import app_logger
 from sqlalchemy import text
 
@@ -21,13 +24,19 @@ def remove_port_from_url(url: str) -> str:
 
 
 @router.get("/list")
-async def get_menus(current_user: dict = Depends(get_current_user), db=Depends(get_sqlserver_db)):
+async def get_menus(current_user: dict = Depends(get_current_user),
+                    db: AsyncSQLServerSession = Depends(get_sqlserver_db)):
     # 记录请求开始的日志
     app_logger.info(f"Fetching menus for user: {current_user['user_code']}")
 
     # 从数据库查询用户对应的菜单和权限
     user_code = current_user['user_code']
 
+    cached_profile = UserProfileCache.get(user_code)
+    if "menu_tree" in cached_profile:
+        app_logger.debug(f"Menu tree for {user_code} served from cache")
+        return cached_profile["menu_tree"]
+
     # 实际查询SQL
     query = text("""
            SELECT distinct a.parent_id,a.parent_id_cn, a.id, a.description, a.menu_url, a.menu_name,a.menu_name_cn, a.type,a.icon,a.parent_icon,a.sort
@@ -41,8 +50,7 @@ async def get_menus(current_user: dict = Depends(get_current_user), db=Depends(g
 
     try:
 
-        result = db.execute(query, {"user_code": user_code})
-        results = result.fetchall()
+        results = await db.fetchall(query, {"user_code": user_code})
         app_logger.debug(f"Query returned {len(results)} rows")
     except Exception as e:
         app_logger.error(f"Database query failed: {str(e)}")
@@ -100,7 +108,28 @@ async def get_menus(current_user: dict = Depends(get_current_user), db=Depends(g
         menu_tree.append(root_menu)
 
     app_logger.info(f"Successfully built menu tree with {len(menu_tree)} root items")
+    UserProfileCache.update(user_code, menu_tree=menu_tree)
     return menu_tree
+
+
+@router.post("/cache/invalidate")
+async def invalidate_user_profile_cache(login_name: str = None, current_user: dict = Depends(get_current_user)):
+    """角色、菜单或员工资料维护后调用；login_name 为空时清空全部用户的缓存"""
+    if not can_manage_cache(current_user):
+        return {"code": 403, "msg": "Permission denied"}
+    UserProfileCache.invalidate(login_name)
+    return {"code": 200, "data": UserProfileCache.stats(), "msg": "Success"}
+
+
+@router.post("/store_access/invalidate")
+async def invalidate_role_store_access(role_code: str = None, current_user: dict = Depends(get_current_user)):
+    """role_org_join 或门店维护后调用；role_code 为空时清空全部角色的门店权限"""
+    if not can_manage_cache(current_user):
+        return {"code": 403, "msg": "Permission denied"}
+    RoleStoreAccess.invalidate(role_code)
+    # 报表结果按角色缓存，门店权限变化后一并失效
+    ReportCache.invalidate()
+    return {"code": 200, "data": RoleStoreAccess.stats(), "msg": "Success"}
 #
 #
 # @router.get("/listBak")
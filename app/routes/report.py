@@ -1,14 +1,24 @@
-from fastapi import APIRouter, Depends, Query, Response
-import pandas as pd
-from io import BytesIO
+import asyncio
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from functools import partial
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
+from app.database import SessionLocal, get_db
 from app.services.target_service import TargetRPTService
 from app.services.commission_service import CommissionRPTService
 from app.services.budget_service import BudgetService
-from app.core.security import get_current_user
+from app.services.report_cache_service import ReportCache
+from app.core.security import get_current_user, can_manage_cache
+from app.utils.excel_writer import iter_file_and_remove, report_columns, write_xlsx_tempfile
+from app.utils.keyset import decode_cursor, take_page
 from app.utils.logger import app_logger
+from app.utils.table_writer import iter_csv_chunks, write_parquet_tempfile
 
 router = APIRouter()
 
@@ -16,6 +26,18 @@ router = APIRouter()
 REPORT_TYPES = ["target_by_store", "target_percentage_version", "target_bi_version", "target_date_horizontal_version",
                 "target_by_staff", "commission", "budget", "sales_by_achievement", "commission_payout"]
 
+# 支持游标分页和 NDJSON 流式返回的报表：报表类型 -> 排序键字段（与行迭代器的输出顺序一致）
+PAGEABLE_REPORTS = {
+    "commission": ("store_code", "staff_no"),
+    "commission_payout": ("store_code", "staff_code"),
+    "target_by_staff": ("store_code", "staff_code"),
+}
+# 分页默认和最大每页行数
+REPORT_PAGE_SIZE = 500
+REPORT_MAX_PAGE_SIZE = 5000
+# NDJSON 每次写出的行数
+NDJSON_FLUSH_ROWS = 200
+
 
 @router.get("/data")
 async def get_report_data(
@@ -23,7 +45,9 @@ async def get_report_data(
         status: str = Query('approved'),
         report_type: str = Query("target_by_store", description=f"报表类型: {', '.join(REPORT_TYPES)}"),
         keyword: str = Query(None, description="门店代码或名称模糊查询"),
-        format: str = Query("json", description="返回格式: json 或 excel"),
+        format: str = Query("json", description="返回格式: json、excel、csv、parquet 或 ndjson"),
+        cursor: str = Query(None, description="分页游标，取上一页返回的 next_cursor"),
+        limit: int = Query(None, description=f"每页行数，传入时分页返回（最大 {REPORT_MAX_PAGE_SIZE}）"),
         session: AsyncSession = Depends(get_db),
         current_user: dict = Depends(get_current_user)
 ):
@@ -31,52 +55,94 @@ async def get_report_data(
     获取报表数据，支持多种报表类型
     - financial_month: 财月（必需）
     - keyword: 门店代码或名称模糊查询（可选）
+    - cursor / limit: 按自然键游标分页（commission、commission_payout、target_by_staff）
+    - format=ndjson: 逐行流式返回，第一行为 field_translations（报表类型同上）
     """
     approve = current_user['approve']
     if report_type not in REPORT_TYPES:
         return {"code": 400, "msg": f"Invalid report_type. Must be one of: {', '.join(REPORT_TYPES)}"}
+    export_format = format.lower()
 
     # 根据报表类型获取数据
     report_data = {}
     role_code = current_user['user_code']
 
-    try:
-        if report_type == "target_by_store":
-            report_data["target_by_store"] = await TargetRPTService.get_rpt_target_by_store(
-                session, financial_month, keyword, status, role_code, approve)
+    # 游标分页只用于 JSON 返回，文件导出仍返回完整数据
+    if export_format == 'ndjson' or (export_format not in ('excel', 'csv', 'parquet') and (cursor or limit)):
+        if report_type not in PAGEABLE_REPORTS:
+            return {"code": 400, "msg": f"Paging and ndjson are only supported for: {', '.join(PAGEABLE_REPORTS)}"}
+        limit = limit or REPORT_PAGE_SIZE
+        if limit < 1 or limit > REPORT_MAX_PAGE_SIZE:
+            return {"code": 400, "msg": f"limit must be between 1 and {REPORT_MAX_PAGE_SIZE}"}
+        try:
+            after = decode_cursor(cursor, len(PAGEABLE_REPORTS[report_type]))
+        except ValueError as e:
+            return {"code": 400, "msg": str(e)}
+
+        if export_format == 'ndjson':
+            return StreamingResponse(
+                _ndjson_lines(report_type, financial_month, keyword, status, role_code, approve, after),
+                media_type='application/x-ndjson')
+
+        try:
+            rows = _iter_report_rows(session, report_type, financial_month, keyword, status, role_code, approve, after)
+            page, next_cursor = await take_page(rows, limit, PAGEABLE_REPORTS[report_type])
+            report_data[report_type] = {
+                "data": page,
+                "field_translations": _report_field_translations(report_type),
+                "next_cursor": next_cursor
+            }
+            report_data.update({
+                "financial_month": financial_month,
+                "report_type": report_type,
+                "keyword": keyword
+            })
+            return {"code": 200, "data": report_data}
+        except Exception as e:
+            app_logger.error(f"Error generating report page: {str(e)}")
+            return {"code": 500, "msg": f"Error generating report: {str(e)}"}
 
-        elif report_type == "target_percentage_version":
-            report_data["target_percentage_version"] = await TargetRPTService.get_rpt_target_by_store(
-                session, financial_month, keyword, status, role_code, approve)
+    try:
+        # 只有目标类报表按审批权限显示不同字段，其余报表的缓存不区分 approve
+        approve_key = None
+        if report_type in ("target_by_store", "target_percentage_version"):
+            compute = partial(TargetRPTService.get_rpt_target_by_store,
+                              session, financial_month, keyword, status, role_code, approve)
+            approve_key = approve
 
         elif report_type == "target_bi_version":
-            report_data["target_bi_version"] = await TargetRPTService.get_rpt_target_bi_version(
-                session, financial_month, keyword, status, role_code, approve)
+            compute = partial(TargetRPTService.get_rpt_target_bi_version,
+                              session, financial_month, keyword, status, role_code, approve)
+            approve_key = approve
 
         elif report_type == "target_date_horizontal_version":
-            report_data[
-                "target_date_horizontal_version"] = await TargetRPTService.get_rpt_target_date_horizontal_version(
-                session, financial_month, keyword, status, role_code, approve)
+            compute = partial(TargetRPTService.get_rpt_target_date_horizontal_version,
+                              session, financial_month, keyword, status, role_code, approve)
+            approve_key = approve
 
         elif report_type == "target_by_staff":
-            report_data["target_by_staff"] = await TargetRPTService.get_rpt_target_by_staff(
-                session, financial_month, keyword, status, role_code, approve)
+            compute = partial(TargetRPTService.get_rpt_target_by_staff,
+                              session, financial_month, keyword, status, role_code, approve)
+            approve_key = approve
 
         elif report_type == "commission":
-            report_data["commission"] = await CommissionRPTService.get_rpt_commission_by_store(
-                session, financial_month, keyword, status, role_code)
+            compute = partial(CommissionRPTService.get_rpt_commission_by_store,
+                              session, financial_month, keyword, status, role_code)
 
         elif report_type == "sales_by_achievement":
-            report_data["sales_by_achievement"] = await CommissionRPTService.get_rpt_sales_by_achievement(
-                session, financial_month, keyword, status, role_code)
+            compute = partial(CommissionRPTService.get_rpt_sales_by_achievement,
+                              session, financial_month, keyword, status, role_code)
 
         elif report_type == "commission_payout":
-            report_data["commission_payout"] = await CommissionRPTService.get_rpt_commission_payout(
-                session, financial_month, keyword, status, role_code)
+            compute = partial(CommissionRPTService.get_rpt_commission_payout,
+                              session, financial_month, keyword, status, role_code)
 
-        elif report_type == "budget":
-            report_data["budget"] = await BudgetService.get_budget_data(
-                session, financial_month, keyword, status, role_code)
+        else:
+            compute = partial(BudgetService.get_budget_data,
+                              session, financial_month, keyword, status, role_code)
+
+        report_data[report_type] = await ReportCache.get_or_compute(
+            report_type, financial_month, status, role_code, keyword, compute, approve_key)
 
         # 添加元数据
         report_data.update({
@@ -86,8 +152,12 @@ async def get_report_data(
         })
 
         # 根据格式返回数据
-        if format.lower() == 'excel':
-            return _export_to_excel(report_data, report_type, status)
+        if export_format == 'excel':
+            return await _export_to_excel(report_data, report_type, status)
+        elif export_format == 'csv':
+            return _export_to_csv(report_data, report_type)
+        elif export_format == 'parquet':
+            return await _export_to_parquet(report_data, report_type)
         else:
             return {"code": 200, "data": report_data}
 
@@ -96,140 +166,140 @@ async def get_report_data(
         return {"code": 500, "msg": f"Error generating report: {str(e)}"}
 
 
-def _export_to_excel(report_data: dict, report_type: str, status: str):
+def _iter_report_rows(db: AsyncSession, report_type: str, financial_month: str, keyword: str, status: str,
+                      role_code: str, approve, after: tuple = None):
+    """可分页报表的行迭代器，按 PAGEABLE_REPORTS 中的排序键升序产生"""
+    if report_type == "commission":
+        return CommissionRPTService.iter_rpt_commission_by_store(db, financial_month, keyword, status, role_code, after)
+    if report_type == "commission_payout":
+        return CommissionRPTService.iter_rpt_commission_payout(db, financial_month, keyword, status, role_code, after)
+    if report_type == "target_by_staff":
+        return TargetRPTService.iter_rpt_target_by_staff(db, financial_month, keyword, status, role_code, approve,
+                                                         after)
+    raise ValueError(f"Report {report_type} does not support paging")
+
+
+def _report_field_translations(report_type: str) -> dict:
+    if report_type == "commission":
+        return CommissionRPTService.commission_by_store_field_translations()
+    if report_type == "commission_payout":
+        return CommissionRPTService.commission_payout_field_translations()
+    return TargetRPTService.target_by_staff_field_translations()
+
+
+def _json_default(value):
+    # 与 FastAPI 的 JSON 编码保持一致：Decimal 转为 int/float，日期转为 ISO 格式
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _ndjson_line(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_json_default) + "\n"
+
+
+async def _ndjson_lines(report_type: str, financial_month: str, keyword: str, status: str, role_code: str, approve,
+                        after: tuple = None):
+    """
+    逐行输出 NDJSON：第一行为 field_translations，之后每行一条报表数据
+
+    响应开始后请求依赖的会话可能已关闭，因此使用独立会话；出错时输出一行 error 后结束
+    """
+    async with SessionLocal() as db:
+        rows = _iter_report_rows(db, report_type, financial_month, keyword, status, role_code, approve, after)
+        try:
+            yield _ndjson_line({"report_type": report_type, "financial_month": financial_month,
+                                "field_translations": _report_field_translations(report_type)})
+            buffer = []
+            async for row in rows:
+                buffer.append(_ndjson_line(row))
+                if len(buffer) >= NDJSON_FLUSH_ROWS:
+                    yield "".join(buffer)
+                    buffer = []
+            if buffer:
+                yield "".join(buffer)
+        except Exception as e:
+            app_logger.error(f"Error streaming report {report_type}: {str(e)}")
+            yield _ndjson_line({"error": f"Error generating report: {str(e)}"})
+        finally:
+            await rows.aclose()
+
+
+@router.post("/cache/invalidate")
+async def invalidate_report_cache(financial_month: str = None, current_user: dict = Depends(get_current_user)):
+    """financial_month 为空时清空全部报表缓存"""
+    if not can_manage_cache(current_user):
+        return {"code": 403, "msg": "Permission denied"}
+    ReportCache.invalidate(financial_month)
+    return {"code": 200, "data": ReportCache.stats(), "msg": "Success"}
+
+
+def _report_sheet(data, sheet_name: str) -> dict:
+    """把报表结果转换为工作表定义，表头使用 field_translations 的英文字段名，列格式取 field_formats"""
+    if isinstance(data, dict) and "data" in data:
+        rows = data.get("data") or []
+        field_translations = data.get("field_translations") or {}
+        formats = data.get("field_formats") or {}
+    elif isinstance(data, list):
+        rows, field_translations, formats = data, {}, {}
+    else:
+        rows, field_translations, formats = [data], {}, {}
+
+    columns = report_columns(rows, field_translations)
+    headers = [field_translations.get(column, {}).get("en", column) for column in columns]
+    return {"name": sheet_name, "columns": columns, "headers": headers, "formats": formats, "rows": rows}
+
+
+async def _export_to_excel(report_data: dict, report_type: str, status: str):
     """
     将报告数据导出为 Excel 文件，使用 field_translations 的英文字段名作为表头
+
+    使用 openpyxl 只写模式在线程中逐行写入临时文件，再分块流式返回
     """
-    output = BytesIO()
-
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        financial_month = report_data.get("financial_month", "unknown")
-        keyword = report_data.get("keyword", "")
-
-        # 通用的数据处理函数，支持使用 field_translations 设置表头
-        def _write_data_to_sheet(data, sheet_name):
-
-            if isinstance(data, dict) and "data" in data:
-                details = data.get("data", [])
-                if details:
-                    df = pd.DataFrame(details)
-                    # 如果有 field_translations，使用英文字段名作为表头
-                    if "field_translations" in data and data["field_translations"]:
-                        field_translations = data["field_translations"]
-                        # 创建列名映射（从原始字段名到英文字段名）
-                        column_mapping = {
-                            old_name: translations["en"]
-                            for old_name, translations in field_translations.items()
-                            if "en" in translations
-                        }
-                        # 重命名列
-                        df.rename(columns=column_mapping, inplace=True)
-
-                    # 判断每列是否全为数字并设置格式
-                    workbook = writer.book
-                    worksheet = workbook.create_sheet(sheet_name)
-
-                    # 写入列标题
-                    for col_idx, col_name in enumerate(df.columns, 1):
-                        worksheet.cell(row=1, column=col_idx, value=col_name)
-
-                    # 写入数据并设置列格式
-                    for row_idx, (_, row) in enumerate(df.iterrows(), 2):
-                        for col_idx, (_, value) in enumerate(row.items(), 1):
-                            worksheet.cell(row=row_idx, column=col_idx, value=value)
-
-                    # 设置列格式
-                    for col_idx, col_name in enumerate(df.columns, 1):
-                        # 检查该列是否全为数字
-                        is_numeric_column = pd.api.types.is_numeric_dtype(df[col_name]) or (
-                                df[col_name].notna().all() and
-                                df[col_name].apply(lambda x: isinstance(x, (int, float))).all()
-                        )
-
-                        if is_numeric_column:
-                            # 设置为 general 格式
-                            from openpyxl.styles import numbers
-                            worksheet.column_dimensions[worksheet.cell(row=1,
-                                                                       column=col_idx).column_letter].number_format = numbers.FORMAT_GENERAL
-                    return
-
-                else:
-                    df = pd.DataFrame([data])
-                    # 如果有 field_translations，使用英文字段名作为表头
-                    if "field_translations" in data and data["field_translations"]:
-                        field_translations = data["field_translations"]
-                        column_mapping = {
-                            old_name: translations["en"]
-                            for old_name, translations in field_translations.items()
-                            if "en" in translations
-                        }
-                        df.rename(columns=column_mapping, inplace=True)
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-            elif isinstance(data, list):
-                df = pd.DataFrame(data)
-                # 如果列表不为空且有字段翻译信息，尝试应用翻译
-                if data and isinstance(data[0], dict):
-                    # 这里无法直接获取 field_translations，需要在调用时确保传入正确的数据结构
-                    pass
-
-                # 判断每列是否全为数字并设置格式
-                workbook = writer.book
-                worksheet = workbook.create_sheet(sheet_name)
-
-                # 写入列标题
-                for col_idx, col_name in enumerate(df.columns, 1):
-                    worksheet.cell(row=1, column=col_idx, value=col_name)
-
-                # 写入数据并设置列格式
-                for row_idx, (_, row) in enumerate(df.iterrows(), 2):
-                    for col_idx, (_, value) in enumerate(row.items(), 1):
-                        worksheet.cell(row=row_idx, column=col_idx, value=value)
-
-                # 设置列格式
-                for col_idx, col_name in enumerate(df.columns, 1):
-                    # 检查该列是否全为数字
-                    is_numeric_column = pd.api.types.is_numeric_dtype(df[col_name]) or (
-                            df[col_name].notna().all() and
-                            df[col_name].apply(lambda x: isinstance(x, (int, float))).all()
-                    )
-
-                    if is_numeric_column:
-                        # 设置为 general 格式
-                        from openpyxl.styles import numbers
-                        worksheet.column_dimensions[
-                            worksheet.cell(row=1, column=col_idx).column_letter].number_format = numbers.FORMAT_GENERAL
-                return
-            else:
-                df = pd.DataFrame([data])
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-        # 根据报表类型导出不同sheet
-        if report_type in ["target_by_store", "target_percentage_version",
-                           "target_bi_version", "target_date_horizontal_version"] and report_type in report_data:
-            _write_data_to_sheet(report_data[report_type], "Sheet1")
-
-        elif report_type == "target_by_staff" and "target_by_staff" in report_data:
-            _write_data_to_sheet(report_data["target_by_staff"], "Sheet1")
-
-        elif report_type == "commission_payout" and "commission_payout" in report_data:
-            _write_data_to_sheet(report_data["commission_payout"], "Sheet1")
-
-        elif report_type == "commission" and "commission" in report_data:
-            _write_data_to_sheet(report_data["commission"], "Sheet1")
-
-        elif report_type == "sales_by_achievement" and "sales_by_achievement" in report_data:
-            _write_data_to_sheet(report_data["sales_by_achievement"], "Sheet1")
-
-        elif report_type == "budget" and "budget" in report_data:
-            _write_data_to_sheet(report_data["budget"], "Upload_Budget")
-
-    output.seek(0)
+    financial_month = report_data.get("financial_month", "unknown")
+    keyword = report_data.get("keyword", "")
+
+    sheets = []
+    if report_type in report_data:
+        sheet_name = "Upload_Budget" if report_type == "budget" else "Sheet1"
+        sheets.append(_report_sheet(report_data[report_type], sheet_name))
+
+    path = await asyncio.to_thread(write_xlsx_tempfile, sheets)
 
-    filename_keyword = f"_{keyword}" if keyword else ""
     headers = {
-        'Content-Disposition': f'attachment; filename="report_{financial_month}{filename_keyword}_{report_type}.xlsx"',
-        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        'Content-Disposition': _attachment(financial_month, keyword, report_type, 'xlsx'),
+        'Content-Length': str(os.path.getsize(path))
     }
 
-    return Response(content=output.getvalue(), headers=headers)
+    return StreamingResponse(iter_file_and_remove(path), headers=headers,
+                             media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
 
+def _export_to_csv(report_data: dict, report_type: str):
+    """将报告数据以 UTF-8 CSV 流式返回，表头与 Excel 导出一致"""
+    sheet = _report_sheet(report_data.get(report_type, []), report_type)
+    headers = {
+        'Content-Disposition': _attachment(report_data.get("financial_month", "unknown"), report_data.get("keyword"),
+                                           report_type, 'csv')
+    }
+    return StreamingResponse(iter_csv_chunks(sheet['columns'], sheet['headers'], sheet['rows']), headers=headers,
+                             media_type='text/csv; charset=utf-8')
+
+
+async def _export_to_parquet(report_data: dict, report_type: str):
+    """将报告数据导出为 parquet（按列存储，金额列为 decimal 类型），表头与 Excel 导出一致"""
+    sheet = _report_sheet(report_data.get(report_type, []), report_type)
+    path = await asyncio.to_thread(write_parquet_tempfile, sheet['columns'], sheet['headers'], sheet['rows'])
+    headers = {
+        'Content-Disposition': _attachment(report_data.get("financial_month", "unknown"), report_data.get("keyword"),
+                                           report_type, 'parquet'),
+        'Content-Length': str(os.path.getsize(path))
+    }
+    return StreamingResponse(iter_file_and_remove(path), headers=headers, media_type='application/vnd.apache.parquet')
+
+
+def _attachment(financial_month: str, keyword: str, report_type: str, extension: str) -> str:
+    filename_keyword = f"_{keyword}" if keyword else ""
+    return f'attachment; filename="report_{financial_month}{filename_keyword}_{report_type}.{extension}"'
@@ -7,6 +7,7 @@ from app.schemas.target import TargetStoreWeekCreate, TargetStoreDailyCreate, St
 from app.services.target_service import TargetStoreService, TargetStoreWeekService, TargetStoreDailyService, \
     TargetStaffService
 from app.services.commission_service import CommissionService
+from app.services.report_cache_service import ReportCache
 from app.database import get_db
 from app.core.security import get_current_user
 
@@ -46,6 +47,7 @@ async def create_week_target(TargetStoreWeek: TargetStoreWeekCreate, db: AsyncSe
                              current_user: dict = Depends(get_current_user)):
     try:
         data = await TargetStoreWeekService.create_target_store_week(db, TargetStoreWeek)
+        ReportCache.invalidate(TargetStoreWeek.fiscal_month)
         return {"code": 200, "data": data, "msg": "Success"}
     except SQLAlchemyError as e:
         raise HTTPException(
@@ -86,6 +88,7 @@ async def create_daily_target(TargetStoreDaily: TargetStoreDailyCreate, db: Asyn
         #     await TargetStoreService.update_target_store_daily(db, TargetStoreDaily.store_code,
         #                                                        TargetStoreDaily.fiscal_month)
 
+        ReportCache.invalidate(TargetStoreDaily.fiscal_month)
         return {"code": 200, "data": data, "msg": "Success"}
     except SQLAlchemyError as e:
 
@@ -101,6 +104,23 @@ async def create_daily_target(TargetStoreDaily: TargetStoreDailyCreate, db: Asyn
         )
 
 
+@router.post("/regenerate_daily")
+async def regenerate_daily_target(fiscal_month: str, db: AsyncSession = Depends(get_db),
+                                  current_user: dict = Depends(get_current_user)):
+    """按周拆分重新生成该财月全部门店日目标的 monthly_percentage"""
+    try:
+        rows = await TargetStoreDailyService.rebuild_monthly_percentages(db, fiscal_month)
+        ReportCache.invalidate(fiscal_month)
+        return {"code": 200, "data": {"fiscal_month": fiscal_month, "rows": rows}, "msg": "Success"}
+    except SQLAlchemyError as e:
+        await db.rollback()
+        app_logger.error(f"regenerate_daily_target SQLAlchemyError {str(e)}")
+        return {"code": 500, "msg": "Database error occurred while regenerating daily targets"}
+    except Exception as e:
+        app_logger.error(f"regenerate_daily_target Exception {str(e)}")
+        return {"code": 500, "msg": f"An error occurred while regenerating daily targets: {str(e)}"}
+
+
 @router.get("/get_daily")
 async def get_daily_target(store_code: str, fiscal_month: str, db: AsyncSession = Depends(get_db),
                            current_user: dict = Depends(get_current_user)):
@@ -132,6 +152,7 @@ async def create_staff_attendance(TargetStaffAttendance: StaffAttendanceCreate,
         role_code = current_user['user_code']
         data = await TargetStaffService.create_staff_attendance(db, TargetStaffAttendance, role_code)
         await TargetStaffService.update_staff(db, TargetStaffAttendance)
+        ReportCache.invalidate(TargetStaffAttendance.fiscal_month)
         return {"code": 200, "data": data, "msg": "Success"}
     except SQLAlchemyError as e:
         app_logger.error(f"create_staff_attendance SQLAlchemyError {str(e)}")
@@ -172,6 +193,7 @@ async def delete_staff_attendance(fiscal_month: str, store_code: str, staff_code
                                   db: AsyncSession = Depends(get_db), current_user: dict = Depends(get_current_user)):
     try:
         data = await TargetStaffService.delete_staff_attendance(db, fiscal_month, store_code, staff_code)
+        ReportCache.invalidate(fiscal_month)
         return {"code": 200, "data": data, "msg": "Success"}
     except SQLAlchemyError as e:
         raise HTTPException(
@@ -202,6 +224,7 @@ async def batch_audit_target(request: BatchApprovedTarget, db: AsyncSession = De
             db, request, role_code
         )
         app_logger.info(f"batch_audit_target {result}")
+        ReportCache.invalidate(request.fiscal_month)
         return {"code": 200, "data": result, "msg": f"Successfully target"}
     except ValueError as e:
         app_logger.error(f"batch_audit_target {e}")
@@ -221,6 +244,7 @@ async def withdrawn_target(request: WithdrawnTarget, db: AsyncSession = Depends(
         result = await TargetStoreService.withdrawn_target(
             db, request
         )
+        ReportCache.invalidate(request.fiscal_month)
         return {"code": 200, "data": result, "msg": f"Successfully withdrawn taget"}
     except ValueError as e:
         return {"code": 404, "msg": str(e)}
@@ -57,3 +57,14 @@ class UpdateOpeningDay(BaseModel):
     fiscal_month: str
     store_code: str
     opening_days: int
+
+
+class BatchCalculateCommission(BaseModel):
+    fiscal_month: str
+    store_codes: Optional[List[str]] = None
+
+
+class MonthEndRunCreate(BaseModel):
+    fiscal_month: str
+    store_codes: Optional[List[str]] = None
+    concurrency: Optional[int] = None
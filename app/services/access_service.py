@@ -1,9 +1,13 @@
+from typing import Optional
+
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy import text
+from app.database import AsyncSQLServerSession
 from app.utils.logger import app_logger
+from app.utils.ttl_cache import TTLCache
 from app.models.dimension import SysUser
 
 # from app.core.jar_pwd_handler import get_password_handler
@@ -13,6 +17,9 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="retail_hub_api/token")
 SECRET_KEY = "secret"
 ALGORITHM = "HS256"
 MASTER_KEY = os.getenv("MASTER_KEY", "xK9mP2vL7qR4wN8bT1yH6jF3dA5sG0cEiUoZaXrBnM")
+# 用户资料缓存：最多缓存的用户数和有效期
+USER_PROFILE_CACHE_SIZE = 2000
+USER_PROFILE_TTL_SECONDS = 600
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
     credentials_exception = HTTPException(
@@ -34,25 +41,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
 _password_hasher = Ssha2Hasher()
 
 
-async def verify_password(session: Session, user_code: str, user_password: str):
+def _query_user_access(session: Session, user_code: str, with_profile: bool = True) -> Optional[dict]:
+    """
+    查询用户密码，with_profile 为 True 时同时查询审批权限和主组，在 SQL Server 线程池中执行
+
+    密码每次登录都查询，不缓存，修改密码或删除用户后立即生效
+    """
     # 查询用户
     result = session.query(SysUser.password, SysUser.id).filter(SysUser.login_name == user_code).first()
-    # 如果用户不存在，返回 False
     if not result:
-        app_logger.warning(f"user not found: {user_code}")
-        return {"verify_result": False, "approve": False}
+        return None
 
     hashed_password = result[0]
     user_id = result[1]
-    # hasher = Ssha2Hasher()
-    # 复用全局 hasher 实例
-    if MASTER_KEY and user_password == MASTER_KEY:
-        app_logger.info(f"User {user_code} logged in via master key.")
-        verify_result = True
-    else:
-        verify_result = _password_hasher.verify(hashed_password, user_password)
-
-    # return verify_result
+    if not with_profile:
+        return {"hashed_password": hashed_password}
 
     sql = text("""
         SELECT menu_rel_id from sys_user_role_rel a 
@@ -60,13 +63,7 @@ async def verify_password(session: Session, user_code: str, user_password: str):
         where sys_user_id=:sys_user_id and menu_rel_id='approve'
     """)
 
-    result = session.execute(sql, {"sys_user_id": user_id}).fetchone()
-
-    if result:
-        app_logger.info(f"User {user_code}   have 'approve' permission.")
-        approve = True
-    else:
-        approve = False
+    approve_result = session.execute(sql, {"sys_user_id": user_id}).fetchone()
 
     pg_sql = text("""
                   SELECT primary_group
@@ -75,6 +72,75 @@ async def verify_password(session: Session, user_code: str, user_password: str):
                   """)
     pg_result = session.execute(pg_sql, {"employee_id": user_code}).fetchone()
 
-    primary_group = pg_result[0] if pg_result else None
+    return {"hashed_password": hashed_password, "approve": bool(approve_result),
+            "primary_group": pg_result[0] if pg_result else None}
+
+
+class UserProfileCache:
+    """
+    按 login_name 缓存用户登录资料：approve 权限、primary_group 和菜单树（不缓存密码哈希）
+
+    TTL + LRU，重复登录和加载菜单时只查询密码。过期时间从首次写入开始计算，后续合并字段不会延长。
+    角色/菜单/员工资料在 SQL Server 中维护后，调用 invalidate 立即生效，否则最长 USER_PROFILE_TTL_SECONDS 后生效。
+    """
+
+    _cache = TTLCache(USER_PROFILE_CACHE_SIZE, USER_PROFILE_TTL_SECONDS)
+
+    @staticmethod
+    def get(login_name: str) -> dict:
+        """返回缓存的资料（可能只包含部分字段），未命中时返回空字典"""
+        return UserProfileCache._cache.get(login_name) or {}
+
+    @staticmethod
+    def update(login_name: str, **fields):
+        """合并字段，保留原有的过期时间"""
+        profile = UserProfileCache._cache.get(login_name)
+        if profile is None:
+            UserProfileCache._cache.set(login_name, dict(fields))
+        else:
+            profile.update(fields)
+
+    @staticmethod
+    def invalidate(login_name: str = None):
+        """失效一个用户，login_name 为空时清空全部"""
+        if login_name:
+            UserProfileCache._cache.pop(login_name)
+        else:
+            UserProfileCache._cache.clear()
+        app_logger.info(f"User profile cache invalidated: {login_name or 'all'}")
+
+    @staticmethod
+    def stats() -> dict:
+        return UserProfileCache._cache.stats()
+
+
+async def verify_password(session: AsyncSQLServerSession, user_code: str, user_password: str):
+    cached_profile = UserProfileCache.get(user_code)
+    with_profile = "approve" not in cached_profile
+    # 一次线程池调用完成全部 SQL Server 查询；资料已缓存时只查询密码
+    user_access = await session.run_sync(_query_user_access, user_code, with_profile)
+    # 如果用户不存在，返回 False
+    if not user_access:
+        UserProfileCache.invalidate(user_code)
+        app_logger.warning(f"user not found: {user_code}")
+        return {"verify_result": False, "approve": False}
+
+    hashed_password = user_access.pop("hashed_password")
+    if with_profile:
+        UserProfileCache.update(user_code, **user_access)
+    else:
+        user_access = cached_profile
+
+    # hasher = Ssha2Hasher()
+    # 复用全局 hasher 实例
+    if MASTER_KEY and user_password == MASTER_KEY:
+        app_logger.info(f"User {user_code} logged in via master key.")
+        verify_result = True
+    else:
+        verify_result = await _password_hasher.verify_async(hashed_password, user_password)
+
+    approve = user_access["approve"]
+    if approve:
+        app_logger.info(f"User {user_code}   have 'approve' permission.")
 
-    return {"verify_result": verify_result, "approve": approve, "primary_group": primary_group}
+    return {"verify_result": verify_result, "approve": approve, "primary_group": user_access["primary_group"]}
@@ -4,11 +4,11 @@ from sqlalchemy import String
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.budget import BudgetModel
-from collections import defaultdict
 
 from app.models.dimension import DimensionDayWeek
 from app.models.target import TargetStoreDaily, TargetStoreWeek, TargetStoreMain
 from app.utils.permissions import build_store_permission_query
+from app.utils.pivot import pivot
 from app.utils.logger import app_logger
 from sqlalchemy import update
 class BudgetService:
@@ -29,7 +29,7 @@ class BudgetService:
                             f"key_word: {key_word}, status: {status}, role_code: {role_code}")
 
             # 执行SQL查询逻辑
-            store_permission_query = build_store_permission_query(role_code)
+            store_permission_query = await build_store_permission_query(db, role_code)
             store_alias = store_permission_query.subquery()
 
             # 修改后的 get_budget_data 方法部分代码
@@ -80,45 +80,27 @@ class BudgetService:
                     "store_codes": []
                 }
 
-            # 按日期分组数据并构建横向表结构
-            app_logger.debug("Grouping data by date")
-            date_groups = defaultdict(dict)
-            store_codes = set()
-
-            for idx, row in enumerate(budget_data):
-                date_str =row.date.strftime('%Y/%m/%d').lstrip('0').replace('/0', '/') if row.date else None
-                store_code = row.store_code
-                budget_value = row.budget_date_value if row.budget_date_value is not None else 0.0
-
-                if date_str:
-                    date_groups[date_str][store_code] = budget_value
-                    store_codes.add(store_code)
-
-                if idx > 0 and idx % 1000 == 0:
-                    app_logger.debug(f"Processed {idx}/{len(budget_data)} rows")
+            # 一次遍历构建 日期 × 门店 的稠密矩阵：日期按 date 值排序，无需再解析日期字符串
+            app_logger.debug("Pivoting data by date")
+            matrix = pivot(
+                (row.date, row.store_code,
+                 row.budget_date_value if row.budget_date_value is not None else 0.0)
+                for row in budget_data if row.date
+            )
 
             # 构建结果数据
-            sorted_store_codes = sorted(list(store_codes))
+            sorted_store_codes = matrix.column_keys
             columns = ["Date"] + sorted_store_codes
             app_logger.debug(f"Found {len(sorted_store_codes)} unique store codes")
 
-            # 构建表格数据
             # 构建表格数据
             app_logger.debug("Building table data")
+            store_fields = [f"Store{store_code}" for store_code in sorted_store_codes]
             table_data = []
-            # 使用 datetime 排序确保日期按时间顺序排列
-            date_list = sorted(list(date_groups.keys()), key=lambda x: datetime.strptime(x, '%Y/%m/%d'))
-
-            for date_idx, date_str in enumerate(date_list):
-                store_values = date_groups[date_str]
-                row_data = {"Date": date_str}
+            for date, values in zip(matrix.row_keys, matrix.rows()):
+                row_data = {"Date": date.strftime('%Y/%m/%d').lstrip('0').replace('/0', '/')}
+                row_data.update(zip(store_fields, values))
                 table_data.append(row_data)
-                for store_code in sorted_store_codes:
-                    formatted_store_code = f"Store{store_code}"
-                    row_data[formatted_store_code] = store_values.get(store_code, 0.0)
-
-                if date_idx > 0 and date_idx % 1000 == 0:
-                    app_logger.debug(f"Built {date_idx}/{len(date_list)} table rows")
 
             app_logger.info(f"Returning {len(table_data)} rows of formatted data with {len(columns)} columns")
 
@@ -0,0 +1,453 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import case, delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.commission import CommissionStaffModel, CommissionStoreModel, CommissionStaffDetailModel, \
+    StaffSalesCategory, CommissionTrialStaffDetailModel
+from app.models.staff import StaffAttendanceModel
+from app.models.target import TargetStoreMain
+from app.services.commission_service import CommissionService
+from app.services.commission_dirty_service import CommissionDirtyService
+from app.services.commission_summary_service import CommissionSummaryService
+from app.services.commission_kernel import CommissionKernel
+from app.services.fiscal_calendar_service import FiscalCalendar
+from app.services.rule_catalog_service import CommissionRuleCatalog
+from app.utils.logger import app_logger
+
+# 每个 bulk insert / IN 列表的最大行数
+BATCH_CHUNK_SIZE = 1000
+
+
+def _chunked(items: list, size: int = BATCH_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class CommissionBatchService:
+    """
+    按财月批量计算佣金
+
+    与 CommissionService.calculate_commissions_for_store 结果一致，但所有门店的规则、阶梯、品类系数、
+    考勤和品类销售都用固定次数的批量查询加载，在内存中用整数内核 CommissionKernel 计算后分块 bulk insert。
+    """
+
+    @staticmethod
+    async def calculate_commissions_for_month(db: AsyncSession, fiscal_month: str,
+                                              store_codes: Optional[List[str]] = None,
+                                              user_code: str = None, is_prod: bool = True) -> dict:
+        """
+        批量计算一个财月所有（或指定）门店的员工佣金
+
+        Args:
+            db: 数据库会话
+            fiscal_month: 财月
+            store_codes: 门店代码列表，为空时计算该财月 commissions_store 中的所有门店
+            user_code: 操作人
+            is_prod: True 写入正式明细, False 写入试算明细
+
+        Returns:
+            dict: {"fiscal_month", "succeeded": [...], "failed": {store_code: error}, "rows": 写入行数}
+        """
+        try:
+            started_at = datetime.now()
+            app_logger.info(f"开始批量计算财月 {fiscal_month} 的佣金, 门店: {store_codes or 'ALL'}")
+
+            context = await CommissionBatchService._load_context(db, fiscal_month, store_codes)
+
+            failed = context['failed']
+            succeeded = []
+            staff_rows = []
+            detail_rows = []
+
+            for store_code, store_record in context['stores'].items():
+                try:
+                    store_staff_rows, store_detail_rows = CommissionBatchService._calculate_store(
+                        context, store_code, store_record, fiscal_month, user_code, is_prod)
+                except Exception as e:
+                    app_logger.error(f"批量计算店铺 {store_code} 在财月 {fiscal_month} 的佣金时发生错误: {e}")
+                    failed[store_code] = str(e)
+                    continue
+                succeeded.append(store_code)
+                staff_rows.extend(store_staff_rows)
+                detail_rows.extend(store_detail_rows)
+
+            await CommissionBatchService._write_results(db, fiscal_month, succeeded, staff_rows, detail_rows,
+                                                        is_prod)
+            await db.commit()
+
+            app_logger.info(
+                f"财月 {fiscal_month} 批量佣金计算完成: 成功 {len(succeeded)} 家, 失败 {len(failed)} 家, "
+                f"写入 {len(detail_rows)} 条明细, 耗时 {(datetime.now() - started_at).total_seconds():.2f}s")
+
+            return {
+                "fiscal_month": fiscal_month,
+                "succeeded": succeeded,
+                "failed": failed,
+                "rows": len(detail_rows)
+            }
+
+        except Exception as e:
+            app_logger.error(f"批量计算财月 {fiscal_month} 的佣金时发生错误: {e}", exc_info=True)
+            await db.rollback()
+            raise e
+
+    @staticmethod
+    async def _load_context(db: AsyncSession, fiscal_month: str, store_codes: Optional[List[str]]) -> dict:
+        """用固定次数的批量查询加载计算所需的全部数据"""
+        # 1. 门店佣金记录（合并门店 / 跨财月 / 店铺类型 / 开店天数）
+        store_query = select(
+            CommissionStoreModel.store_code,
+            CommissionStoreModel.merged_store_codes,
+            CommissionStoreModel.merged_flag,
+            CommissionStoreModel.store_type,
+            CommissionStoreModel.fiscal_period,
+            CommissionStoreModel.opening_days
+        ).where(CommissionStoreModel.fiscal_month == fiscal_month)
+        if store_codes:
+            store_query = store_query.where(CommissionStoreModel.store_code.in_(store_codes))
+        store_records = {row.store_code: row for row in (await db.execute(store_query)).fetchall()}
+
+        failed = {}
+        for store_code in store_codes or []:
+            if store_code not in store_records:
+                failed[store_code] = f"Store {store_code} has no commissions_store record for {fiscal_month}"
+
+        stores = {}
+        scopes = {}
+        for store_code, record in store_records.items():
+            try:
+                scopes[store_code] = CommissionService.resolve_store_scope(store_code, fiscal_month, record)
+            except Exception as e:
+                failed[store_code] = str(e)
+                continue
+            stores[store_code] = record
+
+        # (门店, 财月) -> 需要该数据的计算门店
+        pair_to_stores = defaultdict(list)
+        for store_code, (merged_codes, month_codes) in scopes.items():
+            for code in merged_codes:
+                for month in month_codes:
+                    pair_to_stores[(code, month)].append(store_code)
+
+        all_codes = sorted({code for code, _ in pair_to_stores})
+        all_months = sorted({month for _, month in pair_to_stores})
+
+        # 2. 门店目标/销售
+        store_targets = {}
+        for code_chunk in _chunked(all_codes):
+            target_result = await db.execute(
+                select(
+                    TargetStoreMain.store_code,
+                    TargetStoreMain.fiscal_month,
+                    TargetStoreMain.target_value,
+                    TargetStoreMain.sales_value
+                ).where(
+                    TargetStoreMain.store_code.in_(code_chunk),
+                    TargetStoreMain.fiscal_month.in_(all_months)
+                )
+            )
+            for row in target_result.fetchall():
+                store_targets[(row.store_code, row.fiscal_month)] = row
+
+        # 3. 员工考勤，按门店分块查询，每块按 PK 顺序返回
+        store_attendances = defaultdict(list)
+        for code_chunk in _chunked(all_codes):
+            attendance_result = await db.execute(
+                select(
+                    StaffAttendanceModel.staff_code,
+                    StaffAttendanceModel.store_code,
+                    StaffAttendanceModel.position,
+                    StaffAttendanceModel.actual_attendance,
+                    StaffAttendanceModel.expected_attendance,
+                    case(
+                        (StaffAttendanceModel.planned_attendance.is_(None), StaffAttendanceModel.expected_attendance),
+                        else_=StaffAttendanceModel.planned_attendance
+                    ).label('planned_attendance'),
+                    StaffAttendanceModel.salary_coefficient,
+                    StaffAttendanceModel.target_value_ratio,
+                    StaffAttendanceModel.target_value,
+                    StaffAttendanceModel.sales_value,
+                    StaffAttendanceModel.fiscal_month
+                ).where(
+                    StaffAttendanceModel.store_code.in_(code_chunk),
+                    StaffAttendanceModel.fiscal_month.in_(all_months)
+                ).order_by(
+                    StaffAttendanceModel.staff_code,
+                    StaffAttendanceModel.store_code,
+                    StaffAttendanceModel.fiscal_month
+                )
+            )
+            for row in attendance_result.all():
+                for store_code in pair_to_stores.get((row.store_code, row.fiscal_month), []):
+                    store_attendances[store_code].append(row)
+
+        # 合并门店可能跨块，重新按 PK 排序，保证与单店计算时合并顺序一致
+        for attendances in store_attendances.values():
+            attendances.sort(key=lambda row: (row.staff_code, row.store_code, row.fiscal_month))
+
+        # 4. 财月天数（每个财月的最小/最大日期，进程内财历）
+        calendar = await FiscalCalendar.get(db)
+        month_ranges = {month: calendar.date_range([month]) for month in all_months
+                        if month in calendar.month_ranges}
+
+        # 5. 员工品类销售（只取计算门店本身、本财月）
+        category_sales = defaultdict(dict)
+        if stores:
+            sales_category_result = await db.execute(
+                select(
+                    StaffSalesCategory.staff_code,
+                    StaffSalesCategory.store_code,
+                    StaffSalesCategory.level_value_1,
+                    StaffSalesCategory.sales_value_ec,
+                    StaffSalesCategory.sales_value_store
+                ).where(
+                    StaffSalesCategory.fiscal_month == fiscal_month,
+                    StaffSalesCategory.store_code.in_(list(stores))
+                )
+            )
+            for row in sales_category_result.fetchall():
+                category_sales[(row.store_code, row.staff_code)][row.level_value_1] = \
+                    (row.sales_value_ec or 0) + (row.sales_value_store or 0)
+
+        # 6. 规则分配 / 规则 / 阶梯 / 品类系数（进程内规则目录）
+        catalog = await CommissionRuleCatalog.get(db)
+
+        app_logger.info(f"财月 {fiscal_month} 批量加载完成: 门店 {len(stores)}, 关联门店 {len(all_codes)}, "
+                        f"规则版本 {catalog.version}")
+
+        return {
+            "stores": stores,
+            "scopes": scopes,
+            "failed": failed,
+            "store_targets": store_targets,
+            "store_attendances": store_attendances,
+            "month_ranges": month_ranges,
+            "category_sales": category_sales,
+            "catalog": catalog,
+        }
+
+    @staticmethod
+    def _fiscal_days(month_ranges: dict, month_codes: list) -> int:
+        """与 CommissionService.get_fiscal_month_days 相同：多个财月的最大日期 - 最小日期 + 1"""
+        ranges = [month_ranges[month] for month in month_codes if month in month_ranges]
+        ranges = [(min_date, max_date) for min_date, max_date in ranges if min_date and max_date]
+        if not ranges:
+            return 0
+        return (max(r[1] for r in ranges) - min(r[0] for r in ranges)).days + 1
+
+    @staticmethod
+    def _calculate_store(context: dict, store_code: str, store_record, fiscal_month: str,
+                         user_code: str, is_prod: bool) -> tuple:
+        """在内存中计算单个门店，返回 (commissions_staff 行, 明细行)"""
+        merged_codes, month_codes = context['scopes'][store_code]
+
+        store_data_list = [context['store_targets'][(code, month)]
+                           for code in merged_codes for month in month_codes
+                           if (code, month) in context['store_targets']]
+        if not store_data_list:
+            raise ValueError(f"Stores {merged_codes} not found or have no data for {fiscal_month}")
+
+        store_target_value = 0
+        store_sales_value = 0
+        for store_data in store_data_list:
+            store_target_value += store_data.target_value or 0
+            store_sales_value += store_data.sales_value or 0
+
+        store_type = store_record.store_type
+        opening_days = store_record.opening_days
+        fiscal_days = CommissionBatchService._fiscal_days(context['month_ranges'], month_codes)
+
+        if not store_type:
+            raise ValueError(f"Store {store_code} has no store_type")
+
+        if store_target_value > 0 and store_sales_value is not None:
+            store_achievement_rate = (store_sales_value / store_target_value) * 100
+        else:
+            store_achievement_rate = 0
+
+        staff_rows = []
+        detail_rows = []
+
+        staff_attendances = context['store_attendances'].get(store_code, [])
+        if not staff_attendances:
+            return staff_rows, detail_rows
+
+        catalog = context['catalog']
+        position_to_rules = catalog.position_rules(store_type)
+        positions = set(staff.position for staff in staff_attendances)
+        if not any(position_to_rules.get(position) for position in positions):
+            return staff_rows, detail_rows
+
+        rules_info = catalog.rules
+        staff_attendances = CommissionService.merge_staff_attendances(staff_attendances, is_prod)
+        kernel = CommissionKernel(staff_attendances, opening_days, fiscal_days)
+        position_stats = kernel.position_stats()
+        created_at = datetime.now()
+        default_keys = set()
+        # 员工×规则 行，金额由整数内核统一计算后回填: (kernel 行, commissions_staff 行, 明细行)
+        kernel_rows = []
+        pending_rows = []
+
+        def add_default_detail():
+            # 同一员工多条规则未匹配时只保留一条 R-00 记录，避免主键冲突
+            if staff['staff_code'] in default_keys:
+                return
+            default_keys.add(staff['staff_code'])
+            detail_rows.append(CommissionService.default_commission_detail_values(
+                fiscal_month, staff, store_code, store_target_value, store_sales_value,
+                store_achievement_rate, staff_target_value, staff_sales_value, staff_achievement_rate,
+                staff_category_sales
+            ))
+
+        staff_achievement_rates = [CommissionService.staff_achievement_rate(staff) for staff in staff_attendances]
+        tier_matches = CommissionService.match_rule_tiers(
+            catalog, [rule_code for rule_codes in position_to_rules.values() for rule_code in rule_codes],
+            rules_info, staff_achievement_rates, store_achievement_rate)
+
+        for staff_index, staff in enumerate(staff_attendances):
+            staff_category_sales = context['category_sales'].get((store_code, staff['staff_code']), {})
+
+            staff_target_value = staff['target_value']
+            staff_sales_value = staff['sales_value'] or 0
+            staff_achievement_rate = staff_achievement_rates[staff_index]
+
+            rule_codes = position_to_rules.get(staff['position'], [])
+            if not rule_codes and is_prod:
+                add_default_detail()
+                continue
+
+            position_stat = position_stats.get(staff['position'], {})
+
+            for rule_code in rule_codes:
+                rule_info = rules_info.get(rule_code)
+                if not rule_info:
+                    continue
+
+                basis = CommissionService.resolve_rule_basis(
+                    rule_info, staff_achievement_rate, staff_sales_value,
+                    store_achievement_rate, store_sales_value)
+                if basis is None:
+                    app_logger.warning(f"规则 {rule_code} 的 rule_basis 值无效: {rule_info.rule_basis}")
+                    continue
+                target_achievement_rate, sales_value = basis
+
+                matching_detail = tier_matches[rule_code][staff_index]
+                if not matching_detail:
+                    if is_prod:
+                        add_default_detail()
+                    continue
+
+                rule_detail_value = matching_detail.value or 0
+                category_result_data = CommissionService.empty_category_result(staff_category_sales)
+                if rule_detail_value < 0:
+                    category_result_data = CommissionKernel.category_commission(
+                        catalog.category_coefficients(matching_detail.rule_detail_code), staff_category_sales)
+
+                if CommissionKernel.supports(rule_info, rule_detail_value, sales_value):
+                    commission_amount, factor = None, None
+                else:
+                    commission_amount, factor = CommissionService.compute_rule_amount(
+                        staff, rule_info, rule_detail_value, sales_value, category_result_data,
+                        position_stats, opening_days, fiscal_days
+                    )
+
+                category_fields, staff_sales_fields, tier_bonus_rate_fields = \
+                    CommissionService.build_category_fields(category_result_data, rule_detail_value)
+
+                staff_row = None
+                if is_prod:
+                    staff_row = dict(
+                        fiscal_month=fiscal_month,
+                        staff_code=staff['staff_code'],
+                        store_code=store_code,
+                        amount=commission_amount,
+                        rule_detail_code=matching_detail.rule_detail_code,
+                        created_at=created_at,
+                        creator_code=user_code,
+                        total_days_store_work=position_stat.get('total_attendance', 0),
+                        **category_fields
+                    )
+                    staff_rows.append(staff_row)
+
+                detail_row = dict(
+                    fiscal_month=fiscal_month,
+                    staff_code=staff['staff_code'],
+                    store_code=store_code,
+                    position=staff['position'],
+                    store_target_value=store_target_value,
+                    store_sales_value=store_sales_value,
+                    store_achievement_rate=store_achievement_rate,
+                    staff_target_value=staff_target_value,
+                    staff_sales_value=staff_sales_value,
+                    staff_achievement_rate=staff_achievement_rate,
+                    expected_attendance=staff['expected_attendance'] or 0,
+                    actual_attendance=staff['actual_attendance'] or 0,
+                    rule_code=rule_code,
+                    rule_detail_code=matching_detail.rule_detail_code,
+                    amount=commission_amount,
+                    total_days_store_work=position_stat.get('total_attendance', 0),
+                    factor=factor,
+                    created_at=created_at,
+                    creator_code=user_code,
+                    **category_fields,
+                    **staff_sales_fields,
+                    **tier_bonus_rate_fields
+                )
+                detail_rows.append(detail_row)
+
+                if commission_amount is None:
+                    kernel_rows.append((staff_index, rule_info, rule_detail_value, sales_value,
+                                        category_result_data.get('total')))
+                    pending_rows.append((staff_row, detail_row))
+
+        for (staff_row, detail_row), (commission_amount, factor) in zip(pending_rows,
+                                                                        kernel.rule_amounts(kernel_rows)):
+            if staff_row is not None:
+                staff_row['amount'] = commission_amount
+            detail_row['amount'] = commission_amount
+            detail_row['factor'] = factor
+
+        return staff_rows, detail_rows
+
+    @staticmethod
+    async def _write_results(db: AsyncSession, fiscal_month: str, store_codes: list,
+                             staff_rows: list, detail_rows: list, is_prod: bool):
+        """删除旧结果（保留人工调整 Z-01）并分块 bulk insert"""
+        for store_chunk in _chunked(store_codes):
+            if is_prod:
+                await db.execute(
+                    delete(CommissionStaffModel).where(
+                        CommissionStaffModel.fiscal_month == fiscal_month,
+                        CommissionStaffModel.store_code.in_(store_chunk),
+                        CommissionStaffModel.rule_detail_code != "Z-01"
+                    )
+                )
+                await db.execute(
+                    delete(CommissionStaffDetailModel).where(
+                        CommissionStaffDetailModel.fiscal_month == fiscal_month,
+                        CommissionStaffDetailModel.store_code.in_(store_chunk),
+                        CommissionStaffDetailModel.rule_detail_code != "Z-01"
+                    )
+                )
+                await CommissionDirtyService.clear(db, store_chunk, fiscal_month)
+            else:
+                await db.execute(
+                    delete(CommissionTrialStaffDetailModel).where(
+                        CommissionTrialStaffDetailModel.fiscal_month == fiscal_month,
+                        CommissionTrialStaffDetailModel.store_code.in_(store_chunk)
+                    )
+                )
+
+        detail_model = CommissionStaffDetailModel if is_prod else CommissionTrialStaffDetailModel
+        for rows_chunk in _chunked(staff_rows):
+            await db.execute(insert(CommissionStaffModel), rows_chunk)
+        for rows_chunk in _chunked(detail_rows):
+            await db.execute(insert(detail_model), rows_chunk)
+        if is_prod:
+            await CommissionSummaryService.refresh(db, fiscal_month, store_codes)
+
+        app_logger.info(f"财月 {fiscal_month} 写入 {len(staff_rows)} 条佣金记录, {len(detail_rows)} 条佣金明细")
@@ -0,0 +1,208 @@
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import delete, or_, tuple_
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.commission import CommissionDirtyGroupModel, CommissionStaffDetailModel, CommissionStoreModel
+from app.models.staff import StaffAttendanceModel
+from app.services.fiscal_calendar_service import FiscalCalendar
+from app.utils.logger import app_logger
+
+# position 取该值表示整店重算
+WHOLE_STORE = '*'
+
+
+def _split_codes(value: str) -> list:
+    return [code.strip() for code in value.split(',')] if value else []
+
+
+def _month_key(fiscal_month: str) -> tuple:
+    """'2025-9' -> (2025, 9)，财月不补零，不能按字符串比较；无法解析时返回 (0, 0)"""
+    try:
+        year, month = fiscal_month.split('-')
+        return int(year), int(month)
+    except (AttributeError, ValueError):
+        return 0, 0
+
+
+class CommissionDirtyService:
+    """
+    佣金待重算分组标记
+
+    写入路径（考勤、品类销售、门店目标、开店天数等）在同一事务中调用 mark / mark_stores / mark_staff，
+    把受影响的 (计算门店, 财月, 岗位) 记录到 commissions_dirty_group，
+    由 CommissionService.recalculate_dirty_groups 读取后增量重算。
+    数据门店通过 commissions_store 的 merged_store_codes / fiscal_period 映射到引用它的计算门店，
+    同一份数据被多个计算门店引用时每个计算门店各自一条标记。
+    """
+
+    @staticmethod
+    async def _months_from(db: AsyncSession, fiscal_months: Iterable[str]) -> list:
+        """
+        不早于 fiscal_months 中最早财月的全部财月（来自财历，并包含 fiscal_months 本身）
+
+        Returns:
+            list: 财月字符串列表，用于 IN 条件
+        """
+        fiscal_months = set(fiscal_months)
+        earliest = min(_month_key(month) for month in fiscal_months)
+        calendar = await FiscalCalendar.get(db)
+        later_months = {month for month in calendar.month_ranges if _month_key(month) >= earliest}
+        return sorted(later_months | fiscal_months)
+
+    @staticmethod
+    async def resolve_calc_stores(db: AsyncSession, store_months: Iterable[tuple]) -> set:
+        """
+        查找引用了这些 (数据门店, 财月) 的计算门店
+
+        Args:
+            db: 数据库会话
+            store_months: (store_code, fiscal_month) 列表
+
+        Returns:
+            set: {(calc_store_code, calc_fiscal_month)}
+        """
+        store_months = set(store_months)
+        if not store_months:
+            return set()
+        stores = {store_code for store_code, _ in store_months}
+
+        # 计算财月不早于数据财月（fiscal_period 只向前跨月）
+        result = await db.execute(
+            select(CommissionStoreModel.store_code, CommissionStoreModel.fiscal_month,
+                   CommissionStoreModel.merged_store_codes, CommissionStoreModel.fiscal_period)
+            .where(
+                CommissionStoreModel.fiscal_month.in_(
+                    await CommissionDirtyService._months_from(db, [month for _, month in store_months])),
+                or_(
+                    CommissionStoreModel.store_code.in_(stores),
+                    CommissionStoreModel.merged_store_codes.isnot(None),
+                    CommissionStoreModel.fiscal_period != CommissionStoreModel.fiscal_month
+                )
+            )
+        )
+
+        calc_stores = set()
+        for row in result.fetchall():
+            merged_codes = _split_codes(row.merged_store_codes) or [row.store_code]
+            month_codes = [row.fiscal_month]
+            if row.fiscal_period and row.fiscal_period != row.fiscal_month:
+                month_codes = _split_codes(row.fiscal_period)
+            if any((code, month) in store_months for code in merged_codes for month in month_codes):
+                calc_stores.add((row.store_code, row.fiscal_month))
+        return calc_stores
+
+    @staticmethod
+    async def _insert(db: AsyncSession, calc_stores: set, positions: set, reason: str):
+        if not calc_stores:
+            return
+        now = datetime.now()
+        stmt = insert(CommissionDirtyGroupModel).values([
+            {"store_code": store_code, "fiscal_month": fiscal_month, "position": position,
+             "reason": reason, "marked_at": now}
+            for store_code, fiscal_month in calc_stores
+            for position in positions
+        ])
+        stmt = stmt.on_duplicate_key_update(reason=stmt.inserted.reason, marked_at=stmt.inserted.marked_at)
+        await db.execute(stmt)
+        app_logger.debug(f"Commission dirty: {sorted(calc_stores)} {sorted(positions)} ({reason})")
+
+    @staticmethod
+    async def mark(db: AsyncSession, store_code: str, fiscal_month: str,
+                   positions: Optional[Iterable[str]] = None, reason: str = None):
+        """
+        标记需要重算的分组，不提交事务
+
+        Args:
+            db: 数据库会话
+            store_code: 数据所在门店
+            fiscal_month: 数据所在财月
+            positions: 岗位列表，为空表示整店
+            reason: 标记原因
+        """
+        positions = {position for position in (positions or []) if position} or {WHOLE_STORE}
+        calc_stores = await CommissionDirtyService.resolve_calc_stores(db, [(store_code, fiscal_month)])
+        await CommissionDirtyService._insert(db, calc_stores, positions, reason)
+
+    @staticmethod
+    async def mark_stores(db: AsyncSession, store_months: Iterable[tuple], reason: str = None):
+        """整店标记多个 (数据门店, 财月)，一次查询、一条语句写入"""
+        store_months = {(store_code, fiscal_month) for store_code, fiscal_month in store_months if store_code}
+        calc_stores = await CommissionDirtyService.resolve_calc_stores(db, store_months)
+        await CommissionDirtyService._insert(db, calc_stores, {WHOLE_STORE}, reason)
+
+    @staticmethod
+    async def mark_staff(db: AsyncSession, store_code: str, fiscal_month: str, staff_codes: List[str],
+                         reason: str = None):
+        """
+        按员工标记：员工当前岗位和上次计算时的岗位都需要重算
+
+        Args:
+            db: 数据库会话
+            store_code: 数据所在门店
+            fiscal_month: 数据所在财月
+            staff_codes: 员工列表
+            reason: 标记原因
+        """
+        if not staff_codes:
+            return
+        result = await db.execute(
+            select(StaffAttendanceModel.position).distinct().where(
+                StaffAttendanceModel.store_code == store_code,
+                StaffAttendanceModel.fiscal_month == fiscal_month,
+                StaffAttendanceModel.staff_code.in_(staff_codes)
+            )
+        )
+        positions = {row.position for row in result.fetchall()}
+
+        result = await db.execute(
+            select(CommissionStaffDetailModel.position).distinct().where(
+                CommissionStaffDetailModel.fiscal_month.in_(
+                    await CommissionDirtyService._months_from(db, [fiscal_month])),
+                CommissionStaffDetailModel.staff_code.in_(staff_codes),
+                CommissionStaffDetailModel.rule_detail_code != "Z-01"
+            )
+        )
+        positions.update(row.position for row in result.fetchall())
+
+        # 找不到岗位时退化为整店
+        await CommissionDirtyService.mark(db, store_code, fiscal_month, positions or None, reason)
+
+    @staticmethod
+    async def collect(db: AsyncSession, store_code: str, fiscal_month: str) -> list:
+        """查询计算门店的全部标记"""
+        result = await db.execute(
+            select(CommissionDirtyGroupModel.store_code, CommissionDirtyGroupModel.fiscal_month,
+                   CommissionDirtyGroupModel.position)
+            .where(
+                CommissionDirtyGroupModel.store_code == store_code,
+                CommissionDirtyGroupModel.fiscal_month == fiscal_month
+            )
+        )
+        return result.fetchall()
+
+    @staticmethod
+    async def discard(db: AsyncSession, dirty_rows: list):
+        """删除已处理的标记，不提交事务"""
+        if not dirty_rows:
+            return
+        await db.execute(
+            delete(CommissionDirtyGroupModel).where(
+                tuple_(CommissionDirtyGroupModel.store_code, CommissionDirtyGroupModel.fiscal_month,
+                       CommissionDirtyGroupModel.position).in_(
+                    [(row.store_code, row.fiscal_month, row.position) for row in dirty_rows])
+            )
+        )
+
+    @staticmethod
+    async def clear(db: AsyncSession, store_codes: List[str], fiscal_month: str):
+        """整店计算后清除计算门店的标记，不提交事务"""
+        await db.execute(
+            delete(CommissionDirtyGroupModel).where(
+                CommissionDirtyGroupModel.store_code.in_(store_codes),
+                CommissionDirtyGroupModel.fiscal_month == fiscal_month
+            )
+        )
@@ -0,0 +1,440 @@
+"""
+佣金计算的整数定点内核
+
+与 CommissionService 中基于 Decimal 的计算（process_position_attendance_stats / apply_attendance_adjustment /
+compute_rule_amount / compute_category_commission）结果完全一致，但：
+
+- 员工数据在构造时一次性转换为整数分（DECIMAL(12,2)）存放在紧凑数组中，折扣因子使用基点；
+- 计算过程中只使用 (整数系数, 十进制指数) 对，乘除按 decimal 默认上下文（28 位有效数字、ROUND_HALF_EVEN）舍入，
+  因此连团队分摊等无限小数产生的舍入方向也与 Decimal 路径相同；
+- 不输出逐员工的 debug 日志，只在写库前转换回 Decimal。
+
+golden_compare 用同一份输入分别跑两条路径并返回不一致项；
+python -m app.services.commission_kernel 会用随机数据（含整除边界）跑一遍校验。
+"""
+import asyncio
+import random
+from array import array
+from decimal import Decimal
+
+from app.services.commission_service import CommissionService, CATEGORY_FIELD_MAP
+
+# 与 decimal 默认上下文精度一致
+PRECISION = 28
+_LIMIT = 10 ** PRECISION
+
+_ZERO = (0, 0)
+_HUNDRED = (100, 0)
+
+
+def _fixed(value) -> tuple:
+    """数值 -> (系数, 指数)，与 Decimal(str(value)) 等值"""
+    if value is None:
+        return _ZERO
+    if isinstance(value, int):
+        return value, 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    sign, digits, exponent = value.as_tuple()
+    coefficient = int(''.join(map(str, digits))) if digits else 0
+    return (-coefficient if sign else coefficient), exponent
+
+
+def _cents(value) -> int:
+    """DECIMAL(12,2) 数值 -> 整数分"""
+    coefficient, exponent = _fixed(value)
+    if exponent >= -2:
+        return coefficient * 10 ** (exponent + 2)
+    scaled, remainder = divmod(coefficient, 10 ** (-2 - exponent))
+    if remainder:
+        raise ValueError(f"{value} has more than 2 decimal places")
+    return scaled
+
+
+def _drop_digits(coefficient: int, exponent: int, drop: int, sticky: bool = False) -> tuple:
+    """去掉低 drop 位并按 ROUND_HALF_EVEN 进位；sticky 表示被截掉的部分之后还有非零余数"""
+    negative = coefficient < 0
+    quotient, remainder = divmod(abs(coefficient), 10 ** drop)
+    half = 5 * 10 ** (drop - 1)
+    if remainder > half or (remainder == half and (sticky or quotient & 1)):
+        quotient += 1
+    return (-quotient if negative else quotient), exponent + drop
+
+
+def _normalize(coefficient: int, exponent: int) -> tuple:
+    """舍入到 PRECISION 位有效数字"""
+    digits = len(str(abs(coefficient)))
+    if digits <= PRECISION:
+        return coefficient, exponent
+    coefficient, exponent = _drop_digits(coefficient, exponent, digits - PRECISION)
+    if abs(coefficient) == _LIMIT:
+        coefficient //= 10
+        exponent += 1
+    return coefficient, exponent
+
+
+def _mul(a: tuple, b: tuple) -> tuple:
+    return _normalize(a[0] * b[0], a[1] + b[1])
+
+
+def _div(a: tuple, b: tuple) -> tuple:
+    """a / b，结果正确舍入到 PRECISION 位有效数字（与 decimal 相同）"""
+    if a[0] == 0:
+        return _ZERO
+    negative = (a[0] < 0) != (b[0] < 0)
+    numerator, denominator = abs(a[0]), abs(b[0])
+    shift = max(0, PRECISION + 1 + len(str(denominator)) - len(str(numerator)))
+    quotient, remainder = divmod(numerator * 10 ** shift, denominator)
+    drop = len(str(quotient)) - PRECISION
+    coefficient, exponent = _drop_digits(quotient, a[1] - b[1] - shift, drop, remainder > 0)
+    if coefficient == _LIMIT:
+        coefficient //= 10
+        exponent += 1
+    return (-coefficient if negative else coefficient), exponent
+
+
+def _cmp(a: tuple, b: tuple) -> int:
+    (ac, ae), (bc, be) = a, b
+    if ae > be:
+        ac *= 10 ** (ae - be)
+    elif be > ae:
+        bc *= 10 ** (be - ae)
+    return (ac > bc) - (ac < bc)
+
+
+def _quantize(a: tuple, exponent: int) -> tuple:
+    """等价于 round(Decimal, -exponent)"""
+    if a[1] >= exponent:
+        return a
+    return _drop_digits(a[0], a[1], exponent - a[1])
+
+
+def _to_decimal(a: tuple) -> Decimal:
+    return Decimal(a[0]).scaleb(a[1])
+
+
+class CommissionKernel:
+    """
+    单个门店的整数佣金计算内核
+
+    员工列: actual / expected / target / sales（整数分）、position（岗位下标）、discount（折扣基点）
+    岗位出勤合计以 分×基点 (1e-6 天) 为单位保存，团队分摊时直接使用。
+    """
+
+    def __init__(self, staff_attendances: list, opening_days: int = 0, fiscal_days: int = 0):
+        """
+        Args:
+            staff_attendances: CommissionService.merge_staff_attendances 的结果
+            opening_days: 开店天数
+            fiscal_days: 财月天数
+        """
+        self.opening_days = opening_days
+        self.fiscal_days = fiscal_days
+        self.position_names = []
+        position_index = {}
+
+        self.actual = array('q')
+        self.expected = array('q')
+        self.target = array('q')
+        self.sales = array('q')
+        self.position = array('l')
+        self.discount = array('l')
+
+        for staff in staff_attendances:
+            position = staff['position']
+            if position not in position_index:
+                position_index[position] = len(self.position_names)
+                self.position_names.append(position)
+            self.position.append(position_index[position])
+            self.actual.append(_cents(staff['actual_attendance'] or 0))
+            self.expected.append(_cents(staff['expected_attendance'] or 0))
+            self.target.append(_cents(staff['target_value']))
+            self.sales.append(_cents(staff['sales_value'] or 0))
+
+        for i in range(len(self.actual)):
+            self.discount.append(self._discount_bp(self.sales[i], self.target[i]))
+
+        self.position_total = [0] * len(self.position_names)
+        self.position_count = [0] * len(self.position_names)
+        for i in range(len(self.actual)):
+            self.position_total[self.position[i]] += self.actual[i] * self.discount[i]
+            self.position_count[self.position[i]] += 1
+
+    @staticmethod
+    def _discount_bp(sales_cents: int, target_cents: int) -> int:
+        """与 CommissionService.calculate_discount_factor 相同，返回基点"""
+        if target_cents <= 0:
+            return 7500
+        achievement_rate = _mul(_div((sales_cents, -2), (target_cents, -2)), _HUNDRED)
+        if _cmp(achievement_rate, (80, 0)) < 0:
+            return 7500
+        if _cmp(achievement_rate, _HUNDRED) < 0:
+            return 8500
+        return 10000
+
+    def position_stats(self) -> dict:
+        """与 process_position_attendance_stats 结果相同的岗位统计"""
+        return {
+            name: {'total_attendance': _to_decimal((self.position_total[idx], -6)),
+                   'staff_count': self.position_count[idx]}
+            for idx, name in enumerate(self.position_names)
+        }
+
+    @staticmethod
+    def category_commission(category_coefficients: dict, category_sales: dict) -> dict:
+        """与 compute_category_commission 结果相同的品类奖金"""
+        if not category_coefficients or not category_sales:
+            return {'total': Decimal('0')}
+
+        result = {}
+        total = 0
+        for cat_name in CATEGORY_FIELD_MAP:
+            sales_value = category_sales.get(cat_name, Decimal('0'))
+            coefficient = category_coefficients.get(cat_name)
+            if coefficient is not None:
+                amount = _quantize(_mul(_fixed(sales_value), _div(_fixed(coefficient), _HUNDRED)), 0)
+                total += amount[0] * 10 ** amount[1]
+                result[cat_name] = {
+                    'sales_value': Decimal(str(sales_value)),
+                    'amount': _to_decimal(amount),
+                    'tier_bonus_rate': coefficient
+                }
+            else:
+                result[cat_name] = {
+                    'sales_value': Decimal(str(sales_value)),
+                    'amount': Decimal('0'),
+                    'tier_bonus_rate': None
+                }
+        result['total'] = Decimal(total)
+        return result
+
+    @staticmethod
+    def supports(rule_info, rule_detail_value, sales_value) -> bool:
+        """
+        内核只处理 Decimal 路径中有确定结果的组合；
+        其余（未知 rule_type 时 Decimal 路径以 float 0.0 参与运算）交回 compute_rule_amount
+        """
+        if rule_detail_value < 0 or rule_info.rule_type == 'incentive':
+            return True
+        return rule_info.rule_type == 'commission' and sales_value is not None
+
+    def _attendance_base(self, i: int, rule_info) -> tuple:
+        if rule_info.attendance_calculation_logic == 1 and self.opening_days and self.opening_days > 0:
+            return self.opening_days, 0
+        if rule_info.attendance_calculation_logic == 2 and self.fiscal_days and self.fiscal_days > 0:
+            return self.fiscal_days, 0
+        return self.expected[i], -2
+
+    def _apply_attendance(self, i: int, amount: tuple, rule_info) -> tuple:
+        """与 apply_attendance_adjustment 相同，返回 (金额, 因子或 None)"""
+        actual = self.actual[i]
+        if actual <= 0:
+            return _ZERO, None
+        if not rule_info.consider_attendance or self.expected[i] == 0:
+            return amount, None
+
+        if rule_info.consider_attendance == 1:
+            total = self.position_total[self.position[i]]
+            if total > 0:
+                factor = _div((actual * self.discount[i], -6), (total, -6))
+                return _mul(amount, factor), factor
+        elif rule_info.consider_attendance == 2:
+            factor = _div((actual, -2), self._attendance_base(i, rule_info))
+            return _mul(amount, factor), factor
+        return amount, None
+
+    def rule_amount(self, i: int, rule_info, rule_detail_value, sales_value, category_total) -> tuple:
+        """
+        与 CommissionService.compute_rule_amount 相同
+
+        Args:
+            i: 员工下标（构造时 staff_attendances 的顺序）
+            rule_info: 规则信息
+            rule_detail_value: 匹配到的规则明细值
+            sales_value: 计算基础销售额
+            category_total: 品类奖金合计（品类规则时使用）
+
+        Returns:
+            tuple: (commission_amount, factor)
+        """
+        value = _fixed(rule_detail_value)
+        category_rule = value[0] < 0
+        if category_rule:
+            amount = _fixed(category_total)
+        elif rule_info.rule_type == 'commission':
+            amount = _mul(_fixed(sales_value), _div(value, _HUNDRED))
+        else:
+            amount = value
+
+        factor = None
+        if rule_info.consider_attendance and rule_info.consider_attendance > 0:
+            amount, factor = self._apply_attendance(i, amount, rule_info)
+
+        if rule_info.minimum_guarantee:
+            minimum_guarantee = _fixed(rule_info.minimum_guarantee)
+            if _cmp(amount, minimum_guarantee) < 0:
+                old_amount = amount
+                amount = minimum_guarantee
+                expected = self.expected[i]
+
+                if rule_info.minimum_guarantee_on_attendance == 1 and expected > 0:
+                    factor = _div((self.actual[i], -2), self._attendance_base(i, rule_info))
+                    amount = _mul(minimum_guarantee, factor)
+                    if _cmp(old_amount, amount) > 0:
+                        amount = old_amount
+                elif rule_info.minimum_guarantee_on_attendance > 1 and expected > 0:
+                    attendance_percentage = _mul(
+                        _div((self.actual[i], -2), self._attendance_base(i, rule_info)), _HUNDRED)
+                    if _cmp(attendance_percentage, _fixed(rule_info.minimum_guarantee_on_attendance)) < 0:
+                        amount = _ZERO
+                elif expected == 0:
+                    amount = _ZERO
+
+        if not category_rule:
+            amount = _quantize(amount, 1)
+
+        return _to_decimal(amount), (_to_decimal(factor) if factor is not None else None)
+
+    def rule_amounts(self, rows: list) -> list:
+        """
+        批量计算 员工×规则 行
+
+        Args:
+            rows: [(员工下标, rule_info, rule_detail_value, sales_value, category_total)]
+
+        Returns:
+            list: [(commission_amount, factor)]，与 rows 一一对应
+        """
+        staff_index = array('l', (row[0] for row in rows))
+        return [self.rule_amount(staff_index[n], *rows[n][1:]) for n in range(len(rows))]
+
+
+def _same(a, b) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    return Decimal(str(a)) == Decimal(str(b))
+
+
+def golden_compare(staff_attendances: list, rules: list, detail_values: list, category_coefficients: dict,
+                   category_sales: dict, store_sales_value, opening_days: int = 0, fiscal_days: int = 0) -> list:
+    """
+    用同一份输入对比 Decimal 路径与整数内核
+
+    Args:
+            staff_attendances: 合并后的员工数据
+            rules: rule_info 列表
+            detail_values: 需要覆盖的规则明细值（负数表示品类规则）
+            category_coefficients: {level_value_1: Decimal 系数}
+            category_sales: {staff_code: {level_value_1: 销售额}}
+            store_sales_value: 门店销售额（store 规则的计算基础）
+            opening_days: 开店天数
+            fiscal_days: 财月天数
+
+    Returns:
+        list: 不一致项描述，为空表示完全一致
+    """
+    mismatches = []
+    kernel = CommissionKernel(staff_attendances, opening_days, fiscal_days)
+
+    expected_stats = asyncio.run(CommissionService.process_position_attendance_stats(staff_attendances))
+    actual_stats = kernel.position_stats()
+    for position, stat in expected_stats.items():
+        if not _same(stat['total_attendance'], actual_stats[position]['total_attendance']) or \
+                stat['staff_count'] != actual_stats[position]['staff_count']:
+            mismatches.append(f"position {position}: {stat} != {actual_stats[position]}")
+
+    for i, staff in enumerate(staff_attendances):
+        staff_category_sales = category_sales.get(staff['staff_code'], {})
+        expected_category = CommissionService.compute_category_commission(
+            'golden', staff['staff_code'], category_coefficients, staff_category_sales)
+        actual_category = CommissionKernel.category_commission(category_coefficients, staff_category_sales)
+        if not _same(expected_category['total'], actual_category['total']):
+            mismatches.append(f"{staff['staff_code']} category: {expected_category} != {actual_category}")
+
+        for rule_info in rules:
+            sales_value = staff['sales_value'] if rule_info.rule_basis == 'individual' else store_sales_value
+            for detail_value in detail_values:
+                if not CommissionKernel.supports(rule_info, detail_value, sales_value):
+                    continue
+                try:
+                    expected = CommissionService.compute_rule_amount(
+                        staff, rule_info, detail_value, sales_value, expected_category, expected_stats,
+                        opening_days, fiscal_days)
+                except TypeError:
+                    expected = TypeError
+                try:
+                    actual = kernel.rule_amount(i, rule_info, detail_value, sales_value, actual_category['total'])
+                except TypeError:
+                    actual = TypeError
+                if expected is TypeError or actual is TypeError:
+                    if expected is not actual:
+                        mismatches.append(f"{staff['staff_code']} {rule_info.rule_code} {detail_value}: "
+                                          f"{expected} != {actual}")
+                elif not (_same(expected[0], actual[0]) and _same(expected[1], actual[1])):
+                    mismatches.append(f"{staff['staff_code']} {rule_info.rule_code} {detail_value}: "
+                                      f"{expected} != {actual}")
+    return mismatches
+
+
+def _random_golden_case(rnd: random.Random) -> dict:
+    """随机生成一组输入；出勤取相同值、金额取 5 的倍数以覆盖团队分摊的整除/舍入边界"""
+    from types import SimpleNamespace
+
+    def money(low, high):
+        return Decimal(rnd.randint(low * 100, high * 100)) / 100
+
+    positions = ['SA', 'SM', 'ASM']
+    staff_attendances = []
+    category_sales = {}
+    shared_attendance = Decimal(rnd.choice([7, 13, 21, 26]))
+    for k in range(rnd.randint(1, 9)):
+        staff_code = f'E{k}'
+        staff_attendances.append({
+            'staff_code': staff_code,
+            'position': rnd.choice(positions),
+            'actual_attendance': rnd.choice([shared_attendance, money(0, 31), Decimal(0)]),
+            'expected_attendance': rnd.choice([Decimal(0), Decimal(22), Decimal(26), money(1, 31)]),
+            'target_value': rnd.choice([0, money(0, 90000)]),
+            'sales_value': rnd.choice([0, money(0, 120000)]),
+        })
+        category_sales[staff_code] = {cat: money(0, 30000) for cat in rnd.sample(list(CATEGORY_FIELD_MAP), 3)}
+
+    rules = []
+    for n in range(6):
+        rules.append(SimpleNamespace(
+            rule_code=f'G-{n}',
+            rule_type=rnd.choice(['commission', 'incentive']),
+            rule_basis=rnd.choice(['individual', 'store']),
+            consider_attendance=rnd.choice([0, 1, 2]),
+            attendance_calculation_logic=rnd.choice([0, 1, 2]),
+            minimum_guarantee=rnd.choice([None, Decimal(0), Decimal(rnd.randint(1, 200) * 5)]),
+            minimum_guarantee_on_attendance=rnd.choice([0, 1, 2, Decimal('85.5'), 90]),
+        ))
+
+    return {
+        'staff_attendances': staff_attendances,
+        'rules': rules,
+        'detail_values': [Decimal(-1), Decimal(0), money(0, 3), Decimal(45), Decimal(rnd.randint(1, 300) * 5)],
+        'category_coefficients': {cat: money(0, 5) for cat in rnd.sample(list(CATEGORY_FIELD_MAP), 4)},
+        'category_sales': category_sales,
+        'store_sales_value': money(0, 900000),
+        'opening_days': rnd.choice([None, 0, 20, 31]),
+        'fiscal_days': rnd.choice([0, 28, 35]),
+    }
+
+
+if __name__ == '__main__':
+    import logging
+    import sys
+
+    logging.getLogger('app').setLevel(logging.ERROR)
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    generator = random.Random(20250301)
+    failures = 0
+    for case_no in range(cases):
+        case_mismatches = golden_compare(**_random_golden_case(generator))
+        if case_mismatches:
+            failures += 1
+            print(f"case {case_no}: {case_mismatches[:3]}")
+    print(f"{cases} cases, {failures} with mismatches")
+    sys.exit(1 if failures else 0)
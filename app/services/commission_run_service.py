@@ -0,0 +1,195 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy.future import select
+
+from app.database import SessionLocal
+from app.models.commission import CommissionStoreModel
+from app.services.commission_service import CommissionService
+from app.services.report_cache_service import ReportCache
+from app.utils.logger import app_logger
+
+# 默认并发数，需小于 MySQL 连接池大小(pool_size + max_overflow)
+MONTH_END_CONCURRENCY = 4
+MONTH_END_MAX_CONCURRENCY = 16
+# 内存中保留的运行记录数
+MONTH_END_RUN_HISTORY = 20
+
+
+class CommissionRunService:
+    """
+    月结佣金并行计算
+
+    门店分发到有上限的 asyncio worker 池，每个 worker 使用自己的 SessionLocal 会话调用
+    CommissionService.calculate_commissions_for_store。运行记录保存在进程内存中，供前端轮询进度。
+    """
+
+    _runs = {}
+    _tasks = {}
+
+    @staticmethod
+    async def start_month_end_run(fiscal_month: str, store_codes: Optional[List[str]] = None,
+                                  user_code: str = None, concurrency: int = MONTH_END_CONCURRENCY) -> dict:
+        """
+        启动月结计算，立即返回运行记录
+
+        Args:
+            fiscal_month: 财月
+            store_codes: 门店列表，为空时计算 commissions_store 中该财月的全部门店
+            user_code: 操作人
+            concurrency: worker 数量
+
+        Returns:
+            dict: 运行记录摘要
+        """
+        # 同一财月只允许一个运行中的任务；检查与登记之间没有 await，并发请求不会同时通过检查
+        for run in CommissionRunService._runs.values():
+            if run['fiscal_month'] == fiscal_month and run['status'] in ('pending', 'running'):
+                app_logger.info(f"Month end run {run['run_id']} for {fiscal_month} is already running")
+                return CommissionRunService.get_run(run['run_id'])
+
+        concurrency = max(1, min(concurrency or MONTH_END_CONCURRENCY, MONTH_END_MAX_CONCURRENCY))
+        run_id = uuid.uuid4().hex
+        run = {
+            "run_id": run_id,
+            "fiscal_month": fiscal_month,
+            "status": "pending",
+            "created_by": user_code,
+            "created_at": datetime.now(),
+            "started_at": None,
+            "finished_at": None,
+            "concurrency": concurrency,
+            "total": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "stores": {}
+        }
+        if store_codes:
+            CommissionRunService._set_stores(run, store_codes)
+        CommissionRunService._runs[run_id] = run
+        CommissionRunService._trim_history()
+
+        task = asyncio.create_task(CommissionRunService._execute_run(run, user_code, load_stores=not store_codes))
+        CommissionRunService._tasks[run_id] = task
+        task.add_done_callback(lambda _: CommissionRunService._tasks.pop(run_id, None))
+
+        app_logger.info(f"Month end run {run_id} created for {fiscal_month}: "
+                        f"{len(store_codes) if store_codes else 'all'} stores, concurrency {concurrency}")
+        return CommissionRunService.get_run(run_id)
+
+    @staticmethod
+    def _set_stores(run: dict, store_codes: List[str]):
+        # 去重并保持顺序，total 与 stores 一致，进度才能到 100
+        store_codes = list(dict.fromkeys(store_codes))
+        run['total'] = len(store_codes)
+        run['stores'] = {
+            store_code: {"status": "pending", "started_at": None, "finished_at": None,
+                         "elapsed": None, "error": None}
+            for store_code in store_codes
+        }
+
+    @staticmethod
+    async def _load_store_codes(fiscal_month: str) -> List[str]:
+        """commissions_store 中该财月的全部门店"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(CommissionStoreModel.store_code)
+                .where(CommissionStoreModel.fiscal_month == fiscal_month)
+                .order_by(CommissionStoreModel.store_code)
+            )
+            return [row.store_code for row in result.fetchall()]
+
+    @staticmethod
+    def get_run(run_id: str, with_stores: bool = False) -> Optional[dict]:
+        """查询运行进度"""
+        run = CommissionRunService._runs.get(run_id)
+        if run is None:
+            return None
+
+        finished = run['succeeded'] + run['failed']
+        summary = {key: value for key, value in run.items() if key != 'stores'}
+        summary['processed'] = finished
+        if run['total']:
+            summary['progress'] = round(finished / run['total'] * 100, 2)
+        else:
+            # 门店列表尚未加载时进度为 0
+            summary['progress'] = 0 if run['status'] in ('pending', 'running') else 100
+        summary['errors'] = {store_code: info['error']
+                             for store_code, info in run['stores'].items() if info['status'] == 'failed'}
+        if with_stores:
+            summary['stores'] = run['stores']
+        return summary
+
+    @staticmethod
+    def list_runs(fiscal_month: str = None) -> list:
+        return [CommissionRunService.get_run(run_id)
+                for run_id, run in CommissionRunService._runs.items()
+                if fiscal_month is None or run['fiscal_month'] == fiscal_month]
+
+    @staticmethod
+    def _trim_history():
+        finished = [run_id for run_id, run in CommissionRunService._runs.items()
+                    if run['status'] not in ('pending', 'running')]
+        while len(CommissionRunService._runs) > MONTH_END_RUN_HISTORY and finished:
+            CommissionRunService._runs.pop(finished.pop(0), None)
+
+    @staticmethod
+    async def _execute_run(run: dict, user_code: str, load_stores: bool = False):
+        run['status'] = 'running'
+        run['started_at'] = datetime.now()
+        app_logger.info(f"Month end run {run['run_id']} started")
+
+        try:
+            if load_stores:
+                CommissionRunService._set_stores(
+                    run, await CommissionRunService._load_store_codes(run['fiscal_month']))
+                app_logger.info(f"Month end run {run['run_id']}: {run['total']} stores")
+
+            queue = asyncio.Queue()
+            for store_code in run['stores']:
+                queue.put_nowait(store_code)
+
+            workers = [asyncio.create_task(CommissionRunService._worker(run, queue, user_code))
+                       for _ in range(min(run['concurrency'], max(run['total'], 1)))]
+            await asyncio.gather(*workers)
+            run['status'] = 'completed' if run['failed'] == 0 else 'completed_with_errors'
+        except Exception as e:
+            app_logger.error(f"Month end run {run['run_id']} aborted: {e}", exc_info=True)
+            run['status'] = 'aborted'
+        finally:
+            run['finished_at'] = datetime.now()
+            ReportCache.invalidate(run['fiscal_month'])
+            app_logger.info(f"Month end run {run['run_id']} {run['status']}: "
+                            f"{run['succeeded']} succeeded, {run['failed']} failed")
+
+    @staticmethod
+    async def _worker(run: dict, queue: asyncio.Queue, user_code: str):
+        """每个 worker 持有独立会话，依次处理队列中的门店"""
+        async with SessionLocal() as db:
+            while True:
+                try:
+                    store_code = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                store_info = run['stores'][store_code]
+                store_info['status'] = 'running'
+                store_info['started_at'] = datetime.now()
+                started = time.perf_counter()
+                try:
+                    await CommissionService.calculate_commissions_for_store(
+                        db, store_code, run['fiscal_month'], user_code)
+                    store_info['status'] = 'succeeded'
+                    run['succeeded'] += 1
+                except Exception as e:
+                    # calculate_commissions_for_store 内部已回滚
+                    store_info['status'] = 'failed'
+                    store_info['error'] = str(e)
+                    run['failed'] += 1
+                    app_logger.error(f"Month end run {run['run_id']} store {store_code} failed: {e}")
+                finally:
+                    store_info['finished_at'] = datetime.now()
+                    store_info['elapsed'] = round(time.perf_counter() - started, 3)
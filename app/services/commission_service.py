@@ -1,11 +1,12 @@
+from types import SimpleNamespace
 from typing import List, Dict
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.models.commission import CommissionStaffModel, CommissionStoreModel, CommissionRuleModel, \
-    CommissionRuleAssignmentModel, CommissionRuleDetailModel, CommissionMainModel, CommissionStaffDetailModel, \
-    CommissionRuleCategory, StaffSalesCategory, CommissionTrialStaffDetailModel
-from app.models.dimension import StoreModel, DimensionDayWeek, RoleOrgJoin
+    CommissionRuleDetailModel, CommissionMainModel, CommissionStaffDetailModel, \
+    StaffSalesCategory, CommissionTrialStaffDetailModel, CommissionStaffSummaryModel
+from app.models.dimension import StoreModel, RoleOrgJoin
 from app.models.staff import StaffAttendanceModel, StaffModel
 from app.schemas.commission import CommissionStaffCreate, BatchApprovedCommission
 from app.models.target import TargetStoreMain
@@ -15,6 +16,11 @@ from sqlalchemy import func, or_, exists, case, distinct, union_all, DECIMAL
 from sqlalchemy.orm import aliased
 from sqlalchemy import delete, update
 from app.utils.permissions import build_store_permission_query
+from app.utils.keyset import keyset_after
+from app.services.rule_catalog_service import CommissionRuleCatalog
+from app.services.commission_dirty_service import CommissionDirtyService, WHOLE_STORE
+from app.services.commission_summary_service import CommissionSummaryService
+from app.services.fiscal_calendar_service import FiscalCalendar
 from app.utils.logger import app_logger
 from decimal import Decimal
 
@@ -44,204 +50,288 @@ class CommissionRPTService:
             app_logger.info(f"Starting get_rpt_commission_by_store for fiscal_month: {fiscal_month}, "
                             f"key_word: {key_word}, status: {status}, role_code: {role_code}")
 
-            # 构建查询，包含所有需要的字段
-            store_permission_query = build_store_permission_query(role_code)
-            store_alias = store_permission_query.subquery()
+            formatted_data = [row async for row in CommissionRPTService.iter_rpt_commission_by_store(
+                db, fiscal_month, key_word, status, role_code)]
+            app_logger.info(f"Returning {len(formatted_data)} formatted records")
 
-            # 主查询 - 获取员工详细信息
-            query = (
-                select(
-                    CommissionStaffDetailModel.staff_code.label('staff_code'),
-                    func.concat(StaffModel.first_name, StaffModel.last_name).label('full_name'),
-                    StaffModel.position_code.label('position_code'),
-                    StaffModel.terminated_date.label('terminated_date'),
-                    CommissionStaffDetailModel.position.label('position'),
-                    CommissionStaffDetailModel.expected_attendance,
-                    CommissionStaffDetailModel.actual_attendance,
-                    CommissionStaffDetailModel.staff_target_value,
-                    CommissionStaffDetailModel.staff_sales_value,
-                    CommissionStaffDetailModel.staff_achievement_rate,
-                    CommissionRuleDetailModel.value.label('individual_commission_percent'),
-                    CommissionStaffDetailModel.amount,
-                    CommissionRuleModel.rule_code,
-                    CommissionRuleModel.rule_type,
-                    CommissionRuleModel.rule_class,
-                    CommissionStaffDetailModel.total_days_store_work,
-                    CommissionStaffDetailModel.store_code,
-                    CommissionStoreModel.store_type,
-                    CommissionStaffDetailModel.fiscal_month.label('fiscal_month'),
-                    CommissionStaffDetailModel.store_sales_value,
-                    CommissionStaffDetailModel.store_target_value,
-                    CommissionStaffDetailModel.store_achievement_rate,
-                    store_alias.c.store_name,
-                    store_alias.c.manage_region.label('manage_region'),
-                    store_alias.c.manage_channel.label('manage_channel'),
-                    store_alias.c.City.label('city'),
-                    store_alias.c.City_Tier.label('city_tier'),
-                    CommissionStaffDetailModel.staff_sales_1,
-                    CommissionStaffDetailModel.staff_sales_2,
-                    CommissionStaffDetailModel.staff_sales_3,
-                    CommissionStaffDetailModel.staff_sales_4,
-                    CommissionStaffDetailModel.staff_sales_5,
-                    CommissionStaffDetailModel.staff_sales_6,
-                    CommissionStaffDetailModel.staff_sales_7,
-                    CommissionStaffDetailModel.staff_sales_8,
-                    CommissionStaffDetailModel.tier_bonus_rate_1,
-                    CommissionStaffDetailModel.tier_bonus_rate_2,
-                    CommissionStaffDetailModel.tier_bonus_rate_3,
-                    CommissionStaffDetailModel.tier_bonus_rate_4,
-                    CommissionStaffDetailModel.tier_bonus_rate_5,
-                    CommissionStaffDetailModel.tier_bonus_rate_6,
-                    CommissionStaffDetailModel.tier_bonus_rate_7,
-                    CommissionStaffDetailModel.tier_bonus_rate_8,
-                    CommissionStaffDetailModel.amount_1,
-                    CommissionStaffDetailModel.amount_2,
-                    CommissionStaffDetailModel.amount_3,
-                    CommissionStaffDetailModel.amount_4,
-                    CommissionStaffDetailModel.amount_5,
-                    CommissionStaffDetailModel.amount_6,
-                    CommissionStaffDetailModel.amount_7,
-                    CommissionStaffDetailModel.amount_8
+            return {
+                "data": formatted_data,
+                "field_translations": CommissionRPTService.commission_by_store_field_translations()
+            }
 
-                )
-                .select_from(CommissionStaffDetailModel)
-                .join(CommissionStoreModel,
-                      (CommissionStaffDetailModel.fiscal_month == CommissionStoreModel.fiscal_month) &
-                      (CommissionStaffDetailModel.store_code == CommissionStoreModel.store_code))
-                .join(CommissionRuleDetailModel,
-                      CommissionStaffDetailModel.rule_detail_code == CommissionRuleDetailModel.rule_detail_code)
-                .join(CommissionRuleModel,
-                      CommissionRuleDetailModel.rule_code == CommissionRuleModel.rule_code)
-                .join(StaffModel,
-                      CommissionStaffDetailModel.staff_code == StaffModel.staff_code)
-                .join(store_alias,
-                      CommissionStaffDetailModel.store_code == store_alias.c.store_code)
-                .where(CommissionStaffDetailModel.fiscal_month == fiscal_month)
-            )
+        except Exception as e:
+            app_logger.error(f"Error in get_rpt_commission_by_store: {str(e)}", exc_info=True)
+            raise e
 
-            # 如果提供了关键词，则添加过滤条件
-            if key_word:
-                app_logger.debug(f"Applying keyword filter: {key_word}")
-                query = query.where(
-                    or_(
-                        CommissionStoreModel.store_code.contains(key_word),
-                        store_alias.c.store_name.contains(key_word),
-                        store_alias.c.manage_channel.contains(key_word),
-                        store_alias.c.manage_region.contains(key_word),
-                        StaffModel.staff_code.contains(key_word)
-                    )
-                )
-            if status != 'All':
-                app_logger.debug(f"Applying status filter: {status}")
-                query = query.where(CommissionStoreModel.status == status)
+    @staticmethod
+    def commission_by_store_field_translations() -> dict:
+        """门店佣金报表的字段翻译（包含列宽）"""
+        field_translations = {
+            "staff_no": {"en": "Staff No.", "zh": "员工ID", "width": 100},
+            "full_name": {"en": "Staff Name", "zh": "员工姓名", "width": 120},
+            "position_from_wd": {"en": "Workday Position", "zh": "员工职位", "width": 120},
+            "position": {"en": "Position", "zh": "职位类型", "width": 100},
+            "terminated_date": {"en": "Terminated Date", "zh": "离职日期", "width": 120},
+            "expected_attendance": {"en": "Required Attendance", "zh": "应出勤", "width": 100},
+            "actual_attendance": {"en": "Actual Attendance", "zh": "实出勤", "width": 100},
+            "monthly_target": {"en": "Monthly Target", "zh": "月度指标", "width": 110},
+            "Sales": {"en": "Sales", "zh": "销售额", "width": 110},
+            "achievement_rate": {"en": "Achievement Rate", "zh": "销售达成率", "width": 120},
+            "individual_commission_percent": {"en": "Individual Rate", "zh": "个提比例", "width": 100},
+            "amount_individual": {"en": "Individual", "zh": "个人提成", "width": 100},
+            "amount_team": {"en": "Pool", "zh": "团队提成", "width": 100},
+            "commission_only": {"en": "Commission Only", "zh": "仅奖金部分", "width": 120},
+            "amount_operational": {"en": "Operation", "zh": "运营奖金", "width": 100},
+            "amount_incentive": {"en": "Incentive", "zh": "激励奖金", "width": 100},
+            "amount_adjustment": {"en": "Adjustment", "zh": "调整奖金", "width": 100},
+            "total_commission": {"en": "Total Commission", "zh": "总奖金", "width": 110},
+            "store_code": {"en": "Store Code", "zh": "店铺代码", "width": 100},
+            "store_name": {"en": "Store Name", "zh": "店铺名称", "width": 120},
+            "store_type": {"en": "Store Type", "zh": "店铺类型", "width": 100},
+            "fiscal_month": {"en": "Fiscal Month", "zh": "财月", "width": 100},
+            "individual_rule": {"en": "Individual Type", "zh": "个提规则", "width": 100},
+            "team_rule": {"en": "Pool Type", "zh": "团提规则", "width": 100},
+            "total_days_store_work": {"en": "Total Store Actual Attendance", "zh": "店铺总实出勤", "width": 150},
+            "store_sales_value": {"en": "Store Sales", "zh": "店铺销售", "width": 100},
+            "store_achievement_rate": {"en": "Store Achieved Rate", "zh": "店铺达成率", "width": 130},
+            "manage_region": {"en": "Region", "zh": "店铺区域", "width": 100},
+            "region_achievement_rate": {"en": "Regional Achieved Rate", "zh": "区域达成率", "width": 140},
+            "manage_channel": {"en": "Channel", "zh": "渠道", "width": 100},
+            "channel_achievement_rate": {"en": "Channel Achieved Rate", "zh": "渠道达成率", "width": 140},
+            "city": {"en": "City", "zh": "城市", "width": 100},
+            "city_tier": {"en": "City Tier", "zh": "城市等级", "width": 100}
+        }
+        for cat_name in CATEGORY_INDEX_MAP:
+            field_translations[f'{cat_name}_sales_value'] = {"en": f"{cat_name} Sales",
+                                                             "zh": f"{cat_name}销售额", "width": 120}
+        for cat_name in CATEGORY_INDEX_MAP:
+            field_translations[f'{cat_name}_bonus_rate'] = {"en": f"{cat_name} Commission Rate",
+                                                            "zh": f"{cat_name}奖金比例", "width": 120}
+        for cat_name in CATEGORY_INDEX_MAP:
+            field_translations[f'{cat_name}_bonus_commission'] = {"en": f"{cat_name} Commission",
+                                                                  "zh": f"{cat_name}奖金", "width": 120}
+        return field_translations
 
-            app_logger.debug("Executing main query")
-            result = await db.execute(query)
-            rows = result.fetchall()
-            app_logger.info(f"Fetched {len(rows)} rows from main query")
+    @staticmethod
+    async def iter_rpt_commission_by_store(db: AsyncSession, fiscal_month: str, key_word: str, status: str,
+                                           role_code: str, after: tuple = None):
+        """
+        流式产生门店佣金报表行，每个 (store_code, staff_code) 一行，按该顺序输出
 
-            # 获取区域、渠道和城市层级的聚合数据
-            # 区域达成率
-            if rows:
-                region_achievement_query = (
-                    select(
-                        store_alias.c.manage_region,
-                        func.sum(CommissionStaffDetailModel.store_sales_value).label('region_sales'),
-                        func.sum(CommissionStaffDetailModel.store_target_value).label('region_target')
-                    )
-                    .select_from(CommissionStaffDetailModel)
-                    .join(store_alias, CommissionStaffDetailModel.store_code == store_alias.c.store_code)
-                    .where(CommissionStaffDetailModel.fiscal_month == fiscal_month)
-                    .group_by(store_alias.c.manage_region)
-                )
+        明细查询使用 AsyncSession.stream 按 (store_code, staff_code, rule_code) 顺序读取，
+        同一员工的规则行连续出现，汇总完一个员工即输出，不在内存中保留整月数据。
+        迭代期间会话被流式游标占用，调用方在迭代结束（或 aclose）前不要用同一会话执行其他查询。
 
-                app_logger.debug("Executing optimized region achievement query")
-                region_result = await db.execute(region_achievement_query)
-                region_achievements = {
-                    row.manage_region: (row.region_sales / row.region_target * 100)
-                    if row.region_target and row.region_target > 0 else 0
-                    for row in region_result.fetchall()
-                }
-                app_logger.debug(f"Retrieved {len(region_achievements)} region achievements")
+        Args:
+            db: 数据库会话
+            fiscal_month: 财月
+            key_word: 关键字
+            status: 状态过滤
+            role_code: 角色代码
+            after: 上一页最后一行的 (store_code, staff_code)，为空时从头开始
 
-                channel_achievement_query = (
-                    select(
-                        store_alias.c.manage_channel,
-                        func.sum(CommissionStaffDetailModel.store_sales_value).label('channel_sales'),
-                        func.sum(CommissionStaffDetailModel.store_target_value).label('channel_target')
-                    )
-                    .select_from(CommissionStaffDetailModel)
-                    .join(store_alias, CommissionStaffDetailModel.store_code == store_alias.c.store_code)
-                    .where(CommissionStaffDetailModel.fiscal_month == fiscal_month)
-                    .group_by(store_alias.c.manage_channel)
+        Yields:
+            dict: 报表行
+        """
+        # 构建查询，包含所有需要的字段
+        store_permission_query = await build_store_permission_query(db, role_code)
+        store_alias = store_permission_query.subquery()
+
+        # 主查询 - 获取员工详细信息
+        query = (
+            select(
+                CommissionStaffDetailModel.staff_code.label('staff_code'),
+                func.concat(StaffModel.first_name, StaffModel.last_name).label('full_name'),
+                StaffModel.position_code.label('position_code'),
+                StaffModel.terminated_date.label('terminated_date'),
+                CommissionStaffDetailModel.position.label('position'),
+                CommissionStaffDetailModel.expected_attendance,
+                CommissionStaffDetailModel.actual_attendance,
+                CommissionStaffDetailModel.staff_target_value,
+                CommissionStaffDetailModel.staff_sales_value,
+                CommissionStaffDetailModel.staff_achievement_rate,
+                CommissionRuleDetailModel.value.label('individual_commission_percent'),
+                CommissionStaffDetailModel.amount,
+                CommissionRuleModel.rule_code,
+                CommissionRuleModel.rule_type,
+                CommissionRuleModel.rule_class,
+                CommissionStaffDetailModel.total_days_store_work,
+                CommissionStaffDetailModel.store_code,
+                CommissionStoreModel.store_type,
+                CommissionStaffDetailModel.fiscal_month.label('fiscal_month'),
+                CommissionStaffDetailModel.store_sales_value,
+                CommissionStaffDetailModel.store_target_value,
+                CommissionStaffDetailModel.store_achievement_rate,
+                store_alias.c.store_name,
+                store_alias.c.manage_region.label('manage_region'),
+                store_alias.c.manage_channel.label('manage_channel'),
+                store_alias.c.City.label('city'),
+                store_alias.c.City_Tier.label('city_tier'),
+                CommissionStaffDetailModel.staff_sales_1,
+                CommissionStaffDetailModel.staff_sales_2,
+                CommissionStaffDetailModel.staff_sales_3,
+                CommissionStaffDetailModel.staff_sales_4,
+                CommissionStaffDetailModel.staff_sales_5,
+                CommissionStaffDetailModel.staff_sales_6,
+                CommissionStaffDetailModel.staff_sales_7,
+                CommissionStaffDetailModel.staff_sales_8,
+                CommissionStaffDetailModel.tier_bonus_rate_1,
+                CommissionStaffDetailModel.tier_bonus_rate_2,
+                CommissionStaffDetailModel.tier_bonus_rate_3,
+                CommissionStaffDetailModel.tier_bonus_rate_4,
+                CommissionStaffDetailModel.tier_bonus_rate_5,
+                CommissionStaffDetailModel.tier_bonus_rate_6,
+                CommissionStaffDetailModel.tier_bonus_rate_7,
+                CommissionStaffDetailModel.tier_bonus_rate_8,
+                CommissionStaffDetailModel.amount_1,
+                CommissionStaffDetailModel.amount_2,
+                CommissionStaffDetailModel.amount_3,
+                CommissionStaffDetailModel.amount_4,
+                CommissionStaffDetailModel.amount_5,
+                CommissionStaffDetailModel.amount_6,
+                CommissionStaffDetailModel.amount_7,
+                CommissionStaffDetailModel.amount_8
+
+            )
+            .select_from(CommissionStaffDetailModel)
+            .join(CommissionStoreModel,
+                  (CommissionStaffDetailModel.fiscal_month == CommissionStoreModel.fiscal_month) &
+                  (CommissionStaffDetailModel.store_code == CommissionStoreModel.store_code))
+            .join(CommissionRuleDetailModel,
+                  CommissionStaffDetailModel.rule_detail_code == CommissionRuleDetailModel.rule_detail_code)
+            .join(CommissionRuleModel,
+                  CommissionRuleDetailModel.rule_code == CommissionRuleModel.rule_code)
+            .join(StaffModel,
+                  CommissionStaffDetailModel.staff_code == StaffModel.staff_code)
+            .join(store_alias,
+                  CommissionStaffDetailModel.store_code == store_alias.c.store_code)
+            .where(CommissionStaffDetailModel.fiscal_month == fiscal_month)
+        )
+
+        # 如果提供了关键词，则添加过滤条件
+        if key_word:
+            app_logger.debug(f"Applying keyword filter: {key_word}")
+            query = query.where(
+                or_(
+                    CommissionStoreModel.store_code.contains(key_word),
+                    store_alias.c.store_name.contains(key_word),
+                    store_alias.c.manage_channel.contains(key_word),
+                    store_alias.c.manage_region.contains(key_word),
+                    StaffModel.staff_code.contains(key_word)
                 )
+            )
+        if status != 'All':
+            app_logger.debug(f"Applying status filter: {status}")
+            query = query.where(CommissionStoreModel.status == status)
+        condition = keyset_after((CommissionStaffDetailModel.store_code, CommissionStaffDetailModel.staff_code), after)
+        if condition is not None:
+            query = query.where(condition)
+        query = query.order_by(CommissionStaffDetailModel.store_code, CommissionStaffDetailModel.staff_code,
+                               CommissionRuleModel.rule_code)
+
+        # 获取区域、渠道层级的聚合数据（在开始流式读取明细之前执行）
+        # 区域达成率
+        region_achievement_query = (
+            select(
+                store_alias.c.manage_region,
+                func.sum(CommissionStaffDetailModel.store_sales_value).label('region_sales'),
+                func.sum(CommissionStaffDetailModel.store_target_value).label('region_target')
+            )
+            .select_from(CommissionStaffDetailModel)
+            .join(store_alias, CommissionStaffDetailModel.store_code == store_alias.c.store_code)
+            .where(CommissionStaffDetailModel.fiscal_month == fiscal_month)
+            .group_by(store_alias.c.manage_region)
+        )
 
-                app_logger.debug("Executing optimized channel achievement query")
-                channel_result = await db.execute(channel_achievement_query)
-                channel_achievements = {
-                    row.manage_channel: (row.channel_sales / row.channel_target * 100)
-                    if row.channel_target and row.channel_target > 0 else 0
-                    for row in channel_result.fetchall()
-                }
-                app_logger.debug(f"Retrieved {len(channel_achievements)} channel achievements")
-            else:
-                region_achievements = {}
-                channel_achievements = {}
+        app_logger.debug("Executing optimized region achievement query")
+        region_result = await db.execute(region_achievement_query)
+        region_achievements = {
+            row.manage_region: (row.region_sales / row.region_target * 100)
+            if row.region_target and row.region_target > 0 else 0
+            for row in region_result.fetchall()
+        }
+        app_logger.debug(f"Retrieved {len(region_achievements)} region achievements")
 
-            # 按store_code和staff_code分组并汇总不同规则类型的佣金
-            from collections import defaultdict
-            category_defaults = {}
-            for cat_name, idx in CATEGORY_INDEX_MAP.items():
-                category_defaults[f'{cat_name}_sales_value'] = 0
-            for cat_name, idx in CATEGORY_INDEX_MAP.items():
-                category_defaults[f'{cat_name}_bonus_rate'] = 0
-            for cat_name, idx in CATEGORY_INDEX_MAP.items():
-                category_defaults[f'{cat_name}_bonus_commission'] = 0
-
-            staff_commissions = defaultdict(lambda: {
-                'staff_no': '',
-                'full_name': '',
-                'position_from_wd': '',
-                'position': '',
-                'terminated_date': '',
-                'expected_attendance': 0,
-                'actual_attendance': 0,
-                'monthly_target': 0,
-                'Sales': 0,
-                'achievement_rate': 0,
-                'individual_commission_percent': 0,
-                'amount_individual': Decimal('0'),
-                'amount_team': Decimal('0'),
-                'amount_operational': Decimal('0'),
-                'amount_incentive': Decimal('0'),
-                'amount_adjustment': Decimal('0'),
-                'commission_only': Decimal('0'),
-                'total_commission': Decimal('0'),
-                'fiscal_month': '',
-                "individual_rule": "",
-                "team_rule": "",
-                'total_days_store_work': 0.0,
-                'store_code': '',
-                'store_name': '',
-                'store_type': '',
-                'store_sales_value': 0,
-                'store_achievement_rate': 0,
-                'manage_region': '',
-                'region_achievement_rate': '',
-                'manage_channel': '',
-                'channel_achievement_rate': '',
-                'city': '',
-                'city_tier': '',
-                **category_defaults
-            })
+        channel_achievement_query = (
+            select(
+                store_alias.c.manage_channel,
+                func.sum(CommissionStaffDetailModel.store_sales_value).label('channel_sales'),
+                func.sum(CommissionStaffDetailModel.store_target_value).label('channel_target')
+            )
+            .select_from(CommissionStaffDetailModel)
+            .join(store_alias, CommissionStaffDetailModel.store_code == store_alias.c.store_code)
+            .where(CommissionStaffDetailModel.fiscal_month == fiscal_month)
+            .group_by(store_alias.c.manage_channel)
+        )
 
-            # 处理每行数据，按store_code和staff_code分类汇总
-            for row in rows:
-                # 使用store_code和staff_code组合作为键
-                key = (row.store_code, row.staff_code)
+        app_logger.debug("Executing optimized channel achievement query")
+        channel_result = await db.execute(channel_achievement_query)
+        channel_achievements = {
+            row.manage_channel: (row.channel_sales / row.channel_target * 100)
+            if row.channel_target and row.channel_target > 0 else 0
+            for row in channel_result.fetchall()
+        }
+        app_logger.debug(f"Retrieved {len(channel_achievements)} channel achievements")
+
+        # 按store_code和staff_code分组并汇总不同规则类型的佣金
+        category_defaults = {}
+        for cat_name, idx in CATEGORY_INDEX_MAP.items():
+            category_defaults[f'{cat_name}_sales_value'] = 0
+        for cat_name, idx in CATEGORY_INDEX_MAP.items():
+            category_defaults[f'{cat_name}_bonus_rate'] = 0
+        for cat_name, idx in CATEGORY_INDEX_MAP.items():
+            category_defaults[f'{cat_name}_bonus_commission'] = 0
+
+        row_defaults = {
+            'staff_no': '',
+            'full_name': '',
+            'position_from_wd': '',
+            'position': '',
+            'terminated_date': '',
+            'expected_attendance': 0,
+            'actual_attendance': 0,
+            'monthly_target': 0,
+            'Sales': 0,
+            'achievement_rate': 0,
+            'individual_commission_percent': 0,
+            'amount_individual': Decimal('0'),
+            'amount_team': Decimal('0'),
+            'amount_operational': Decimal('0'),
+            'amount_incentive': Decimal('0'),
+            'amount_adjustment': Decimal('0'),
+            'commission_only': Decimal('0'),
+            'total_commission': Decimal('0'),
+            'fiscal_month': '',
+            "individual_rule": "",
+            "team_rule": "",
+            'total_days_store_work': 0.0,
+            'store_code': '',
+            'store_name': '',
+            'store_type': '',
+            'store_sales_value': 0,
+            'store_achievement_rate': 0,
+            'manage_region': '',
+            'region_achievement_rate': '',
+            'manage_channel': '',
+            'channel_achievement_rate': '',
+            'city': '',
+            'city_tier': '',
+            **category_defaults
+        }
 
-                # 初始化员工信息（只设置一次）
-                if staff_commissions[key]['staff_no'] == '':
+        app_logger.debug("Streaming main query")
+        result = await db.stream(query)
+        try:
+            current_key = None
+            current = None
+            async for row in result:
+                # 行按 store_code、staff_code 排序，键变化时输出上一个员工的汇总
+                key = (row.store_code, row.staff_code)
+                if key != current_key:
+                    if current is not None:
+                        yield current
+                    current_key = key
+                    current = dict(row_defaults)
                     region_achievement = region_achievements.get(row.manage_region, 0)
                     channel_achievement = channel_achievements.get(row.manage_channel, 0)
 
@@ -254,7 +344,7 @@ class CommissionRPTService:
                     category_data[f'{cat_name}_bonus_rate'] = f"{rate_val:.2f}%" if rate_val is not None else "0.00%"
                     category_data[f'{cat_name}_bonus_commission'] = amt_val if amt_val is not None else 0
 
-                staff_commissions[key].update({
+                current.update({
                     "staff_no": row.staff_code or '',
                     "full_name": row.full_name or '',
                     "terminated_date": row.terminated_date or '',
@@ -291,103 +381,42 @@ class CommissionRPTService:
                 amount = Decimal(str(row.amount)) if row.amount is not None else Decimal('0')
 
                 if rule_class == 'individual':
-                    staff_commissions[key]['commission_only'] += amount
-                    staff_commissions[key]['total_commission'] += amount
-                    staff_commissions[key]['amount_individual'] += amount
-                    # staff_commissions[key][
+                    current['commission_only'] += amount
+                    current['total_commission'] += amount
+                    current['amount_individual'] += amount
+                    # current[
                     #     'individual_commission_percent'] = f"{row.individual_commission_percent}%" if row.individual_commission_percent>0 else f"{amount/row.staff_sales_value:.2%}"
 
                     if row.individual_commission_percent and row.individual_commission_percent > 0:
-                        staff_commissions[key][
+                        current[
                             'individual_commission_percent'] = f"{row.individual_commission_percent}%"
                     elif row.staff_sales_value and row.staff_sales_value > 0:
-                        staff_commissions[key][
+                        current[
                             'individual_commission_percent'] = f"{amount / row.staff_sales_value:.2%}"
                     else:
-                        staff_commissions[key][
+                        current[
                             'individual_commission_percent'] = "0.00%"
 
-                    staff_commissions[key]['individual_rule'] = row.rule_code
+                    current['individual_rule'] = row.rule_code
                 elif rule_class == 'team':
-                    staff_commissions[key]['commission_only'] += amount
-                    staff_commissions[key]['total_commission'] += amount
-                    staff_commissions[key]['amount_team'] += amount
-                    staff_commissions[key]['team_rule'] = row.rule_code
+                    current['commission_only'] += amount
+                    current['total_commission'] += amount
+                    current['amount_team'] += amount
+                    current['team_rule'] = row.rule_code
                 elif rule_class == 'incentive':
-                    staff_commissions[key]['total_commission'] += amount
-                    staff_commissions[key]['amount_incentive'] += amount
+                    current['total_commission'] += amount
+                    current['amount_incentive'] += amount
                 elif rule_class == 'adjustment':
-                    staff_commissions[key]['total_commission'] += amount
-                    staff_commissions[key]['amount_adjustment'] += amount
+                    current['total_commission'] += amount
+                    current['amount_adjustment'] += amount
                 elif rule_class == 'operational':
-                    staff_commissions[key]['total_commission'] += amount
-                    staff_commissions[key]['amount_operational'] += amount
-
-            # 转换为列表格式
-            # formatted_data = list(staff_commissions.values())
-
-            formatted_data = sorted(
-                staff_commissions.values(),
-                key=lambda x: x['store_code']
-            )
+                    current['total_commission'] += amount
+                    current['amount_operational'] += amount
 
-            app_logger.info(f"Returning {len(formatted_data)} formatted records")
-
-            # 更新后的 field_translations
-            # 在 get_rpt_commission_by_store 方法中，将原来的 field_translations 替换为包含宽度的版本
-            field_translations = {
-                "staff_no": {"en": "Staff No.", "zh": "员工ID", "width": 100},
-                "full_name": {"en": "Staff Name", "zh": "员工姓名", "width": 120},
-                "position_from_wd": {"en": "Workday Position", "zh": "员工职位", "width": 120},
-                "position": {"en": "Position", "zh": "职位类型", "width": 100},
-                "terminated_date": {"en": "Terminated Date", "zh": "离职日期", "width": 120},
-                "expected_attendance": {"en": "Required Attendance", "zh": "应出勤", "width": 100},
-                "actual_attendance": {"en": "Actual Attendance", "zh": "实出勤", "width": 100},
-                "monthly_target": {"en": "Monthly Target", "zh": "月度指标", "width": 110},
-                "Sales": {"en": "Sales", "zh": "销售额", "width": 110},
-                "achievement_rate": {"en": "Achievement Rate", "zh": "销售达成率", "width": 120},
-                "individual_commission_percent": {"en": "Individual Rate", "zh": "个提比例", "width": 100},
-                "amount_individual": {"en": "Individual", "zh": "个人提成", "width": 100},
-                "amount_team": {"en": "Pool", "zh": "团队提成", "width": 100},
-                "commission_only": {"en": "Commission Only", "zh": "仅奖金部分", "width": 120},
-                "amount_operational": {"en": "Operation", "zh": "运营奖金", "width": 100},
-                "amount_incentive": {"en": "Incentive", "zh": "激励奖金", "width": 100},
-                "amount_adjustment": {"en": "Adjustment", "zh": "调整奖金", "width": 100},
-                "total_commission": {"en": "Total Commission", "zh": "总奖金", "width": 110},
-                "store_code": {"en": "Store Code", "zh": "店铺代码", "width": 100},
-                "store_name": {"en": "Store Name", "zh": "店铺名称", "width": 120},
-                "store_type": {"en": "Store Type", "zh": "店铺类型", "width": 100},
-                "fiscal_month": {"en": "Fiscal Month", "zh": "财月", "width": 100},
-                "individual_rule": {"en": "Individual Type", "zh": "个提规则", "width": 100},
-                "team_rule": {"en": "Pool Type", "zh": "团提规则", "width": 100},
-                "total_days_store_work": {"en": "Total Store Actual Attendance", "zh": "店铺总实出勤", "width": 150},
-                "store_sales_value": {"en": "Store Sales", "zh": "店铺销售", "width": 100},
-                "store_achievement_rate": {"en": "Store Achieved Rate", "zh": "店铺达成率", "width": 130},
-                "manage_region": {"en": "Region", "zh": "店铺区域", "width": 100},
-                "region_achievement_rate": {"en": "Regional Achieved Rate", "zh": "区域达成率", "width": 140},
-                "manage_channel": {"en": "Channel", "zh": "渠道", "width": 100},
-                "channel_achievement_rate": {"en": "Channel Achieved Rate", "zh": "渠道达成率", "width": 140},
-                "city": {"en": "City", "zh": "城市", "width": 100},
-                "city_tier": {"en": "City Tier", "zh": "城市等级", "width": 100}
-            }
-            for cat_name in CATEGORY_INDEX_MAP:
-                field_translations[f'{cat_name}_sales_value'] = {"en": f"{cat_name} Sales",
-                                                                 "zh": f"{cat_name}销售额", "width": 120}
-            for cat_name in CATEGORY_INDEX_MAP:
-                field_translations[f'{cat_name}_bonus_rate'] = {"en": f"{cat_name} Commission Rate",
-                                                                "zh": f"{cat_name}奖金比例", "width": 120}
-            for cat_name in CATEGORY_INDEX_MAP:
-                field_translations[f'{cat_name}_bonus_commission'] = {"en": f"{cat_name} Commission",
-                                                                      "zh": f"{cat_name}奖金", "width": 120}
-
-            return {
-                "data": formatted_data,
-                "field_translations": field_translations
-            }
-
-        except Exception as e:
-            app_logger.error(f"Error in get_rpt_commission_by_store: {str(e)}", exc_info=True)
-            raise e
+            if current is not None:
+                yield current
+        finally:
+            await result.close()
 
     @staticmethod
     async def get_rpt_sales_by_achievement(db: AsyncSession, fiscal_month: str, key_word: str, status: str,
@@ -397,7 +426,7 @@ class CommissionRPTService:
                             f"key_word: {key_word}, status: {status}, role_code: {role_code}")
 
             # 构建权限查询
-            store_permission_query = build_store_permission_query(role_code)
+            store_permission_query = await build_store_permission_query(db, role_code)
             store_alias = store_permission_query.subquery()
 
             # 构建主查询
@@ -511,109 +540,159 @@ class CommissionRPTService:
             app_logger.info(f"Starting get_rpt_commission_payout for fiscal_month: {fiscal_month}, "
                             f"key_word: {key_word}, status: {status}, role_code: {role_code}")
 
-            # 构建权限查询
-            store_permission_query = build_store_permission_query(role_code)
-            store_alias = store_permission_query.subquery()
+            formatted_data = [row async for row in CommissionRPTService.iter_rpt_commission_payout(
+                db, fiscal_month, key_word, status, role_code)]
+            app_logger.info(f"Returning {len(formatted_data)} formatted records")
 
-            # 构建主查询
-            query = (
-                select(
-                    store_alias.c.store_name.label('store_name'),
-                    CommissionStoreModel.store_code.label('store_code'),
-                    CommissionStaffDetailModel.staff_code.label('staff_code'),
-                    func.concat(StaffModel.first_name, StaffModel.last_name).label('full_name'),
-                    StaffModel.position_code.label('position_code'),
-                    func.sum(
-                        case(
-                            (CommissionRuleModel.rule_class == 'individual', CommissionStaffDetailModel.amount),
-                            else_=0
-                        )
-                    ).label('amount_individual'),
-                    func.sum(
-                        case(
-                            (CommissionRuleModel.rule_class == 'team', CommissionStaffDetailModel.amount),
-                            else_=0
-                        )
-                    ).label('amount_team'),
-                    func.sum(
-                        case(
-                            (CommissionRuleModel.rule_class == 'operational', CommissionStaffDetailModel.amount),
-                            else_=0
-                        )
-                    ).label('amount_operational'),
-                    func.sum(
-                        case(
-                            (CommissionRuleModel.rule_class == 'incentive', CommissionStaffDetailModel.amount),
-                            else_=0
-                        )
-                    ).label('amount_incentive'),
-                    func.sum(
-                        case(
-                            (CommissionRuleModel.rule_class == 'adjustment', CommissionStaffDetailModel.amount),
-                            else_=0
-                        )
-                    ).label('amount_adjustment'),
-                    func.sum(
-                        case(
-                            (CommissionRuleModel.rule_class.in_(['individual', 'team']),
-                             CommissionStaffDetailModel.amount),
-                            else_=0
-                        )
-                    ).label('commission_only'),
-                    func.sum(CommissionStaffDetailModel.amount).label('total_commission')
-                )
-                .select_from(CommissionStoreModel)
-                .join(CommissionStaffDetailModel,
-                      (CommissionStoreModel.store_code == CommissionStaffDetailModel.store_code) &
-                      (CommissionStoreModel.fiscal_month == CommissionStaffDetailModel.fiscal_month))
-                .join(CommissionRuleDetailModel,
-                      CommissionStaffDetailModel.rule_detail_code == CommissionRuleDetailModel.rule_detail_code)
-                .join(CommissionRuleModel,
-                      CommissionRuleDetailModel.rule_code == CommissionRuleModel.rule_code)
-                .join(StaffModel,
-                      CommissionStaffDetailModel.staff_code == StaffModel.staff_code)
-                .join(store_alias,
-                      CommissionStoreModel.store_code == store_alias.c.store_code)
-                .where(CommissionStoreModel.fiscal_month == fiscal_month
-                       #,CommissionStaffDetailModel.amount > 0
-                       )
-                .group_by(
-                    store_alias.c.store_name,
-                    CommissionStoreModel.store_code,
-                    CommissionStaffDetailModel.staff_code,
-                    StaffModel.first_name,
-                    StaffModel.last_name,
-                    StaffModel.position_code
-                )
-                .order_by(CommissionStoreModel.store_code)
-            )
+            # 导出 Excel 时的列格式
+            amount_format = '#,##0.00'
+            field_formats = {field: amount_format for field in (
+                "commission_only", "amount_operational", "amount_incentive", "amount_adjustment", "total_commission")}
 
-            # 如果提供了关键词，则添加过滤条件
-            if key_word:
-                app_logger.debug(f"Applying keyword filter: {key_word}")
-                query = query.where(
-                    or_(
-                        CommissionStoreModel.store_code.contains(key_word),
-                        store_alias.c.store_name.contains(key_word),
-                        CommissionStaffDetailModel.staff_code.contains(key_word),
-                        store_alias.c.manage_channel.contains(key_word),
-                        store_alias.c.manage_region.contains(key_word)
-                    )
-                )
-            if status != 'All':
-                app_logger.debug(f"Applying status filter: {status}")
-                query = query.where(CommissionStoreModel.status == status)
+            return {
+                "data": formatted_data,
+                "field_translations": CommissionRPTService.commission_payout_field_translations(),
+                "field_formats": field_formats
+            }
 
-            app_logger.debug("Executing main query")
-            result = await db.execute(query)
-            rows = result.fetchall()
-            app_logger.info(f"Fetched {len(rows)} rows from main query")
+        except Exception as e:
+            app_logger.error(f"Error in get_rpt_commission_payout: {str(e)}", exc_info=True)
+            raise e
 
-            # 格式化数据
-            formatted_data = []
-            app_logger.debug("Formatting data")
-            for idx, row in enumerate(rows):
-                formatted_data.append({
+    @staticmethod
+    def commission_payout_field_translations() -> dict:
+        """佣金发放报表的字段翻译"""
+        field_translations = {
+            "store_name": {"en": "Store", "zh": "店铺"},
+            "store_code": {"en": "Store ID", "zh": "店铺ID"},
+            "staff_code": {"en": "Staff ID", "zh": "员工ID"},
+            "full_name": {"en": "Full Name", "zh": "姓名"},
+            "position_code": {"en": "Position", "zh": "职位"},
+            "commission_only": {"en": "Commission only", "zh": "仅奖金部分"},
+            "amount_operational": {"en": "Operation", "zh": "运营奖金"},
+            "amount_incentive": {"en": "Incentive", "zh": "激励奖金"},
+            "amount_adjustment": {"en": "Adjustment", "zh": "调整奖金"},
+            "total_commission": {"en": "Total Commission", "zh": "总奖金"}
+        }
+        return field_translations
+
+    @staticmethod
+    async def iter_rpt_commission_payout(db: AsyncSession, fiscal_month: str, key_word: str, status: str,
+                                         role_code: str, after: tuple = None):
+        """
+        流式产生佣金发放报表行，每个 (store_code, staff_code) 一行，按该顺序输出
+
+        Args:
+            db: 数据库会话
+            fiscal_month: 财月
+            key_word: 关键字
+            status: 状态过滤
+            role_code: 角色代码
+            after: 上一页最后一行的 (store_code, staff_code)，为空时从头开始
+
+        Yields:
+            dict: 报表行
+        """
+        # 上线前已计算的财月没有汇总行，首次读取时补齐
+        await CommissionSummaryService.ensure_month(db, fiscal_month)
+
+        # 构建权限查询
+        store_permission_query = await build_store_permission_query(db, role_code)
+        store_alias = store_permission_query.subquery()
+
+        # 构建主查询：读取员工月度佣金汇总表，每个员工最多每个 rule_class 一行
+        summary = CommissionStaffSummaryModel
+        query = (
+            select(
+                store_alias.c.store_name.label('store_name'),
+                CommissionStoreModel.store_code.label('store_code'),
+                summary.staff_code.label('staff_code'),
+                func.concat(StaffModel.first_name, StaffModel.last_name).label('full_name'),
+                StaffModel.position_code.label('position_code'),
+                func.sum(
+                    case(
+                        (summary.rule_class == 'individual', summary.amount),
+                        else_=0
+                    )
+                ).label('amount_individual'),
+                func.sum(
+                    case(
+                        (summary.rule_class == 'team', summary.amount),
+                        else_=0
+                    )
+                ).label('amount_team'),
+                func.sum(
+                    case(
+                        (summary.rule_class == 'operational', summary.amount),
+                        else_=0
+                    )
+                ).label('amount_operational'),
+                func.sum(
+                    case(
+                        (summary.rule_class == 'incentive', summary.amount),
+                        else_=0
+                    )
+                ).label('amount_incentive'),
+                func.sum(
+                    case(
+                        (summary.rule_class == 'adjustment', summary.amount),
+                        else_=0
+                    )
+                ).label('amount_adjustment'),
+                func.sum(
+                    case(
+                        (summary.rule_class.in_(['individual', 'team']), summary.amount),
+                        else_=0
+                    )
+                ).label('commission_only'),
+                func.sum(summary.amount).label('total_commission')
+            )
+            .select_from(CommissionStoreModel)
+            .join(summary,
+                  (CommissionStoreModel.store_code == summary.store_code) &
+                  (CommissionStoreModel.fiscal_month == summary.fiscal_month))
+            .join(StaffModel,
+                  summary.staff_code == StaffModel.staff_code)
+            .join(store_alias,
+                  CommissionStoreModel.store_code == store_alias.c.store_code)
+            .where(CommissionStoreModel.fiscal_month == fiscal_month
+                   #,summary.amount > 0
+                   )
+            .group_by(
+                store_alias.c.store_name,
+                CommissionStoreModel.store_code,
+                summary.staff_code,
+                StaffModel.first_name,
+                StaffModel.last_name,
+                StaffModel.position_code
+            )
+        )
+
+        # 如果提供了关键词，则添加过滤条件
+        if key_word:
+            app_logger.debug(f"Applying keyword filter: {key_word}")
+            query = query.where(
+                or_(
+                    CommissionStoreModel.store_code.contains(key_word),
+                    store_alias.c.store_name.contains(key_word),
+                    summary.staff_code.contains(key_word),
+                    store_alias.c.manage_channel.contains(key_word),
+                    store_alias.c.manage_region.contains(key_word)
+                )
+            )
+        if status != 'All':
+            app_logger.debug(f"Applying status filter: {status}")
+            query = query.where(CommissionStoreModel.status == status)
+        condition = keyset_after((CommissionStoreModel.store_code, summary.staff_code), after)
+        if condition is not None:
+            query = query.where(condition)
+        query = query.order_by(CommissionStoreModel.store_code, summary.staff_code)
+
+        app_logger.debug("Streaming main query")
+        result = await db.stream(query)
+        try:
+            async for row in result:
+                yield {
                     "store_name": row.store_name if row.store_name is not None else '',
                     "store_code": row.store_code if row.store_code is not None else '',
                     "staff_code": row.staff_code if row.staff_code is not None else '',
@@ -624,35 +703,9 @@ class CommissionRPTService:
                     "amount_incentive": row.amount_incentive if row.amount_incentive is not None else 0.0,
                     "amount_adjustment": row.amount_adjustment if row.amount_adjustment is not None else 0.0,
                     "total_commission": row.total_commission if row.total_commission is not None else 0.0
-                })
-
-                if idx > 0 and idx % 1000 == 0:
-                    app_logger.debug(f"Formatted {idx}/{len(rows)} rows")
-
-            app_logger.info(f"Returning {len(formatted_data)} formatted records")
-
-            # 字段翻译
-            field_translations = {
-                "store_name": {"en": "Store", "zh": "店铺"},
-                "store_code": {"en": "Store ID", "zh": "店铺ID"},
-                "staff_code": {"en": "Staff ID", "zh": "员工ID"},
-                "full_name": {"en": "Full Name", "zh": "姓名"},
-                "position_code": {"en": "Position", "zh": "职位"},
-                "commission_only": {"en": "Commission only", "zh": "仅奖金部分"},
-                "amount_operational": {"en": "Operation", "zh": "运营奖金"},
-                "amount_incentive": {"en": "Incentive", "zh": "激励奖金"},
-                "amount_adjustment": {"en": "Adjustment", "zh": "调整奖金"},
-                "total_commission": {"en": "Total Commission", "zh": "总奖金"}
-            }
-
-            return {
-                "data": formatted_data,
-                "field_translations": field_translations
-            }
-
-        except Exception as e:
-            app_logger.error(f"Error in get_rpt_commission_payout: {str(e)}", exc_info=True)
-            raise e
+                }
+        finally:
+            await result.close()
 
 
 class CommissionUtil:
@@ -774,6 +827,8 @@ class CommissionService:
             staff_attendances = attendance_update.staff_actual_attendance
 
             updated_count = 0
+            # 实际出勤有变化的员工 {数据所在门店: {staff_code}}
+            dirty_staff = {}
 
             # 初始化 merged_codes 为默认空列表
             merged_codes = []
@@ -819,6 +874,8 @@ class CommissionService:
                 if staff_record:
                     app_logger.debug(
                         f"Updating staff {staff_code} attendance from {staff_record.actual_attendance} to {actual_attendance}")
+                    if staff_record.actual_attendance != actual_attendance:
+                        dirty_staff.setdefault(store_code, set()).add(staff_code)
                     staff_record.actual_attendance = actual_attendance
                     staff_record.updated_at = datetime.now()
                     updated_count += 1
@@ -844,6 +901,8 @@ class CommissionService:
                                 if merged_staff_record:
                                     app_logger.debug(
                                         f"Updating merged staff {staff_code} attendance from {merged_staff_record.actual_attendance} to {actual_attendance}")
+                                    if merged_staff_record.actual_attendance != actual_attendance:
+                                        dirty_staff.setdefault(merged_store_code, set()).add(staff_code)
                                     merged_staff_record.actual_attendance = actual_attendance
                                     merged_staff_record.updated_at = datetime.now()
                                     updated_count += 1
@@ -857,6 +916,10 @@ class CommissionService:
 
             app_logger.info(f"Total updated staff records: {updated_count}")
 
+            for dirty_store_code, dirty_staff_codes in dirty_staff.items():
+                await CommissionDirtyService.mark_staff(db, dirty_store_code, fiscal_month,
+                                                        list(dirty_staff_codes), "actual_attendance")
+
             app_logger.debug(f"Querying CommissionStoreModel for status update")
             result_store = await db.execute(
                 select(CommissionStoreModel)
@@ -918,6 +981,8 @@ class CommissionService:
 
             if commission_store:
                 # 更新开店天数字段
+                if commission_store.opening_days != opening_days:
+                    await CommissionDirtyService.mark(db, store_code, fiscal_month, None, "opening_days")
                 commission_store.opening_days = opening_days
                 commission_store.updated_at = datetime.now()
 
@@ -968,6 +1033,10 @@ class CommissionService:
                 elif request.status == "submitted":
                     commission.submit_by = role_code
                     commission.submit_at = datetime.now()
+            # 审批通过时按最终明细重建汇总，报表读取的即为审批时的结果
+            if status == "approved" and commissions:
+                await CommissionSummaryService.refresh(
+                    db, fiscal_month, [commission.store_code for commission in commissions])
             await db.commit()
 
             return True
@@ -996,7 +1065,7 @@ class CommissionService:
     async def get_all_commissions_by_key(role_code: str, fiscal_month: str, key_word: str, status: str,
                                          db: AsyncSession):
         try:
-            store_permission_query = build_store_permission_query(role_code)
+            store_permission_query = await build_store_permission_query(db, role_code)
             store_alias = store_permission_query.subquery()
 
             # 添加关键词过滤条件
@@ -1072,27 +1141,12 @@ class CommissionService:
 
             # 为每个 fiscal_period 获取日期范围
             date_ranges = {}
+            calendar = await FiscalCalendar.get(db)
             for fp in fiscal_periods:
                 if fp:
                     # 分割可能包含多个财月的 fiscal_period
                     months = [month.strip() for month in fp.split(',')]
-
-                    # 查询日期范围
-                    date_query = select(
-                        func.min(DimensionDayWeek.actual_date).label('min_date'),
-                        func.max(DimensionDayWeek.actual_date).label('max_date')
-                    ).where(
-                        DimensionDayWeek.fiscal_month.in_(months)
-                    )
-
-                    date_result = await db.execute(date_query)
-                    date_row = date_result.fetchone()
-
-                    if date_row and date_row.min_date and date_row.max_date:
-                        date_ranges[
-                            fp] = f"{date_row.min_date.strftime('%Y-%m-%d')} to {date_row.max_date.strftime('%Y-%m-%d')}"
-                    else:
-                        date_ranges[fp] = "N/A"
+                    date_ranges[fp] = calendar.fiscal_period(months) or "N/A"
 
             for commission in commissions:
                 store_code = commission.store_code
@@ -1394,6 +1448,8 @@ class CommissionService:
                 position=position
             )
             db.add(adjustment_detail)
+            await CommissionSummaryService.refresh(db, adjustment.fiscal_month, [adjustment.store_code],
+                                                   [adjustment.staff_code])
 
             await db.commit()
             await db.refresh(adjustment_commission)
@@ -1450,6 +1506,7 @@ class CommissionService:
                 await db.delete(adjustment_detail_record)
 
             if adjustment_record or adjustment_detail_record:
+                await CommissionSummaryService.refresh(db, fiscal_month, [store_code], [staff_code])
                 await db.commit()
                 return True
             else:
@@ -1487,61 +1544,67 @@ class CommissionService:
             category_sales: dict
     ) -> dict:
         try:
-            category_result = await db.execute(
-                select(
-                    CommissionRuleCategory.level_value_1,
-                    CommissionRuleCategory.value
-                ).where(
-                    CommissionRuleCategory.rule_detail_code == rule_detail_code
-                )
-            )
-            category_rules = category_result.fetchall()
-
-            if not category_rules:
-                app_logger.warning(f"规则 {rule_detail_code} 在 commissions_rule_category 中没有找到品类系数")
-                return {'total': Decimal('0')}
-
-            category_coefficients = {
-                row.level_value_1: Decimal(str(row.value))
-                for row in category_rules
-            }
-            app_logger.debug(f"员工 {staff_code} 品类系数: {category_coefficients}")
-
-            if not category_sales:
-                app_logger.warning(f"员工 {staff_code} 品类销售数据为空")
-                return {'total': Decimal('0')}
+            catalog = await CommissionRuleCatalog.get(db)
+            category_coefficients = catalog.category_coefficients(rule_detail_code)
+            return CommissionService.compute_category_commission(
+                rule_detail_code, staff_code, category_coefficients, category_sales)
+        except Exception as e:
+            app_logger.error(f"计算品类奖金时发生错误: {str(e)}", exc_info=True)
+            return {'category_amounts': {}, 'total': Decimal('0')}
 
-            app_logger.debug(f"员工 {staff_code} 品类销售数据: {category_sales}")
+    @staticmethod
+    def compute_category_commission(rule_detail_code: str, staff_code: str,
+                                    category_coefficients: dict, category_sales: dict) -> dict:
+        """
+        品类奖金的纯计算部分（不访问数据库），供单店计算和批量计算共用
 
-            result = {'total': Decimal('0')}
-            for cat_name, field_name in CATEGORY_FIELD_MAP.items():
-                sales_value = category_sales.get(cat_name, Decimal('0'))
-                coefficient = category_coefficients.get(cat_name)
+        Args:
+            rule_detail_code: 规则明细代码
+            staff_code: 员工代码
+            category_coefficients: {level_value_1: Decimal 系数}
+            category_sales: {level_value_1: 销售额}
 
-                if coefficient is not None:
-                    amount = Decimal(str(sales_value)) * (coefficient / Decimal('100'))
-                    amount = round(amount, 0)
-                    result[cat_name] = {
-                        'sales_value': Decimal(str(sales_value)),
-                        'amount': amount,
-                        'tier_bonus_rate': coefficient
-                    }
-                    result['total'] += amount
-                    app_logger.debug(
-                        f"品类 {cat_name}: 销售额 {sales_value} × 系数 {coefficient}% = {amount}")
-                else:
-                    result[cat_name] = {
-                        'sales_value': Decimal(str(sales_value)),
-                        'amount': Decimal('0'),
-                        'tier_bonus_rate': None
-                    }
-                    app_logger.warning(f"品类 {cat_name} 在规则 {rule_detail_code} 中没有定义系数，金额记为0")
+        Returns:
+            dict: 与 calculate_category_commission_v2 相同的结构
+        """
+        if not category_coefficients:
+            app_logger.warning(f"规则 {rule_detail_code} 在 commissions_rule_category 中没有找到品类系数")
+            return {'total': Decimal('0')}
+
+        app_logger.debug(f"员工 {staff_code} 品类系数: {category_coefficients}")
+
+        if not category_sales:
+            app_logger.warning(f"员工 {staff_code} 品类销售数据为空")
+            return {'total': Decimal('0')}
+
+        app_logger.debug(f"员工 {staff_code} 品类销售数据: {category_sales}")
+
+        result = {'total': Decimal('0')}
+        for cat_name, field_name in CATEGORY_FIELD_MAP.items():
+            sales_value = category_sales.get(cat_name, Decimal('0'))
+            coefficient = category_coefficients.get(cat_name)
+
+            if coefficient is not None:
+                amount = Decimal(str(sales_value)) * (coefficient / Decimal('100'))
+                amount = round(amount, 0)
+                result[cat_name] = {
+                    'sales_value': Decimal(str(sales_value)),
+                    'amount': amount,
+                    'tier_bonus_rate': coefficient
+                }
+                result['total'] += amount
+                app_logger.debug(
+                    f"品类 {cat_name}: 销售额 {sales_value} × 系数 {coefficient}% = {amount}")
+            else:
+                result[cat_name] = {
+                    'sales_value': Decimal(str(sales_value)),
+                    'amount': Decimal('0'),
+                    'tier_bonus_rate': None
+                }
+                app_logger.warning(f"品类 {cat_name} 在规则 {rule_detail_code} 中没有定义系数，金额记为0")
 
-            app_logger.info(f"员工 {staff_code} 品类奖金结果: {result}")
-            return result
-        except Exception as e:
-            app_logger.error(f"计算品类奖金时发生错误: {str(e)}", exc_info=True)
-            return {'category_amounts': {}, 'total': Decimal('0')}
+        app_logger.info(f"员工 {staff_code} 品类奖金结果: {result}")
+        return result
 
     @staticmethod
     async def calculate_category_commission(
@@ -1559,26 +1622,13 @@ class CommissionService:
             dict: {'category_amounts': {'HBG': Decimal, 'RTW': Decimal, ...}, 'total': Decimal}
         """
         try:
-            category_result = await db.execute(
-                select(
-                    CommissionRuleCategory.level_value_1,
-                    CommissionRuleCategory.value
-                ).where(
-                    CommissionRuleCategory.rule_detail_code == rule_detail_code
-                )
-            )
-            category_rules = category_result.fetchall()
+            catalog = await CommissionRuleCatalog.get(db)
+            category_coefficients = catalog.category_coefficients(rule_detail_code)
 
-            if not category_rules:
+            if not category_coefficients:
                 app_logger.warning(f"规则 {rule_detail_code} 在 commissions_rule_category 中没有找到品类系数")
                 return {'total': Decimal('0')}
 
-            category_coefficients = {
-                row.level_value_1: Decimal(str(row.value))
-                for row in category_rules
-            }
-            app_logger.debug(f"员工 {staff_code} 品类系数: {category_coefficients}")
-
             sales_category_result = await db.execute(
                 select(
                     StaffSalesCategory.level_value_1,
@@ -1600,34 +1650,8 @@ class CommissionService:
                 row.level_value_1: (row.sales_value_ec or 0) + (row.sales_value_store or 0)
                 for row in sales_rows
             }
-            app_logger.debug(f"员工 {staff_code} 品类销售数据: {category_sales}")
-
-            result = {'total': Decimal('0')}
-            for cat_name, field_name in CATEGORY_FIELD_MAP.items():
-                sales_value = category_sales.get(cat_name, Decimal('0'))
-                coefficient = category_coefficients.get(cat_name)
-
-                if coefficient is not None:
-                    amount = Decimal(str(sales_value)) * (coefficient / Decimal('100'))
-                    amount = round(amount, 0)
-                    result[cat_name] = {
-                        'sales_value': Decimal(str(sales_value)),
-                        'amount': amount,
-                        'tier_bonus_rate': coefficient
-                    }
-                    result['total'] += amount
-                    app_logger.debug(
-                        f"品类 {cat_name}: 销售额 {sales_value} × 系数 {coefficient}% = {amount}")
-                else:
-                    result[cat_name] = {
-                        'sales_value': Decimal(str(sales_value)),
-                        'amount': Decimal('0'),
-                        'tier_bonus_rate': None
-                    }
-                    app_logger.warning(f"品类 {cat_name} 在规则 {rule_detail_code} 中没有定义系数，金额记为0")
-
-            app_logger.info(f"员工 {staff_code} 品类奖金结果: {result}")
-            return result
+            return CommissionService.compute_category_commission(
+                rule_detail_code, staff_code, category_coefficients, category_sales)
         except Exception as e:
             app_logger.error(f"计算品类奖金时发生错误: {str(e)}", exc_info=True)
             return {'category_amounts': {}, 'total': Decimal('0')}
@@ -1812,12 +1836,25 @@ class CommissionService:
         Returns:
             CommissionStaffDetailModel: 佣金明细模型实例
         """
+        return CommissionStaffDetailModel(
+            **CommissionService.default_commission_detail_values(
+                fiscal_month, staff, store_code, store_target_value, store_sales_value,
+                store_achievement_rate, staff_target_value, staff_sales_value,
+                staff_achievement_rate, staff_category_sales)
+        )
+
+    @staticmethod
+    def default_commission_detail_values(fiscal_month: str, staff: dict, store_code: str,
+                                         store_target_value, store_sales_value, store_achievement_rate,
+                                         staff_target_value, staff_sales_value, staff_achievement_rate,
+                                         staff_category_sales: dict) -> dict:
+        """默认佣金明细（R-00）的字段值，批量计算时直接用于 bulk insert"""
         staff_sales_fields = {
             f"staff_sales_{idx}": Decimal(str(staff_category_sales.get(cat_name, 0)))
             for cat_name, idx in CATEGORY_INDEX_MAP.items()
         }
 
-        return CommissionStaffDetailModel(
+        return dict(
             fiscal_month=fiscal_month,
             staff_code=staff['staff_code'],
             store_code=store_code,
@@ -1837,9 +1874,279 @@ class CommissionService:
             **staff_sales_fields
         )
 
+    @staticmethod
+    def resolve_store_scope(store_code: str, fiscal_month: str, commission_store_record) -> tuple:
+        """
+        根据门店佣金记录解析合并门店和跨财月范围
+
+        Returns:
+            tuple: (merged_codes, month_codes)
+        """
+        if commission_store_record and commission_store_record.merged_store_codes:
+            merged_code = commission_store_record.merged_store_codes.split(',')
+            merged_codes = [code.strip() for code in merged_code]
+        else:
+            merged_codes = [store_code]
+
+        if commission_store_record and fiscal_month != commission_store_record.fiscal_period:
+            month_code = commission_store_record.fiscal_period.split(',')
+            month_codes = [code.strip() for code in month_code]
+        else:
+            month_codes = [fiscal_month]
+
+        return merged_codes, month_codes
+
+    @staticmethod
+    def merge_staff_attendances(staff_attendances: list, is_prod: bool = True) -> list:
+        """
+        合并同一员工在不同月份/门店的考勤数据
+
+        Args:
+            staff_attendances: StaffAttendanceModel 查询行
+            is_prod: True 使用实际出勤, False 使用计划出勤
+
+        Returns:
+            list: 每个员工一条的字典列表
+        """
+        processed_staff_attendances = {}
+        for staff in staff_attendances:
+            staff_code = staff.staff_code
+
+            if staff_code not in processed_staff_attendances:
+                # 初始化员工数据，使用第一个遇到的记录作为基础
+                processed_staff_attendances[staff_code] = {
+                    'staff_code': staff.staff_code,
+                    'position': staff.position,
+                    'actual_attendance': staff.actual_attendance or 0 if is_prod else (
+                            staff.planned_attendance or 0),
+                    'expected_attendance': staff.expected_attendance or 0,
+                    'salary_coefficient': staff.salary_coefficient,
+                    'target_value_ratio': staff.target_value_ratio,
+                    'target_value': staff.target_value or 0,
+                    'sales_value': staff.sales_value or 0,
+                    'fiscal_months': [staff.fiscal_month]
+                }
+            else:
+                # 累加数值型字段
+                existing_staff = processed_staff_attendances[staff_code]
+                existing_staff[
+                    'actual_attendance'] += staff.actual_attendance or 0 if is_prod else (
+                        staff.planned_attendance or 0)
+                existing_staff['expected_attendance'] += staff.expected_attendance or 0
+                existing_staff['sales_value'] += staff.sales_value or 0
+                existing_staff['target_value'] += staff.target_value or 0
+                existing_staff['fiscal_months'].append(staff.fiscal_month)
+
+        return list(processed_staff_attendances.values())
+
+    @staticmethod
+    def resolve_rule_basis(rule_info, staff_achievement_rate, staff_sales_value,
+                           store_achievement_rate, store_sales_value):
+        """
+        根据 rule_basis 选择达成率和销售额，R-05 为店铺达成率+个人销售额
+
+        Returns:
+            tuple | None: (保留两位小数的达成率, 销售额)，rule_basis 无效时返回 None
+        """
+        if rule_info.rule_basis == 'individual':
+            target_achievement_rate = staff_achievement_rate
+            sales_value = staff_sales_value
+        elif rule_info.rule_basis == 'store':
+            target_achievement_rate = store_achievement_rate
+            if rule_info.rule_code == 'R-05':
+                sales_value = staff_sales_value
+            else:
+                sales_value = store_sales_value
+        else:
+            return None
+
+        return round(target_achievement_rate, 2), sales_value
+
+    @staticmethod
+    def staff_achievement_rate(staff: dict):
+        """员工达成率（合并后的员工数据）"""
+        staff_target_value = staff['target_value']
+        staff_sales_value = staff['sales_value'] or 0
+        if staff_sales_value is not None and staff_target_value > 0:
+            return (staff_sales_value / staff_target_value) * 100
+        return 0
+
+    @staticmethod
+    def match_rule_tiers(catalog, rule_codes, rules_info: dict, staff_achievement_rates: list,
+                         store_achievement_rate) -> dict:
+        """
+        一次解析每条规则下所有员工匹配的阶梯（按 rule_basis 选择员工或店铺达成率，保留两位小数）
+
+        Args:
+            catalog: 规则快照
+            rule_codes: 需要解析的规则代码
+            rules_info: rule_code -> 规则行
+            staff_achievement_rates: 员工达成率，顺序与员工列表一致
+            store_achievement_rate: 店铺达成率
+
+        Returns:
+            dict: {rule_code: [阶梯行或 None]}，列表与 staff_achievement_rates 一一对应；rule_basis 无效的规则不在结果中
+        """
+        tier_matches = {}
+        for rule_code in rule_codes:
+            rule_info = rules_info.get(rule_code)
+            if not rule_info or rule_code in tier_matches:
+                continue
+            if rule_info.rule_basis == 'individual':
+                tier_matches[rule_code] = catalog.match_tiers(
+                    rule_code, [round(rate, 2) for rate in staff_achievement_rates])
+            elif rule_info.rule_basis == 'store':
+                store_tier = catalog.match_tier(rule_code, round(store_achievement_rate, 2))
+                tier_matches[rule_code] = [store_tier] * len(staff_achievement_rates)
+        return tier_matches
+
+    @staticmethod
+    def empty_category_result(staff_category_sales: dict) -> dict:
+        """非品类规则时的品类结果：只带销售额，金额为0"""
+        category_result_data = {}
+        for cat_name in CATEGORY_FIELD_MAP:
+            sales_value_category = staff_category_sales.get(cat_name, Decimal('0'))
+            category_result_data[cat_name] = {
+                'sales_value': Decimal(str(sales_value_category)),
+                'amount': Decimal('0'),
+                'tier_bonus_rate': None
+            }
+        return category_result_data
+
+    @staticmethod
+    def compute_rule_amount(staff: dict, rule_info, rule_detail_value, sales_value, category_result_data: dict,
+                            position_stats: dict, opening_days: int = 0, fiscal_days: int = 0) -> tuple:
+        """
+        计算单个员工在单条规则下的佣金金额（不访问数据库）
+        包含: 基础金额、出勤调整、保底金额以及取整
+
+        Args:
+            staff: 合并后的员工数据
+            rule_info: 规则信息
+            rule_detail_value: 匹配到的规则明细值，小于0表示品类奖金
+            sales_value: 计算基础销售额
+            category_result_data: 品类奖金结果（品类规则时使用其 total）
+            position_stats: 岗位出勤统计
+            opening_days: 开店天数
+            fiscal_days: 财月天数
+
+        Returns:
+            tuple: (commission_amount, factor)
+        """
+        commission_amount = 0.0
+        factor = None
+
+        if rule_detail_value < 0:
+            commission_amount = category_result_data['total']
+            app_logger.debug(
+                f"品类奖金计算完成，员工 {staff['staff_code']} 品类奖金: {category_result_data}, 总计: {commission_amount}")
+        elif rule_info.rule_type == 'commission':
+            if sales_value is not None:
+                commission_amount = sales_value * (Decimal(str(rule_detail_value)) / Decimal(100))
+                app_logger.debug(
+                    f"佣金计算: {sales_value} * ({rule_detail_value}/100) = {commission_amount}")
+        elif rule_info.rule_type == 'incentive':
+            commission_amount = Decimal(str(rule_detail_value))
+            app_logger.debug(f"激励金额: {commission_amount}")
+
+        # 考虑出勤率
+        if rule_info.consider_attendance and rule_info.consider_attendance > 0:
+            commission_dict = CommissionService.apply_attendance_adjustment(
+                commission_amount, staff, rule_info, position_stats, opening_days, fiscal_days
+            )
+            commission_amount = commission_dict['commission_amount']
+            factor = commission_dict['factor']
+            app_logger.debug(f"应用出勤调整后金额: {commission_amount}")
+        else:
+            app_logger.debug(f"未考虑出勤率")
+
+        # 最低保障金额
+        if rule_info.minimum_guarantee and commission_amount < Decimal(str(rule_info.minimum_guarantee)):
+            old_amount = commission_amount
+            commission_amount = Decimal(str(rule_info.minimum_guarantee))
+            app_logger.debug(
+                f"应用保底金额: 原始金额 {old_amount} < 保底金额 {rule_info.minimum_guarantee}, 调整为保底金额")
+
+            expected_attendance = staff['expected_attendance'] or 0
+            actual_attendance = staff['actual_attendance'] or 0
+
+            if rule_info.minimum_guarantee_on_attendance == 1 and expected_attendance > 0:
+                if rule_info.attendance_calculation_logic == 1 and opening_days and opening_days > 0:
+                    # 使用实际出勤天数/开店天数
+                    attendance_factor = Decimal(str(actual_attendance)) / Decimal(str(opening_days))
+                elif rule_info.attendance_calculation_logic == 2 and fiscal_days and fiscal_days > 0:
+                    # 使用实际出勤天数/财月天数
+                    attendance_factor = Decimal(str(actual_attendance)) / Decimal(str(fiscal_days))
+                else:
+                    # 默认使用实际出勤/应出勤
+                    attendance_factor = Decimal(str(actual_attendance)) / Decimal(str(expected_attendance))
+
+                commission_amount = commission_amount * attendance_factor
+                factor = attendance_factor
+                app_logger.debug(
+                    f"保底金额考虑出勤比例: 保底金额 {rule_info.minimum_guarantee} * 出勤率 {attendance_factor} = 调整后金额 {commission_amount}")
+
+                app_logger.debug(f"打折的保底金额: {commission_amount}, 原始金额 {old_amount} 取高的值")
+                commission_amount = max(commission_amount, old_amount)
+
+            elif rule_info.minimum_guarantee_on_attendance > 1 and expected_attendance > 0:
+                if rule_info.attendance_calculation_logic == 1 and opening_days and opening_days > 0:
+                    # 使用实际出勤天数/开店天数计算出勤率
+                    attendance_percentage = (Decimal(str(actual_attendance)) / Decimal(str(opening_days))) * 100
+                elif rule_info.attendance_calculation_logic == 2 and fiscal_days and fiscal_days > 0:
+                    # 使用实际出勤天数/财月天数计算出勤率
+                    attendance_percentage = (Decimal(str(actual_attendance)) / Decimal(str(fiscal_days))) * 100
+                else:
+                    # 默认使用实际出勤/应出勤计算出勤率
+                    attendance_percentage = (Decimal(str(actual_attendance)) / Decimal(
+                        str(expected_attendance))) * 100
+
+                if attendance_percentage < Decimal(str(rule_info.minimum_guarantee_on_attendance)):
+                    commission_amount = Decimal('0')
+                    app_logger.debug(
+                        f"出勤率 {attendance_percentage}% 低于要求的 {rule_info.minimum_guarantee_on_attendance}%, 保底金额取消")
+                else:
+                    app_logger.debug(
+                        f"出勤率 {attendance_percentage}% 满足要求的 {rule_info.minimum_guarantee_on_attendance}%, 保底金额保持 {commission_amount}")
+            elif expected_attendance == 0:
+                commission_amount = 0
+                app_logger.debug(f"出勤 expected_attendance:{expected_attendance}, 保底金额取消")
+            else:
+                app_logger.debug(f"其它情况, 最终金额 {commission_amount}")
+
+        if rule_detail_value >= 0:
+            commission_amount = round(commission_amount, -1)
+
+        return commission_amount, factor
+
+    @staticmethod
+    def build_category_fields(category_result_data: dict, rule_detail_value) -> tuple:
+        """
+        将品类结果展开为 amount_n / staff_sales_n / tier_bonus_rate_n 字段
+
+        Returns:
+            tuple: (category_fields, staff_sales_fields, tier_bonus_rate_fields)
+        """
+        category_fields = {}
+        staff_sales_fields = {}
+        tier_bonus_rate_fields = {}
+        for cat_name, field_name in CATEGORY_FIELD_MAP.items():
+            cat_data = category_result_data.get(cat_name, {})
+            suffix = field_name.split('_', 1)[1]
+            staff_sales_field = f"staff_sales_{suffix}"
+            staff_sales_fields[staff_sales_field] = cat_data.get('sales_value', Decimal('0'))
+
+            if rule_detail_value < 0:
+                category_fields[field_name] = cat_data.get('amount', Decimal('0'))
+                tier_bonus_rate_field = f"tier_bonus_rate_{suffix}"
+                tier_bonus_rate_fields[tier_bonus_rate_field] = cat_data.get('tier_bonus_rate', Decimal('0'))
+
+        return category_fields, staff_sales_fields, tier_bonus_rate_fields
+
     @staticmethod
     async def calculate_commissions_for_store(db: AsyncSession, store_code: str, fiscal_month: str,
-                                              user_code: str = None, is_prod: bool = True):
+                                              user_code: str = None, is_prod: bool = True,
+                                              only_positions: set = None):
         """
         为指定店铺计算员工佣金，支持一个岗位对应多个规则的情况
 
@@ -1847,6 +2154,8 @@ class CommissionService:
             db: 数据库会话
             store_code: 店铺代码
             fiscal_month: 财月
+            only_positions: 只重算这些岗位的员工（增量计算），为空时整店重算。
+                岗位出勤统计仍按全店员工计算，团队分摊规则结果与整店重算一致
 
         Returns:
             bool: 计算是否成功
@@ -1865,17 +2174,8 @@ class CommissionService:
             )
             commission_store_record = commission_store_result.fetchone()
 
-            if commission_store_record and commission_store_record.merged_store_codes:
-                merged_code = commission_store_record.merged_store_codes.split(',')
-                merged_codes = [code.strip() for code in merged_code]
-            else:
-                merged_codes = [store_code]
-
-            if commission_store_record and fiscal_month != commission_store_record.fiscal_period:
-                month_code = commission_store_record.fiscal_period.split(',')
-                month_codes = [code.strip() for code in month_code]
-            else:
-                month_codes = [fiscal_month]
+            merged_codes, month_codes = CommissionService.resolve_store_scope(
+                store_code, fiscal_month, commission_store_record)
 
             app_logger.info(f"开始为店铺 {merged_codes} 在财月 {month_codes} 计算佣金")
             # 1. 获取店铺类型和数据
@@ -1947,40 +2247,68 @@ class CommissionService:
             staff_attendances = staff_attendances_result.all()
             app_logger.info(f"找到 {len(staff_attendances)} 名员工需要计算佣金")
 
-            # 3. 删除该店铺该财月的所有现有佣金记录
+            # 预处理员工数据，合并同一员工在不同月份的数据
+            merged_staff_attendances = CommissionService.merge_staff_attendances(staff_attendances, is_prod)
+
+            # 增量计算：重算范围 = 当前属于这些岗位的员工 + 上次计算结果中属于这些岗位的员工
+            scope_staff_codes = None
+            if only_positions:
+                detail_model = CommissionStaffDetailModel if is_prod else CommissionTrialStaffDetailModel
+                existing_result = await db.execute(
+                    select(detail_model.staff_code).distinct().where(
+                        detail_model.fiscal_month == fiscal_month,
+                        detail_model.store_code == store_code,
+                        detail_model.position.in_(only_positions)
+                    )
+                )
+                scope_staff_codes = {row.staff_code for row in existing_result.fetchall()}
+                scope_staff_codes.update(staff['staff_code'] for staff in merged_staff_attendances
+                                         if staff['position'] in only_positions)
+                app_logger.info(f"增量计算店铺 {store_code} 岗位 {sorted(only_positions)}，"
+                                f"涉及 {len(scope_staff_codes)} 名员工")
+
+            # 3. 删除该店铺该财月的现有佣金记录（增量计算时只删除重算范围内的员工）
             if is_prod:
                 app_logger.debug(f"删除店铺 {store_code} 在财月 {month_codes} 的现有佣金记录")
-                delete_result = await db.execute(
-                    delete(CommissionStaffModel)
-                    .where(
-                        CommissionStaffModel.fiscal_month == fiscal_month,
-                        CommissionStaffModel.store_code == store_code,
-                        CommissionStaffModel.rule_detail_code != "Z-01"
-                    )
+                delete_stmt = delete(CommissionStaffModel).where(
+                    CommissionStaffModel.fiscal_month == fiscal_month,
+                    CommissionStaffModel.store_code == store_code,
+                    CommissionStaffModel.rule_detail_code != "Z-01"
+                )
+                delete_detail_stmt = delete(CommissionStaffDetailModel).where(
+                    CommissionStaffDetailModel.fiscal_month == fiscal_month,
+                    CommissionStaffDetailModel.store_code == store_code,
+                    CommissionStaffDetailModel.rule_detail_code != "Z-01"
                 )
+                if scope_staff_codes is not None:
+                    delete_stmt = delete_stmt.where(CommissionStaffModel.staff_code.in_(scope_staff_codes))
+                    delete_detail_stmt = delete_detail_stmt.where(
+                        CommissionStaffDetailModel.staff_code.in_(scope_staff_codes))
+
+                delete_result = await db.execute(delete_stmt)
                 app_logger.debug(f"删除了 {delete_result.rowcount} 条现有佣金记录")
 
                 # 同时删除 CommissionStaffDetailModel 记录
-                delete_detail_result = await db.execute(
-                    delete(CommissionStaffDetailModel)
-                    .where(
-                        CommissionStaffDetailModel.fiscal_month == fiscal_month,
-                        CommissionStaffDetailModel.store_code == store_code,
-                        CommissionStaffDetailModel.rule_detail_code != "Z-01"
-                    )
-                )
+                await db.execute(delete_detail_stmt)
+
+                # 整店重算后待重算标记随结果一起提交
+                if scope_staff_codes is None:
+                    await CommissionDirtyService.clear(db, [store_code], fiscal_month)
             else:
-                await db.execute(
-                    delete(CommissionTrialStaffDetailModel)
-                    .where(
-                        CommissionTrialStaffDetailModel.fiscal_month == fiscal_month,
-                        CommissionTrialStaffDetailModel.store_code == store_code
-                    )
+                delete_trial_stmt = delete(CommissionTrialStaffDetailModel).where(
+                    CommissionTrialStaffDetailModel.fiscal_month == fiscal_month,
+                    CommissionTrialStaffDetailModel.store_code == store_code
                 )
+                if scope_staff_codes is not None:
+                    delete_trial_stmt = delete_trial_stmt.where(
+                        CommissionTrialStaffDetailModel.staff_code.in_(scope_staff_codes))
+                await db.execute(delete_trial_stmt)
 
             # 4. 如果没有员工数据，直接提交事务并返回
             if not staff_attendances:
                 app_logger.info(f"店铺 {store_code} 没有员工数据，直接提交事务")
+                if is_prod:
+                    await CommissionSummaryService.refresh(db, fiscal_month, [store_code], scope_staff_codes)
                 await db.commit()
                 return True
 
@@ -1988,97 +2316,27 @@ class CommissionService:
             positions = list(set(staff.position for staff in staff_attendances))
             app_logger.debug(f"涉及的岗位类型: {positions}")
 
-            rule_assignment_result = await db.execute(
-                select(
-                    CommissionRuleAssignmentModel.position,
-                    CommissionRuleAssignmentModel.rule_code
-                ).where(
-                    CommissionRuleAssignmentModel.store_type == store_type,
-                    CommissionRuleAssignmentModel.position.in_(positions),
-                    CommissionRuleAssignmentModel.is_active == True
-                )
-            )
+            catalog = await CommissionRuleCatalog.get(db)
 
             # 构建岗位到规则代码的映射（一个岗位可能有多个规则）
-            position_to_rules = {}
-            for row in rule_assignment_result.fetchall():
-                if row.position not in position_to_rules:
-                    position_to_rules[row.position] = []
-                position_to_rules[row.position].append(row.rule_code)
+            store_position_rules = catalog.position_rules(store_type)
+            position_to_rules = {
+                position: store_position_rules[position]
+                for position in positions if store_position_rules.get(position)
+            }
 
             app_logger.debug(f"岗位到规则映射: {position_to_rules}")
 
-            # 6. 获取所有需要用到的规则信息
-            all_rule_codes = []
-            for rule_codes in position_to_rules.values():
-                all_rule_codes.extend(rule_codes)
-
-            all_rule_codes = list(set(all_rule_codes))  # 去重
-
-            if not all_rule_codes:
+            if not position_to_rules:
                 app_logger.warning(f"未找到适用的规则代码")
+                if is_prod:
+                    await CommissionSummaryService.refresh(db, fiscal_month, [store_code], scope_staff_codes)
                 await db.commit()
                 return True
 
-            app_logger.debug(f"需要获取信息的规则代码: {all_rule_codes}")
+            rules_info = catalog.rules
 
-            rules_result = await db.execute(
-                select(
-                    CommissionRuleModel.rule_code,
-                    CommissionRuleModel.rule_basis,
-                    CommissionRuleModel.rule_class,
-                    CommissionRuleModel.rule_type,
-                    CommissionRuleModel.minimum_guarantee,
-                    CommissionRuleModel.consider_attendance,
-                    CommissionRuleModel.minimum_guarantee_on_attendance,
-                    CommissionRuleModel.attendance_calculation_logic
-                ).where(
-                    CommissionRuleModel.rule_code.in_(all_rule_codes)
-                )
-            )
-            rules_info = {
-                row.rule_code: row
-                for row in rules_result.fetchall()
-            }
-
-            app_logger.debug(f"获取到的规则信息: {rules_info}")
-
-            # 预处理员工数据，合并同一员工在不同月份的数据
-            processed_staff_attendances = {}
-            for staff in staff_attendances:
-                staff_code = staff.staff_code
-
-                if staff_code not in processed_staff_attendances:
-                    # 初始化员工数据，使用第一个遇到的记录作为基础
-                    processed_staff_attendances[staff_code] = {
-                        'staff_code': staff.staff_code,
-                        'position': staff.position,
-                        'actual_attendance': staff.actual_attendance or 0 if is_prod else (
-                                staff.planned_attendance or 0),
-                        'expected_attendance': staff.expected_attendance or 0,
-                        'salary_coefficient': staff.salary_coefficient,
-                        'target_value_ratio': staff.target_value_ratio,
-                        'target_value': staff.target_value or 0,
-                        'sales_value': staff.sales_value or 0,
-                        'fiscal_months': [staff.fiscal_month]
-                    }
-                else:
-                    # 累加数值型字段
-                    existing_staff = processed_staff_attendances[staff_code]
-                    existing_staff[
-                        'actual_attendance'] += staff.actual_attendance or 0 if is_prod else (
-                            staff.planned_attendance or 0)
-                    existing_staff['expected_attendance'] += staff.expected_attendance or 0
-                    existing_staff['sales_value'] += staff.sales_value or 0
-                    existing_staff['target_value'] += staff.target_value or 0
-                    existing_staff['fiscal_months'].append(staff.fiscal_month)
-
-            # if not is_prod:
-            #     for sc, att_dict in processed_staff_attendances.items():
-            #         if sc in trial_actual_attendances:
-            #             att_dict['actual_attendance'] = trial_actual_attendances[sc]
-            # 转换为列表格式
-            staff_attendances = list(processed_staff_attendances.values())
+            staff_attendances = merged_staff_attendances
             app_logger.info(f"预处理后有 {len(staff_attendances)} 名唯一员工需要计算佣金")
 
             # 处理岗位出勤统计数据
@@ -2087,8 +2345,16 @@ class CommissionService:
 
             commission_records = []
 
+            # 6. 一次解析所有规则、所有员工的阶梯
+            staff_achievement_rates = [CommissionService.staff_achievement_rate(staff) for staff in staff_attendances]
+            tier_matches = CommissionService.match_rule_tiers(
+                catalog, [rule_code for rule_codes in position_to_rules.values() for rule_code in rule_codes],
+                rules_info, staff_achievement_rates, store_achievement_rate)
+
             # 7. 为每个员工计算佣金（应用所有适用的规则）
-            for staff in staff_attendances:
+            for staff_index, staff in enumerate(staff_attendances):
+                if scope_staff_codes is not None and staff['staff_code'] not in scope_staff_codes:
+                    continue
                 app_logger.debug(f"正在为员工 {staff['staff_code']} 计算佣金")
 
                 sales_category_result = await db.execute(
@@ -2117,10 +2383,7 @@ class CommissionService:
 
                 # 计算员工达成率
                 staff_sales_value = staff['sales_value'] or 0
-                if staff_sales_value is not None and staff_target_value > 0:
-                    staff_achievement_rate = (staff_sales_value / staff_target_value) * 100
-                else:
-                    staff_achievement_rate = 0
+                staff_achievement_rate = staff_achievement_rates[staff_index]
 
                 app_logger.debug(f"员工 {staff['staff_code']} 达成率: {staff_achievement_rate}%")
 
@@ -2149,38 +2412,16 @@ class CommissionService:
                         continue
 
                     # 根据 rule_basis 选择合适的达成率和销售额
-                    if rule_info.rule_basis == 'individual':
-                        target_achievement_rate = staff_achievement_rate
-                        sales_value = staff_sales_value
-                    elif rule_info.rule_basis == 'store':
-                        target_achievement_rate = store_achievement_rate
-                        if rule_info.rule_code == 'R-05':
-                            sales_value = staff_sales_value
-                            app_logger.debug(f" R-05 使用员工 {staff['staff_code']} 的销售额 计算提成")
-                        else:
-                            sales_value = store_sales_value
-                    else:
+                    basis = CommissionService.resolve_rule_basis(
+                        rule_info, staff_achievement_rate, staff_sales_value,
+                        store_achievement_rate, store_sales_value)
+                    if basis is None:
                         app_logger.warning(f"规则 {rule_code} 的 rule_basis 值无效: {rule_info.rule_basis}")
                         continue
-
-                    app_logger.debug(f"使用达成率: {target_achievement_rate}%, 销售额: {sales_value}")
-                    target_achievement_rate = round(target_achievement_rate, 2)
-                    app_logger.debug(f"达成率四舍五入，保留两位小数:{target_achievement_rate}")
+                    target_achievement_rate, sales_value = basis
+                    app_logger.debug(f"使用达成率(保留两位小数): {target_achievement_rate}%, 销售额: {sales_value}")
                     # 获取匹配的规则详情
-                    rule_detail_result = await db.execute(
-                        select(
-                            CommissionRuleDetailModel.rule_detail_code,
-                            CommissionRuleDetailModel.value
-                        ).where(
-                            CommissionRuleDetailModel.rule_code == rule_code,
-                            CommissionRuleDetailModel.start_value <= target_achievement_rate,
-                            (
-                                    CommissionRuleDetailModel.end_value.is_(None) |
-                                    (CommissionRuleDetailModel.end_value > target_achievement_rate)
-                            )
-                        )
-                    )
-                    matching_detail = rule_detail_result.fetchone()
+                    matching_detail = tier_matches[rule_code][staff_index]
 
                     if not matching_detail and is_prod:
                         app_logger.warning(
@@ -2196,150 +2437,29 @@ class CommissionService:
                     app_logger.debug(f"匹配的规则详情: {matching_detail}")
 
                     # 计算佣金
-
-                    commission_amount = 0.0
                     rule_detail_value = matching_detail.value or 0
-
-                    category_result_data = {}
-                    factor = None
-
-                    for cat_name, field_name in CATEGORY_FIELD_MAP.items():
-                        sales_value_category = staff_category_sales.get(cat_name, Decimal('0'))
-                        category_result_data[cat_name] = {
-                            'sales_value': Decimal(str(sales_value_category)),
-                            'amount': Decimal('0'),
-                            'tier_bonus_rate': None
-                        }
+                    category_result_data = CommissionService.empty_category_result(staff_category_sales)
 
                     app_logger.debug(f"规则详情值: {rule_detail_value}")
                     if rule_detail_value < 0:
                         app_logger.debug(f"规则详情值判断，进行品类奖金计算")
-                        category_result = await CommissionService.calculate_category_commission_v2(
+                        category_result_data = await CommissionService.calculate_category_commission_v2(
                             db,
                             matching_detail.rule_detail_code,
                             staff['staff_code'],
                             staff_category_sales
                         )
-                        commission_amount = category_result['total']
-                        category_result_data = category_result
-                        app_logger.debug(
-                            f"品类奖金计算完成，员工 {staff['staff_code']} 品类奖金: {category_result_data}, 总计: {commission_amount}")
-                    elif rule_info.rule_type == 'commission':
-                        if sales_value is not None:
-                            # commission_amount = sales_value * (rule_detail_value / 100)
-                            commission_amount = sales_value * (Decimal(str(rule_detail_value)) / Decimal(100))
-                            app_logger.debug(
-                                f"佣金计算: {sales_value} * ({rule_detail_value}/100) = {commission_amount}")
-                    elif rule_info.rule_type == 'incentive':
-                        commission_amount = Decimal(str(rule_detail_value))
-                        app_logger.debug(f"激励金额: {commission_amount}")
-
-                        # 考虑出勤率
-
-                    if rule_info.consider_attendance and rule_info.consider_attendance > 0:
-                        commission_dict = CommissionService.apply_attendance_adjustment(
-                            commission_amount, staff, rule_info, position_stats, opening_days, fiscal_days
-                        )
-                        commission_amount = commission_dict['commission_amount']
-                        factor = commission_dict['factor']
-                        app_logger.debug(f"应用出勤调整后金额: {commission_amount}")
-                    else:
-                        app_logger.debug(f"未考虑出勤率")
 
-                    # 最低保障金额
-                    if rule_info.minimum_guarantee and commission_amount < Decimal(str(rule_info.minimum_guarantee)):
-                        old_amount = commission_amount
-                        commission_amount = Decimal(str(rule_info.minimum_guarantee))
-                        app_logger.debug(
-                            f"应用保底金额: 原始金额 {old_amount} < 保底金额 {rule_info.minimum_guarantee}, 调整为保底金额")
-
-                        expected_attendance = staff['expected_attendance'] or 0
-                        actual_attendance = staff['actual_attendance'] or 0
-
-                        if rule_info.minimum_guarantee_on_attendance == 1 and expected_attendance > 0:
-                            # attendance_factor = actual_attendance / expected_attendance
-
-                            if rule_info.attendance_calculation_logic == 1 and opening_days and opening_days > 0:
-                                # 使用实际出勤天数/开店天数
-                                attendance_factor = Decimal(str(actual_attendance)) / Decimal(str(opening_days))
-                                app_logger.debug(
-                                    f"保底使用实际出勤/开店天数计算因子: {actual_attendance} / {opening_days} = {attendance_factor}")
-                            elif rule_info.attendance_calculation_logic == 2 and fiscal_days and fiscal_days > 0:
-                                # 使用实际出勤天数/财月天数
-                                attendance_factor = Decimal(str(actual_attendance)) / Decimal(str(fiscal_days))
-                                app_logger.debug(
-                                    f"保底使用实际出勤/财月天数计算因子: {actual_attendance} / {fiscal_days} = {attendance_factor}")
-                            else:
-                                # 默认使用实际出勤/应出勤
-                                attendance_factor = Decimal(str(actual_attendance)) / Decimal(str(expected_attendance))
-                                app_logger.debug(
-                                    f"保底使用实际出勤/应出勤计算因子: {actual_attendance} / {expected_attendance} = {attendance_factor}")
-
-                            commission_amount = commission_amount * attendance_factor
-                            factor = attendance_factor
-                            app_logger.debug(
-                                f"保底金额考虑出勤比例: 保底金额 {rule_info.minimum_guarantee} * 出勤率 {attendance_factor} = 调整后金额 {commission_amount}")
-
-                            app_logger.debug(f"打折的保底金额: {commission_amount}, 原始金额 {old_amount} 取高的值")
-                            commission_amount = max(commission_amount, old_amount)
-
-                        elif rule_info.minimum_guarantee_on_attendance > 1 and expected_attendance > 0:
-                            # attendance_percentage = (actual_attendance / expected_attendance) * 100
-
-                            if rule_info.attendance_calculation_logic == 1 and opening_days and opening_days > 0:
-                                # 使用实际出勤天数/开店天数计算出勤率
-                                attendance_percentage = (Decimal(str(actual_attendance)) / Decimal(
-                                    str(opening_days))) * 100
-                                app_logger.debug(
-                                    f"使用实际出勤/开店天数计算出勤率: {actual_attendance} / {opening_days} * 100 = {attendance_percentage}%")
-                            elif rule_info.attendance_calculation_logic == 2 and fiscal_days and fiscal_days > 0:
-                                # 使用实际出勤天数/财月天数计算出勤率
-                                attendance_percentage = (Decimal(str(actual_attendance)) / Decimal(
-                                    str(fiscal_days))) * 100
-                                app_logger.debug(
-                                    f"使用实际出勤/财月天数计算出勤率: {actual_attendance} / {fiscal_days} * 100 = {attendance_percentage}%")
-                            else:
-                                # 默认使用实际出勤/应出勤计算出勤率
-                                attendance_percentage = (Decimal(str(actual_attendance)) / Decimal(
-                                    str(expected_attendance))) * 100
-                                app_logger.debug(
-                                    f"使用实际出勤/应出勤计算出勤率: {actual_attendance} / {expected_attendance} * 100 = {attendance_percentage}%")
-
-                            if attendance_percentage < Decimal(str(rule_info.minimum_guarantee_on_attendance)):
-                                commission_amount = Decimal('0')
-                                app_logger.debug(
-                                    f"出勤率 {attendance_percentage}% 低于要求的 {rule_info.minimum_guarantee_on_attendance}%, 保底金额取消")
-                            else:
-                                app_logger.debug(
-                                    f"出勤率 {attendance_percentage}% 满足要求的 {rule_info.minimum_guarantee_on_attendance}%, 保底金额保持 {commission_amount}")
-                        elif expected_attendance == 0:
-                            commission_amount = 0
-                            app_logger.debug(f"出勤 expected_attendance:{expected_attendance}, 保底金额取消")
-                        else:
-                            app_logger.debug(f"其它情况, 最终金额 {commission_amount}")
-
-                    # 只有佣金金额大于等0时才保存
+                    commission_amount, factor = CommissionService.compute_rule_amount(
+                        staff, rule_info, rule_detail_value, sales_value, category_result_data,
+                        position_stats, opening_days, fiscal_days
+                    )
 
                     position_stat = position_stats.get(staff['position'], {})
                     app_logger.debug(f"为员工 {staff['staff_code']} 创建佣金记录: {commission_amount}")
 
-                    category_fields = {}
-                    staff_sales_fields = {}
-                    tier_bonus_rate_fields = {}
-                    for cat_name, field_name in CATEGORY_FIELD_MAP.items():
-                        cat_data = category_result_data.get(cat_name, {})
-                        suffix = field_name.split('_', 1)[1]
-                        staff_sales_field = f"staff_sales_{suffix}"
-                        staff_sales_fields[staff_sales_field] = cat_data.get('sales_value', Decimal('0'))
-
-                        if rule_detail_value < 0:
-                            category_fields[field_name] = cat_data.get('amount', Decimal('0'))
-                            tier_bonus_rate_field = f"tier_bonus_rate_{suffix}"
-                            tier_bonus_rate_fields[tier_bonus_rate_field] = cat_data.get('tier_bonus_rate',
-                                                                                         Decimal('0'))
-
-                    if rule_detail_value >= 0:
-                        commission_amount = round(commission_amount, -1)
+                    category_fields, staff_sales_fields, tier_bonus_rate_fields = \
+                        CommissionService.build_category_fields(category_result_data, rule_detail_value)
 
                     if is_prod:
                         commission_record = CommissionStaffModel(
@@ -2417,7 +2537,9 @@ class CommissionService:
             else:
                 app_logger.info("没有需要插入的佣金记录")
 
-            # 9. 提交事务
+            # 9. 刷新员工佣金汇总并提交事务
+            if is_prod:
+                await CommissionSummaryService.refresh(db, fiscal_month, [store_code], scope_staff_codes)
             app_logger.info(f"提交店铺 {store_code} 的佣金计算结果")
             await db.commit()
             app_logger.info(f"成功完成店铺 {store_code} 在财月 {fiscal_month} 的佣金计算")
@@ -2429,26 +2551,59 @@ class CommissionService:
             raise e
 
     @staticmethod
-    async def get_fiscal_month_days(db: AsyncSession, months: list) -> int:
+    async def recalculate_dirty_groups(db: AsyncSession, store_code: str, fiscal_month: str,
+                                       user_code: str = None) -> dict:
+        """
+        按 commissions_dirty_group 中的标记增量重算门店佣金
 
-        try:
-            # 查询指定财月的最小和最大日期
-            date_query = select(
-                func.min(DimensionDayWeek.actual_date).label('min_date'),
-                func.max(DimensionDayWeek.actual_date).label('max_date')
-            ).where(
-                DimensionDayWeek.fiscal_month.in_(months)
-            )
+        只重算被标记的岗位；存在整店标记或门店尚未计算过时整店重算；没有标记时跳过。
 
-            date_result = await db.execute(date_query)
-            date_row = date_result.fetchone()
+        Args:
+            db: 数据库会话
+            store_code: 计算门店
+            fiscal_month: 财月
+            user_code: 操作人
 
-            if date_row and date_row.min_date and date_row.max_date:
-                days_diff = (date_row.max_date - date_row.min_date).days + 1
-                return days_diff
-            else:
+        Returns:
+            dict: {"mode": "full" | "incremental" | "skipped", "positions": [...]}
+        """
+        dirty_rows = await CommissionDirtyService.collect(db, store_code, fiscal_month)
+        positions = {row.position for row in dirty_rows}
+
+        computed_result = await db.execute(
+            select(CommissionStaffDetailModel.staff_code).where(
+                CommissionStaffDetailModel.fiscal_month == fiscal_month,
+                CommissionStaffDetailModel.store_code == store_code,
+                CommissionStaffDetailModel.rule_detail_code != "Z-01"
+            ).limit(1)
+        )
+        computed = computed_result.first() is not None
+
+        if not computed or WHOLE_STORE in positions:
+            app_logger.info(f"店铺 {store_code} 在财月 {fiscal_month} 整店重算佣金")
+            await CommissionService.calculate_commissions_for_store(db, store_code, fiscal_month, user_code)
+            return {"mode": "full", "positions": []}
+
+        if not positions:
+            app_logger.info(f"店铺 {store_code} 在财月 {fiscal_month} 没有待重算的岗位，跳过计算")
+            return {"mode": "skipped", "positions": []}
+
+        # 标记与计算结果在同一事务中删除，计算失败回滚后标记保留
+        await CommissionDirtyService.discard(db, dirty_rows)
+        await CommissionService.calculate_commissions_for_store(db, store_code, fiscal_month, user_code,
+                                                                only_positions=positions)
+        return {"mode": "incremental", "positions": sorted(positions)}
+
+    @staticmethod
+    async def get_fiscal_month_days(db: AsyncSession, months: list) -> int:
+
+        try:
+            # 指定财月的最小和最大日期
+            calendar = await FiscalCalendar.get(db)
+            days_diff = calendar.month_days(months)
+            if not days_diff:
                 app_logger.warning(f"未能找到财月 {months} 的日期范围")
-                return 0
+            return days_diff
 
         except Exception as e:
             app_logger.error(f"获取财月 {months} 天数时发生错误: {e}")
@@ -2465,6 +2620,7 @@ class CommissionService:
         if Commission_store:
             Commission_store.store_type = store_type
             Commission_store.updated_at = datetime.now()
+            await CommissionDirtyService.mark(db, store_code, fiscal_month, None, "store_type")
 
         result = await db.execute(select(TargetStoreMain).where(
             TargetStoreMain.store_code == store_code,
@@ -2500,6 +2656,7 @@ class CommissionService:
         if Commission_store:
             Commission_store.fiscal_period = fiscal_period_str
             Commission_store.updated_at = datetime.now()
+            await CommissionDirtyService.mark(db, store_code, fiscal_month, None, "fiscal_period")
             await db.commit()
             return Commission_store
 
@@ -2546,7 +2703,16 @@ class CommissionDataHubService:
     async def get_commission_tiers_by_staff(db: AsyncSession, fiscal_month: str, store_code: str, staff_code: str):
         try:
 
-            await CommissionService.calculate_commissions_for_store(db, store_code, fiscal_month, staff_code, False)
+            # 试算只重算该员工所在岗位，岗位出勤统计仍按全店计算
+            position_result = await db.execute(
+                select(StaffAttendanceModel.position).distinct().where(
+                    StaffAttendanceModel.staff_code == staff_code,
+                    StaffAttendanceModel.fiscal_month == fiscal_month
+                )
+            )
+            staff_positions = {row.position for row in position_result.fetchall() if row.position}
+            await CommissionService.calculate_commissions_for_store(db, store_code, fiscal_month, staff_code, False,
+                                                                    only_positions=staff_positions or None)
 
             tier_commission_data, expected_attendance, actual_attendance, position, staff_target_value, staff_sales_value, store_target, store_sales = await CommissionService.get_commission_by_staff_code(
                 db, staff_code, store_code,
@@ -2594,40 +2760,41 @@ class CommissionDataHubService:
                 f"Starting get_commission_tiers_by_store for fiscal_month: {fiscal_month}, "
                 f"store_code: {store_code}, position: {position}")
 
-            query = (
+            store_result = await db.execute(
                 select(
                     CommissionStoreModel.store_type,
-                    CommissionStoreModel.fiscal_period,
-                    CommissionRuleAssignmentModel.position,
-                    CommissionRuleModel.rule_code,
-                    CommissionRuleModel.rule_name,
-                    CommissionRuleModel.rule_class,
-                    CommissionRuleModel.rule_type,
-                    CommissionRuleDetailModel.rule_detail_code,
-                    CommissionRuleDetailModel.start_value,
-                    CommissionRuleDetailModel.end_value,
-                    CommissionRuleDetailModel.value,
-                    func.row_number().over(
-                        partition_by=CommissionRuleModel.rule_code,
-                        order_by=CommissionRuleDetailModel.start_value
-                    ).label('tier_index')
-                )
-                .select_from(CommissionStoreModel)
-                .join(CommissionRuleAssignmentModel,
-                      CommissionStoreModel.store_type == CommissionRuleAssignmentModel.store_type)
-                .join(CommissionRuleDetailModel,
-                      CommissionRuleAssignmentModel.rule_code == CommissionRuleDetailModel.rule_code)
-                .join(CommissionRuleModel,
-                      CommissionRuleDetailModel.rule_code == CommissionRuleModel.rule_code)
-                .where(
+                    CommissionStoreModel.fiscal_period
+                ).where(
                     CommissionStoreModel.fiscal_month == fiscal_month,
-                    CommissionStoreModel.store_code == store_code,
-                    CommissionRuleAssignmentModel.position == position,
+                    CommissionStoreModel.store_code == store_code
                 )
             )
+            store_row = store_result.fetchone()
+
+            # 从规则目录组装阶梯（按 start_value 升序编号）
+            catalog = await CommissionRuleCatalog.get(db)
+            rows = []
+            if store_row:
+                for assignment in catalog.assignments_for(store_row.store_type, position):
+                    rule = catalog.rules.get(assignment.rule_code)
+                    if not rule:
+                        continue
+                    for tier_index, tier in enumerate(catalog.tiers.get(assignment.rule_code, []), start=1):
+                        rows.append(SimpleNamespace(
+                            store_type=store_row.store_type,
+                            fiscal_period=store_row.fiscal_period,
+                            position=assignment.position,
+                            rule_code=rule.rule_code,
+                            rule_name=rule.rule_name,
+                            rule_class=rule.rule_class,
+                            rule_type=rule.rule_type,
+                            rule_detail_code=tier.rule_detail_code,
+                            start_value=tier.start_value,
+                            end_value=tier.end_value,
+                            value=tier.value,
+                            tier_index=tier_index
+                        ))
 
-            result = await db.execute(query)
-            rows = result.fetchall()
             store_type = rows[0].store_type if rows else None
             fiscal_period = rows[0].fiscal_period if rows else None
             app_logger.info(f"Fetched {len(rows)} tier rows for store {store_code}")
@@ -2652,28 +2819,13 @@ class CommissionDataHubService:
             negative_rule_detail_codes = [row.rule_detail_code for row in rows if
                                           row.value is not None and row.value < 0]
             category_lookup = {}
-            if negative_rule_detail_codes:
-                category_result = await db.execute(
-                    select(
-                        CommissionRuleCategory.rule_detail_code,
-                        CommissionRuleCategory.level_value_1,
-                        CommissionRuleCategory.value,
-                        CommissionRuleDetailModel.start_value
-                    )
-                    .join(CommissionRuleDetailModel,
-                          CommissionRuleCategory.rule_detail_code == CommissionRuleDetailModel.rule_detail_code)
-                    .where(
-                        CommissionRuleCategory.rule_detail_code.in_(negative_rule_detail_codes)
-                    )
-                    .order_by(CommissionRuleDetailModel.start_value)
-                )
-                for cat_row in category_result.fetchall():
-                    if cat_row.rule_detail_code not in category_lookup:
-                        category_lookup[cat_row.rule_detail_code] = []
-                    category_lookup[cat_row.rule_detail_code].append({
-                        "level_value_1": cat_row.level_value_1,
-                        "tier_bonus_rate": cat_row.value,
-                    })
+            for rule_detail_code in negative_rule_detail_codes:
+                coefficients = catalog.category_coefficients(rule_detail_code)
+                if coefficients:
+                    category_lookup[rule_detail_code] = [
+                        {"level_value_1": level_value_1, "tier_bonus_rate": value}
+                        for level_value_1, value in coefficients.items()
+                    ]
 
             prev_category_by_class = {}
 
@@ -2775,7 +2927,7 @@ class CommissionDataHubService:
                                                  cursor: int = 0, limit: int = 30, rank_type: str = 'ALL',
                                                  sort_by: str = 'commissions', primary_group: str = ''):
         try:
-            store_permission_query = build_store_permission_query(role_code)
+            store_permission_query = await build_store_permission_query(db, role_code)
             store_alias = store_permission_query.subquery()
 
             channel_result = await db.execute(
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, distinct, func, insert, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.commission import CommissionStaffDetailModel, CommissionRuleDetailModel, CommissionRuleModel, \
+    CommissionStaffSummaryModel
+from app.utils.logger import app_logger
+
+# 每条 DELETE / INSERT ... SELECT 覆盖的门店数
+SUMMARY_STORE_CHUNK = 500
+
+
+class CommissionSummaryService:
+    """
+    员工月度佣金汇总表（commissions_staff_summary）维护
+
+    佣金计算、人工调整、审批完成时在同一事务中调用 refresh，按 (财月, 门店[, 员工]) 删除旧汇总，
+    再用一条 INSERT ... SELECT 从 commissions_staff_detail 重新汇总；不提交事务。
+    历史财月可通过 /commission/summary/refresh 整月重建；上线前已计算的财月在首次读取报表时由 ensure_month 自动补齐。
+    """
+
+    # 本进程中已检查过汇总是否完整的财月
+    _checked_months = set()
+    _lock = asyncio.Lock()
+
+    @staticmethod
+    def _summary_select(fiscal_month: str):
+        rule_class = func.coalesce(CommissionRuleModel.rule_class, '')
+        return (
+            select(
+                CommissionStaffDetailModel.fiscal_month,
+                CommissionStaffDetailModel.store_code,
+                CommissionStaffDetailModel.staff_code,
+                rule_class,
+                func.sum(CommissionStaffDetailModel.amount),
+                literal(datetime.now())
+            )
+            .select_from(CommissionStaffDetailModel)
+            .join(CommissionRuleDetailModel,
+                  CommissionStaffDetailModel.rule_detail_code == CommissionRuleDetailModel.rule_detail_code)
+            .join(CommissionRuleModel,
+                  CommissionRuleDetailModel.rule_code == CommissionRuleModel.rule_code)
+            .where(CommissionStaffDetailModel.fiscal_month == fiscal_month)
+            .group_by(
+                CommissionStaffDetailModel.fiscal_month,
+                CommissionStaffDetailModel.store_code,
+                CommissionStaffDetailModel.staff_code,
+                rule_class
+            )
+        )
+
+    @staticmethod
+    async def _refresh_scope(db: AsyncSession, fiscal_month: str, store_codes: Optional[list],
+                             staff_codes: Optional[list]):
+        delete_stmt = delete(CommissionStaffSummaryModel).where(
+            CommissionStaffSummaryModel.fiscal_month == fiscal_month)
+        summary_select = CommissionSummaryService._summary_select(fiscal_month)
+        if store_codes is not None:
+            delete_stmt = delete_stmt.where(CommissionStaffSummaryModel.store_code.in_(store_codes))
+            summary_select = summary_select.where(CommissionStaffDetailModel.store_code.in_(store_codes))
+        if staff_codes is not None:
+            delete_stmt = delete_stmt.where(CommissionStaffSummaryModel.staff_code.in_(staff_codes))
+            summary_select = summary_select.where(CommissionStaffDetailModel.staff_code.in_(staff_codes))
+
+        await db.execute(delete_stmt)
+        await db.execute(
+            insert(CommissionStaffSummaryModel).from_select(
+                ['fiscal_month', 'store_code', 'staff_code', 'rule_class', 'amount', 'refreshed_at'],
+                summary_select
+            )
+        )
+
+    @staticmethod
+    async def refresh(db: AsyncSession, fiscal_month: str, store_codes: Optional[Iterable[str]] = None,
+                      staff_codes: Optional[Iterable[str]] = None):
+        """
+        重新汇总指定范围的员工佣金，不提交事务
+
+        Args:
+            db: 数据库会话
+            fiscal_month: 财月
+            store_codes: 门店列表，为 None 时整月重建
+            staff_codes: 员工列表，为 None 时包含门店全部员工
+        """
+        staff_codes = sorted(set(staff_codes)) if staff_codes is not None else None
+        if store_codes is None:
+            await CommissionSummaryService._refresh_scope(db, fiscal_month, None, staff_codes)
+            app_logger.info(f"Commission summary rebuilt for fiscal_month: {fiscal_month}")
+            return
+
+        store_codes = sorted(set(store_codes))
+        for i in range(0, len(store_codes), SUMMARY_STORE_CHUNK):
+            await CommissionSummaryService._refresh_scope(
+                db, fiscal_month, store_codes[i:i + SUMMARY_STORE_CHUNK], staff_codes)
+        app_logger.debug(f"Commission summary refreshed for fiscal_month: {fiscal_month}, "
+                         f"{len(store_codes)} stores")
+
+    @staticmethod
+    async def ensure_month(db: AsyncSession, fiscal_month: str):
+        """
+        补齐财月汇总：有佣金明细但没有汇总行的门店重新汇总并提交
+
+        每个财月在每个进程中只检查一次，之后由写入路径上的 refresh 维护。
+
+        Args:
+            db: 数据库会话
+            fiscal_month: 财月
+        """
+        if fiscal_month in CommissionSummaryService._checked_months:
+            return
+
+        async with CommissionSummaryService._lock:
+            if fiscal_month in CommissionSummaryService._checked_months:
+                return
+
+            summary_exists = (
+                select(CommissionStaffSummaryModel.store_code)
+                .where(
+                    CommissionStaffSummaryModel.fiscal_month == fiscal_month,
+                    CommissionStaffSummaryModel.store_code == CommissionStaffDetailModel.store_code
+                )
+                .exists()
+            )
+            result = await db.execute(
+                select(distinct(CommissionStaffDetailModel.store_code))
+                .where(CommissionStaffDetailModel.fiscal_month == fiscal_month, ~summary_exists)
+            )
+            store_codes = [row[0] for row in result.fetchall()]
+            if store_codes:
+                await CommissionSummaryService.refresh(db, fiscal_month, store_codes)
+                await db.commit()
+                app_logger.info(f"Commission summary backfilled for fiscal_month: {fiscal_month}, "
+                                f"{len(store_codes)} stores")
+            CommissionSummaryService._checked_months.add(fiscal_month)
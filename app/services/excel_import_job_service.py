@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from app.database import SessionLocal
+from app.utils.excel_reader import aiter_excel_chunks
+from app.utils.logger import app_logger
+
+# 同时处理的导入任务数
+IMPORT_JOB_CONCURRENCY = 2
+# 内存中保留的任务记录数
+IMPORT_JOB_HISTORY = 50
+
+
+class ExcelImportJobService:
+    """
+    Excel 后台导入任务
+
+    上传文件写入临时文件后提交为任务立即返回，任务进入队列由固定数量的 asyncio worker 处理。
+    每个任务使用自己的 SessionLocal 会话，Excel 解析在线程中进行，不阻塞事件循环。
+    任务记录保存在进程内存中，供前端轮询状态。
+    """
+
+    _jobs = {}
+    _queue = None
+    _workers = []
+
+    @staticmethod
+    def submit(path: str, filename: str, data_type: str, import_func) -> dict:
+        """
+        提交导入任务，立即返回任务记录
+
+        Args:
+            path: 上传文件的临时文件路径，任务结束后删除
+            filename: 原始文件名
+            data_type: 数据类型（target / budget / ec_sales）
+            import_func: 导入函数 (chunks, db) -> ImportResult，chunks 为异步数据块迭代器
+
+        Returns:
+            dict: 任务记录摘要
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "filename": filename,
+            "data_type": data_type,
+            "status": "pending",
+            "created_at": datetime.now(),
+            "started_at": None,
+            "finished_at": None,
+            "elapsed": None,
+            "rows_read": 0,
+            "rows_processed": 0,
+            "rows_with_errors": 0,
+            "success": None,
+            "message": None,
+            "errors": [],
+            "warning_table": []
+        }
+        ExcelImportJobService._jobs[job_id] = job
+        ExcelImportJobService._trim_history()
+
+        ExcelImportJobService._ensure_workers()
+        ExcelImportJobService._queue.put_nowait((job, path, import_func))
+        app_logger.info(f"Excel import job {job_id} submitted: {filename} ({data_type})")
+        return ExcelImportJobService.get_job(job_id)
+
+    @staticmethod
+    def get_job(job_id: str, with_warnings: bool = False) -> Optional[dict]:
+        """查询任务状态，warning_table 可能很大，按需返回"""
+        job = ExcelImportJobService._jobs.get(job_id)
+        if job is None:
+            return None
+        summary = {key: value for key, value in job.items() if key != 'warning_table'}
+        summary['warning_rows'] = len(job['warning_table'])
+        if with_warnings:
+            summary['warning_table'] = job['warning_table']
+        return summary
+
+    @staticmethod
+    def list_jobs(data_type: str = None) -> list:
+        return [ExcelImportJobService.get_job(job_id)
+                for job_id, job in ExcelImportJobService._jobs.items()
+                if data_type is None or job['data_type'] == data_type]
+
+    @staticmethod
+    def _trim_history():
+        finished = [job_id for job_id, job in ExcelImportJobService._jobs.items()
+                    if job['status'] not in ('pending', 'running')]
+        while len(ExcelImportJobService._jobs) > IMPORT_JOB_HISTORY and finished:
+            ExcelImportJobService._jobs.pop(finished.pop(0), None)
+
+    @staticmethod
+    def _ensure_workers():
+        """在当前事件循环中启动 worker，worker 异常退出后补齐"""
+        if ExcelImportJobService._queue is None:
+            ExcelImportJobService._queue = asyncio.Queue()
+        ExcelImportJobService._workers = [worker for worker in ExcelImportJobService._workers if not worker.done()]
+        while len(ExcelImportJobService._workers) < IMPORT_JOB_CONCURRENCY:
+            ExcelImportJobService._workers.append(asyncio.create_task(ExcelImportJobService._worker()))
+
+    @staticmethod
+    async def _worker():
+        queue = ExcelImportJobService._queue
+        while True:
+            job, path, import_func = await queue.get()
+            try:
+                await ExcelImportJobService._execute(job, path, import_func)
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    async def _execute(job: dict, path: str, import_func):
+        job['status'] = 'running'
+        job['started_at'] = datetime.now()
+        started = time.perf_counter()
+        app_logger.info(f"Excel import job {job['job_id']} started")
+
+        async def chunks():
+            async for df in aiter_excel_chunks(path):
+                job['rows_read'] += len(df)
+                yield df
+
+        try:
+            async with SessionLocal() as db:
+                result = await import_func(chunks(), db)
+            job['success'] = result.success
+            job['message'] = result.message
+            job['rows_processed'] = result.rows_processed
+            job['rows_with_errors'] = result.rows_with_errors
+            job['errors'] = result.errors
+            job['warning_table'] = result.warning_table
+            job['status'] = 'completed' if result.success else 'failed'
+        except Exception as e:
+            app_logger.error(f"Excel import job {job['job_id']} failed: {e}", exc_info=True)
+            job['success'] = False
+            job['message'] = f"导入失败: {str(e)}"
+            job['status'] = 'failed'
+        finally:
+            job['finished_at'] = datetime.now()
+            job['elapsed'] = round(time.perf_counter() - started, 3)
+            if os.path.exists(path):
+                os.remove(path)
+            app_logger.info(f"Excel import job {job['job_id']} {job['status']}: "
+                            f"{job['rows_processed']} rows processed")
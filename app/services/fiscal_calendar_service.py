@@ -0,0 +1,153 @@
+import asyncio
+import time
+from datetime import date, datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.dimension import DimensionDayWeek
+from app.utils.logger import app_logger
+
+# 两次版本检查之间的最小间隔（秒），间隔内直接使用内存中的财历
+FISCAL_CALENDAR_CHECK_SECONDS = 3600
+
+
+def _day(value) -> Optional[date]:
+    """date / datetime -> date，作为索引键"""
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+class FiscalCalendarSnapshot:
+    """
+    某一版本的财历快照（只读）
+
+    days: 日期 -> (fiscal_month, week_number)
+    month_ranges: fiscal_month -> (最小日期, 最大日期, 天数)，日期为 dimension_dayweek.actual_date 的原始值
+    week_months: (week_number, finance_year) -> 该周第一天所在的 fiscal_month
+    """
+
+    def __init__(self, version: tuple, rows: list):
+        self.version = version
+        self.loaded_at = time.time()
+        self.days = {}
+        self.month_ranges = {}
+        self.week_months = {}
+
+        # rows 按 actual_date 升序
+        for row in rows:
+            self.days[_day(row.actual_date)] = (row.fiscal_month, row.week_number)
+            if row.fiscal_month is not None:
+                month_range = self.month_ranges.get(row.fiscal_month)
+                if month_range is None:
+                    self.month_ranges[row.fiscal_month] = (row.actual_date, row.actual_date, 1)
+                else:
+                    self.month_ranges[row.fiscal_month] = (month_range[0], row.actual_date, month_range[2] + 1)
+                self.week_months.setdefault((row.week_number, row.finance_year), row.fiscal_month)
+
+    def day(self, value) -> Optional[tuple]:
+        """日期 -> (fiscal_month, week_number)，不在财历中返回 None"""
+        return self.days.get(_day(value))
+
+    def week_number(self, value, fiscal_month: str = None) -> Optional[int]:
+        """
+        日期所在的周数
+
+        Args:
+            value: 日期
+            fiscal_month: 指定时要求日期属于该财月，否则返回 None
+        """
+        day = self.days.get(_day(value))
+        if day is None or (fiscal_month is not None and day[0] != fiscal_month):
+            return None
+        return day[1]
+
+    def date_range(self, fiscal_months: Iterable[str]) -> tuple:
+        """
+        一个或多个财月的 (最小日期, 最大日期)，等价于 min/max(actual_date) WHERE fiscal_month IN (...)
+
+        Returns:
+            tuple: 没有数据时为 (None, None)
+        """
+        ranges = [self.month_ranges[month] for month in set(fiscal_months) if month in self.month_ranges]
+        if not ranges:
+            return None, None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    def month_days(self, fiscal_months: Iterable[str]) -> int:
+        """多个财月的 最大日期 - 最小日期 + 1，没有数据时为 0"""
+        min_date, max_date = self.date_range(fiscal_months)
+        if min_date is None:
+            return 0
+        return (max_date - min_date).days + 1
+
+    def fiscal_period(self, fiscal_months: Iterable[str]) -> str:
+        """'YYYY-MM-DD to YYYY-MM-DD'，没有数据时为空字符串"""
+        min_date, max_date = self.date_range(fiscal_months)
+        if min_date is None:
+            return ""
+        return f"{min_date.strftime('%Y-%m-%d')} to {max_date.strftime('%Y-%m-%d')}"
+
+
+class FiscalCalendar:
+    """
+    进程内的财历（dimension_dayweek）索引
+
+    财历只在年度维护时变化，日期 -> 财月/周数、财月 -> 日期区间/天数 的查询直接读内存。
+    每隔 FISCAL_CALENDAR_CHECK_SECONDS 用一条轻量查询（行数、max(actual_date)、max(create_time)）判断是否需要重新加载，
+    维护财历后也可以调用 invalidate() 立即失效。
+    """
+
+    _snapshot: FiscalCalendarSnapshot = None
+    _checked_at: float = 0
+    _lock = asyncio.Lock()
+
+    @classmethod
+    def invalidate(cls):
+        """显式失效，下次 get 时重新加载"""
+        cls._snapshot = None
+        cls._checked_at = 0
+        app_logger.info("Fiscal calendar invalidated")
+
+    @classmethod
+    async def get(cls, db: AsyncSession) -> FiscalCalendarSnapshot:
+        """获取当前财历快照，必要时检查版本并重新加载"""
+        snapshot = cls._snapshot
+        if snapshot is not None and time.time() - cls._checked_at < FISCAL_CALENDAR_CHECK_SECONDS:
+            return snapshot
+
+        async with cls._lock:
+            snapshot = cls._snapshot
+            if snapshot is not None and time.time() - cls._checked_at < FISCAL_CALENDAR_CHECK_SECONDS:
+                return snapshot
+
+            version = await cls._fetch_version(db)
+            if snapshot is None or snapshot.version != version:
+                snapshot = await cls._load(db, version)
+                cls._snapshot = snapshot
+            cls._checked_at = time.time()
+            return snapshot
+
+    @staticmethod
+    async def _fetch_version(db: AsyncSession) -> tuple:
+        result = await db.execute(
+            select(func.count(), func.max(DimensionDayWeek.actual_date), func.max(DimensionDayWeek.create_time))
+        )
+        return tuple(result.fetchone())
+
+    @staticmethod
+    async def _load(db: AsyncSession, version: tuple) -> FiscalCalendarSnapshot:
+        result = await db.execute(
+            select(
+                DimensionDayWeek.actual_date,
+                DimensionDayWeek.fiscal_month,
+                DimensionDayWeek.week_number,
+                DimensionDayWeek.finance_year
+            ).order_by(DimensionDayWeek.actual_date)
+        )
+        snapshot = FiscalCalendarSnapshot(version, result.fetchall())
+        app_logger.info(f"Fiscal calendar loaded: {len(snapshot.days)} days, {len(snapshot.month_ranges)} months")
+        return snapshot
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import time
+from typing import Awaitable, Callable, Optional
+
+from app.utils.logger import app_logger
+from app.utils.ttl_cache import TTLCache
+
+# 内存中最多缓存的报表结果数
+REPORT_CACHE_SIZE = 200
+# approved 状态的报表数据只会被审批/撤回/导入/重算改变，缓存时间较长
+REPORT_CACHE_APPROVED_TTL_SECONDS = 3600
+# 其他状态的数据随时可能被编辑，只做短时间缓存
+REPORT_CACHE_DRAFT_TTL_SECONDS = 60
+# 磁盘缓存目录，未配置时不启用磁盘缓存；只缓存 approved 状态的报表
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR")
+
+_MISSING = object()
+
+
+class ReportCache:
+    """
+    报表结果缓存
+
+    键为 (report_type, fiscal_month, status, role_code, approve, keyword)。
+    每个财月有一个版本号，写操作（审批、撤回、导入、佣金重算等）调用 invalidate 使版本号加一，
+    旧版本的结果不再命中，随 LRU 淘汰。相同参数的并发请求只计算一次。
+    配置 REPORT_CACHE_DIR 后，approved 状态的结果同时写入磁盘，按财月分目录，失效时删除对应目录。
+    """
+
+    _memory = TTLCache(REPORT_CACHE_SIZE, REPORT_CACHE_APPROVED_TTL_SECONDS)
+    _generations = {}
+    _global_generation = 0
+    _inflight = {}
+
+    @staticmethod
+    async def get_or_compute(report_type: str, fiscal_month: str, status: str, role_code: str,
+                             keyword: Optional[str], compute: Callable[[], Awaitable], approve=None):
+        """
+        读取缓存的报表结果，未命中时调用 compute 计算并缓存
+
+        Args:
+            report_type: 报表类型
+            fiscal_month: 财月
+            status: 状态过滤
+            role_code: 角色代码（决定门店权限）
+            keyword: 门店关键字
+            compute: 无参协程函数，返回报表结果
+            approve: 用户审批权限，影响部分报表的可见字段
+
+        Returns:
+            报表结果（多个请求共享同一对象，调用方不要修改）
+        """
+        key = (report_type, fiscal_month, status, role_code, approve, keyword or None)
+        generation = ReportCache._generation(fiscal_month)
+        memory_key = (key, generation)
+
+        value = ReportCache._memory.get(memory_key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        pending = ReportCache._inflight.get(memory_key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        ReportCache._inflight[memory_key] = future
+        try:
+            cacheable_on_disk = REPORT_CACHE_DIR and status == 'approved'
+            value = _MISSING
+            if cacheable_on_disk:
+                value = await asyncio.to_thread(ReportCache._disk_read, key)
+            if value is _MISSING:
+                value = await compute()
+                if cacheable_on_disk and ReportCache._generation(fiscal_month) == generation:
+                    await asyncio.to_thread(ReportCache._disk_write, key, value)
+                    # 写入期间该财月被失效时，删除刚写入的文件
+                    if ReportCache._generation(fiscal_month) != generation:
+                        ReportCache._disk_remove(key)
+
+            ttl = REPORT_CACHE_APPROVED_TTL_SECONDS if status == 'approved' else REPORT_CACHE_DRAFT_TTL_SECONDS
+            ReportCache._memory.set(memory_key, value, ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他请求等待时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            ReportCache._inflight.pop(memory_key, None)
+
+    @staticmethod
+    def invalidate(fiscal_month: str = None):
+        """
+        使一个财月的报表缓存失效，fiscal_month 为空时失效全部
+
+        Args:
+            fiscal_month: 财月
+        """
+        if fiscal_month:
+            ReportCache._generations[fiscal_month] = ReportCache._generations.get(fiscal_month, 0) + 1
+        else:
+            ReportCache._global_generation += 1
+            ReportCache._generations.clear()
+            ReportCache._memory.clear()
+
+        if REPORT_CACHE_DIR:
+            path = ReportCache._disk_dir(fiscal_month) if fiscal_month else REPORT_CACHE_DIR
+            shutil.rmtree(path, ignore_errors=True)
+        app_logger.info(f"Report cache invalidated: {fiscal_month or 'all'}")
+
+    @staticmethod
+    def stats() -> dict:
+        stats = ReportCache._memory.stats()
+        stats['disk_dir'] = REPORT_CACHE_DIR
+        stats['inflight'] = len(ReportCache._inflight)
+        return stats
+
+    @staticmethod
+    def _generation(fiscal_month: str) -> tuple:
+        return ReportCache._global_generation, ReportCache._generations.get(fiscal_month, 0)
+
+    @staticmethod
+    def _disk_dir(fiscal_month: str) -> str:
+        return os.path.join(REPORT_CACHE_DIR, re.sub(r'[^0-9A-Za-z_-]', '_', str(fiscal_month)))
+
+    @staticmethod
+    def _disk_path(key: tuple) -> str:
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(ReportCache._disk_dir(key[1]), f"{digest}.pkl")
+
+    @staticmethod
+    def _disk_read(key: tuple):
+        path = ReportCache._disk_path(key)
+        try:
+            if os.path.getmtime(path) + REPORT_CACHE_APPROVED_TTL_SECONDS <= time.time():
+                os.remove(path)
+                return _MISSING
+            with open(path, 'rb') as f:
+                stored_key, value = pickle.load(f)
+            return value if stored_key == key else _MISSING
+        except FileNotFoundError:
+            return _MISSING
+        except Exception as e:
+            app_logger.warning(f"Report cache file {path} unreadable: {e}")
+            return _MISSING
+
+    @staticmethod
+    def _disk_write(key: tuple, value):
+        path = ReportCache._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception as e:
+            app_logger.warning(f"Report cache file {path} not written: {e}")
+
+    @staticmethod
+    def _disk_remove(key: tuple):
+        try:
+            os.remove(ReportCache._disk_path(key))
+        except OSError:
+            pass
@@ -0,0 +1,244 @@
+import asyncio
+import time
+from collections import defaultdict
+from decimal import Decimal, ROUND_FLOOR
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.commission import CommissionRuleModel, CommissionRuleDetailModel, CommissionRuleCategory, \
+    CommissionRuleAssignmentModel
+from app.utils.logger import app_logger
+
+# 两次版本检查之间的最小间隔（秒），间隔内直接使用内存中的规则
+RULE_CATALOG_CHECK_SECONDS = 60
+
+# end_value 为空（无上限）时使用的哨兵
+_NO_END = np.iinfo(np.int64).max
+
+
+def _hundredths(value) -> int:
+    """
+    达成率/区间值 -> 向下取整的百分之一单位整数
+    区间值为 DECIMAL(12,2)，对整数 s、e 有 s <= r 等价于 s <= floor(r)、e > r 等价于 e > floor(r)，比较结果不变
+    """
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int((value * 100).to_integral_value(rounding=ROUND_FLOOR))
+
+
+class TierIndex:
+    """
+    单条规则的阶梯索引
+
+    按 start_value 升序保存下界/上界（百分之一单位的 int64 数组），
+    用 np.searchsorted 一次解析整组达成率：取最后一个 start_value <= 达成率 的阶梯，
+    其 end_value 不覆盖时（区间重叠/断档的配置）再向前逐个查找，与 SQL 条件
+    start_value <= rate AND (end_value IS NULL OR end_value > rate) 结果一致。
+    """
+
+    def __init__(self, tiers: list):
+        self.tiers = [tier for tier in tiers if tier.start_value is not None]
+        self.starts = np.array([_hundredths(tier.start_value) for tier in self.tiers], dtype=np.int64)
+        self.ends = np.array([_NO_END if tier.end_value is None else _hundredths(tier.end_value)
+                              for tier in self.tiers], dtype=np.int64)
+
+    def lookup(self, achievement_rates) -> np.ndarray:
+        """
+        Args:
+            achievement_rates: 达成率序列
+
+        Returns:
+            np.ndarray: 每个达成率对应的阶梯下标，未匹配为 -1
+        """
+        rates = np.array([_hundredths(rate) for rate in achievement_rates], dtype=np.int64)
+        if not len(self.tiers) or not len(rates):
+            return np.full(len(rates), -1, dtype=np.int64)
+
+        positions = np.searchsorted(self.starts, rates, side='right') - 1
+        covered = positions >= 0
+        covered[covered] = self.ends[positions[covered]] > rates[covered]
+        result = np.where(covered, positions, -1)
+
+        # 少见情况：最后一个下界满足但上界不覆盖，向前查找
+        for n in np.flatnonzero(~covered & (positions > 0)):
+            for idx in range(positions[n] - 1, -1, -1):
+                if self.ends[idx] > rates[n]:
+                    result[n] = idx
+                    break
+        return result
+
+    def match_many(self, achievement_rates) -> list:
+        """达成率序列 -> 阶梯行列表（未匹配为 None）"""
+        return [self.tiers[idx] if idx >= 0 else None for idx in self.lookup(achievement_rates)]
+
+    def match(self, achievement_rate):
+        return self.match_many([achievement_rate])[0]
+
+
+class RuleCatalogSnapshot:
+    """
+    某一版本的佣金规则快照（只读）
+
+    rules: rule_code -> 规则行
+    tiers: rule_code -> 按 start_value 升序排列的阶梯行
+    categories: rule_detail_code -> {level_value_1: Decimal 系数}
+    """
+
+    def __init__(self, version: tuple, rules: dict, assignments: list, tiers: dict, categories: dict):
+        self.version = version
+        self.loaded_at = time.time()
+        self.rules = rules
+        self.assignments = assignments
+        self.tiers = tiers
+        self.categories = categories
+
+        self._position_rules = defaultdict(lambda: defaultdict(list))
+        for row in assignments:
+            if row.is_active:
+                self._position_rules[row.store_type][row.position].append(row.rule_code)
+
+        # 只有 start_value 非空的阶梯参与匹配（与 SQL 中 start_value <= rate 一致）
+        self._tier_indexes = {rule_code: TierIndex(rule_tiers) for rule_code, rule_tiers in tiers.items()}
+
+    def position_rules(self, store_type: str) -> dict:
+        """店铺类型下 启用的 岗位 -> [rule_code]"""
+        return self._position_rules.get(store_type, {})
+
+    def rules_for(self, store_type: str, position: str) -> list:
+        return self._position_rules.get(store_type, {}).get(position, [])
+
+    def assignments_for(self, store_type: str, position: str) -> list:
+        """店铺类型+岗位的全部分配（包含未启用的），保持加载顺序"""
+        return [row for row in self.assignments if row.store_type == store_type and row.position == position]
+
+    def match_tier(self, rule_code: str, achievement_rate):
+        """
+        查找 start_value <= 达成率 且 (end_value 为空 或 end_value > 达成率) 的阶梯
+
+        Returns:
+            阶梯行，未匹配返回 None
+        """
+        tier_index = self._tier_indexes.get(rule_code)
+        return tier_index.match(achievement_rate) if tier_index else None
+
+    def match_tiers(self, rule_code: str, achievement_rates) -> list:
+        """一次解析一组达成率，返回与输入一一对应的阶梯行（未匹配为 None）"""
+        tier_index = self._tier_indexes.get(rule_code)
+        if not tier_index:
+            return [None] * len(achievement_rates)
+        return tier_index.match_many(achievement_rates)
+
+    def category_coefficients(self, rule_detail_code: str) -> dict:
+        return self.categories.get(rule_detail_code, {})
+
+
+class CommissionRuleCatalog:
+    """
+    进程内的佣金规则目录缓存
+
+    规则在一个月内几乎不变，计算时从内存读取，不再反复查询 MySQL。
+    每隔 RULE_CATALOG_CHECK_SECONDS 用一条轻量查询（四张规则表的 max(updated_at) 和行数）判断是否需要重新加载，
+    规则维护后也可以调用 invalidate() 立即失效。
+    """
+
+    _snapshot: RuleCatalogSnapshot = None
+    _checked_at: float = 0
+    _lock = asyncio.Lock()
+
+    @classmethod
+    def invalidate(cls):
+        """显式失效，下次 get 时重新加载"""
+        cls._snapshot = None
+        cls._checked_at = 0
+        app_logger.info("Commission rule catalog invalidated")
+
+    @classmethod
+    async def get(cls, db: AsyncSession) -> RuleCatalogSnapshot:
+        """获取当前规则快照，必要时检查版本并重新加载"""
+        snapshot = cls._snapshot
+        if snapshot is not None and time.time() - cls._checked_at < RULE_CATALOG_CHECK_SECONDS:
+            return snapshot
+
+        async with cls._lock:
+            snapshot = cls._snapshot
+            if snapshot is not None and time.time() - cls._checked_at < RULE_CATALOG_CHECK_SECONDS:
+                return snapshot
+
+            version = await cls._fetch_version(db)
+            if snapshot is None or snapshot.version != version:
+                snapshot = await cls._load(db, version)
+                cls._snapshot = snapshot
+            cls._checked_at = time.time()
+            return snapshot
+
+    @staticmethod
+    async def _fetch_version(db: AsyncSession) -> tuple:
+        """四张规则表的 (max(updated_at), count) 作为版本号"""
+        parts = []
+        for model in (CommissionRuleModel, CommissionRuleDetailModel, CommissionRuleCategory,
+                      CommissionRuleAssignmentModel):
+            parts.append(select(func.max(model.updated_at)).scalar_subquery())
+            parts.append(select(func.count()).select_from(model).scalar_subquery())
+        result = await db.execute(select(*parts))
+        return tuple(result.fetchone())
+
+    @staticmethod
+    async def _load(db: AsyncSession, version: tuple) -> RuleCatalogSnapshot:
+        rules_result = await db.execute(
+            select(
+                CommissionRuleModel.rule_code,
+                CommissionRuleModel.rule_name,
+                CommissionRuleModel.rule_basis,
+                CommissionRuleModel.rule_class,
+                CommissionRuleModel.rule_type,
+                CommissionRuleModel.minimum_guarantee,
+                CommissionRuleModel.consider_attendance,
+                CommissionRuleModel.minimum_guarantee_on_attendance,
+                CommissionRuleModel.attendance_calculation_logic
+            )
+        )
+        rules = {row.rule_code: row for row in rules_result.fetchall()}
+
+        assignment_result = await db.execute(
+            select(
+                CommissionRuleAssignmentModel.store_type,
+                CommissionRuleAssignmentModel.position,
+                CommissionRuleAssignmentModel.rule_code,
+                CommissionRuleAssignmentModel.is_active
+            )
+        )
+        assignments = assignment_result.fetchall()
+
+        detail_result = await db.execute(
+            select(
+                CommissionRuleDetailModel.rule_code,
+                CommissionRuleDetailModel.rule_detail_code,
+                CommissionRuleDetailModel.start_value,
+                CommissionRuleDetailModel.end_value,
+                CommissionRuleDetailModel.value
+            ).order_by(CommissionRuleDetailModel.rule_code, CommissionRuleDetailModel.start_value)
+        )
+        tiers = defaultdict(list)
+        for row in detail_result.fetchall():
+            tiers[row.rule_code].append(row)
+
+        category_result = await db.execute(
+            select(
+                CommissionRuleCategory.rule_detail_code,
+                CommissionRuleCategory.level_value_1,
+                CommissionRuleCategory.value
+            )
+        )
+        categories = defaultdict(dict)
+        for row in category_result.fetchall():
+            categories[row.rule_detail_code][row.level_value_1] = \
+                Decimal(str(row.value)) if row.value is not None else None
+
+        app_logger.info(f"Commission rule catalog loaded: {len(rules)} rules, {len(assignments)} assignments, "
+                        f"{sum(len(t) for t in tiers.values())} tiers, {len(categories)} category rules")
+        return RuleCatalogSnapshot(version, rules, assignments, dict(tiers), dict(categories))
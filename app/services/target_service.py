@@ -1,11 +1,10 @@
-from collections import defaultdict
 from sqlalchemy import String, func, null, cast, Integer, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, tuple_
+from sqlalchemy.dialects.mysql import insert
 
-from app.models.commission import CommissionStoreModel, CommissionMainModel, CommissionRuleModel, \
-    CommissionRuleAssignmentModel
+from app.models.commission import CommissionStoreModel, CommissionMainModel
 from app.models.target import TargetStoreMain, TargetStoreWeek, TargetStoreDaily
 from app.models.staff import StaffAttendanceModel, StaffModel
 from app.schemas.target import TargetStoreUpdate, \
@@ -14,12 +13,28 @@ from app.schemas.target import TargetStoreUpdate, \
 from app.models.dimension import DimensionDayWeek, StoreModel
 
 from datetime import datetime
+import asyncio
+import time
 
+import numpy as np
+
+from app.database import SessionLocal
 from app.services.commission_service import CommissionUtil
+from app.services.rule_catalog_service import CommissionRuleCatalog
+from app.services.fiscal_calendar_service import FiscalCalendar
+from app.services.commission_dirty_service import CommissionDirtyService
 from app.utils.permissions import build_store_permission_query
+from app.utils.keyset import keyset_after
+from app.utils.pivot import pivot
 from app.utils.logger import app_logger
 from decimal import Decimal, ROUND_HALF_UP
 
+# 批量写入门店目标时每条语句的行数
+TARGET_UPSERT_CHUNK = 1000
+
+# 门店员工明细（get_staff_attendance）的耗时预算（毫秒），超出时记录告警
+STORE_DETAIL_LATENCY_BUDGET_MS = 300
+
 
 class TargetRPTService:
 
@@ -44,17 +59,12 @@ class TargetRPTService:
         if has_approved:
             return should_display
 
-        # 查询财月的日期范围
-        date_range_result = await db.execute(
-            select(
-                func.min(DimensionDayWeek.actual_date).label('min_date')
-            )
-                .where(DimensionDayWeek.fiscal_month == fiscal_month)
-        )
-        date_range = date_range_result.fetchone()
+        # 财月的日期范围
+        calendar = await FiscalCalendar.get(db)
+        min_date, _ = calendar.date_range([fiscal_month])
 
         # 如果最小日期在今天之后，则隐藏目标值
-        if date_range and date_range.min_date and date_range.min_date.date() > datetime.now().date():
+        if min_date and min_date.date() > datetime.now().date():
             should_display = False
             app_logger.debug("Minimum date is in the future, hiding target values")
 
@@ -74,7 +84,7 @@ class TargetRPTService:
 
             should_values = await TargetRPTService._check_should_display_target_values(db, fiscal_month, has_approved)
 
-            store_permission_query = build_store_permission_query(role_code)
+            store_permission_query = await build_store_permission_query(db, role_code)
             store_alias = store_permission_query.subquery()
 
             # 记录权限查询结果
@@ -186,7 +196,7 @@ class TargetRPTService:
                                                 role_code: str):
 
         try:
-            store_permission_query = build_store_permission_query(role_code)
+            store_permission_query = await build_store_permission_query(db, role_code)
             store_alias = store_permission_query.subquery()
 
             # 执行SQL查询逻辑
@@ -293,7 +303,7 @@ class TargetRPTService:
         try:
             should_values = await TargetRPTService._check_should_display_target_values(db, fiscal_month, has_approved)
 
-            store_permission_query = build_store_permission_query(role_code)
+            store_permission_query = await build_store_permission_query(db, role_code)
             store_alias = store_permission_query.subquery()
 
             query = select(
@@ -421,7 +431,7 @@ class TargetRPTService:
         """
         try:
             should_values = await TargetRPTService._check_should_display_target_values(db, fiscal_month, has_approved)
-            store_permission_query = build_store_permission_query(role_code)
+            store_permission_query = await build_store_permission_query(db, role_code)
             store_alias = store_permission_query.subquery()
 
             # 执行SQL查询逻辑
@@ -458,49 +468,32 @@ class TargetRPTService:
             result = await db.execute(query)
             target_data = result.all()
 
-            # 按日期分组数据并构建横向表结构（参考 get_budget_data 的实现方式）
-            date_groups = defaultdict(dict)
-            store_codes = set()
-            # store_names = {}
+            # 一次遍历构建 门店 × 日期 的稠密矩阵（日期按 date 值排序，每个日期只格式化一次）
+            matrix = pivot(
+                (row.store_code, row.date,
+                 row.target_date_value if row.target_date_value is not None and should_values else 0.0)
+                for row in target_data if row.date
+            )
+            dates = [date.strftime('%Y%m%d') for date in matrix.column_keys]
 
-            for row in target_data:
-                date_str = row.date.strftime('%Y%m%d') if row.date else None
-                store_code = row.store_code
-                # store_name = row.store_name
-                target_value = row.target_date_value if row.target_date_value is not None and should_values else 0.0
-
-                if date_str:
-                    date_groups[date_str][store_code] = target_value
-                    store_codes.add(store_code)
-                    # if store_code not in store_names:
-                    #     store_names[store_code] = store_name
-
-            # 构建结果数据 - 转换为横向格式
-            sorted_store_codes = sorted(list(store_codes))
+            # 构建结果数据 - 转换为横向格式，每个门店一行
             formatted_data = []
-
-            # 为每个门店构建一行数据
-            for store_code in sorted_store_codes:
-                # store_name = store_names.get(store_code, "")
+            for store_code, values in zip(matrix.row_keys, matrix.rows()):
                 row_data = {"store": f"{store_code}"}
-
-                # 为每个日期添加目标值
-                for date_str in sorted(date_groups.keys()):
-                    row_data[date_str] = date_groups[date_str].get(store_code, 0.0)
-
+                row_data.update(zip(dates, values))
                 formatted_data.append(row_data)
 
             # 构建字段翻译
             field_translations = {
                 "store": {"en": "Store", "zh": "店铺"}
             }
-            for date_str in sorted(date_groups.keys()):
+            for date_str in dates:
                 field_translations[date_str] = {"en": date_str, "zh": date_str}
 
             return {
                 "data": formatted_data,
                 "field_translations": field_translations,
-                "dates": sorted(list(date_groups.keys()))  # 返回排序后的日期列表
+                "dates": dates  # 返回排序后的日期列表
             }
         except Exception as e:
             error_msg = f"Error in get_rpt_target_date_horizontal_version: {str(e)}"
@@ -526,59 +519,110 @@ class TargetRPTService:
             dict: 报表数据
         """
         try:
-            should_values = await TargetRPTService._check_should_display_target_values(db, fiscal_month, has_approved)
-            store_permission_query = build_store_permission_query(role_code)
-            store_alias = store_permission_query.subquery()
-            # 执行SQL查询逻辑
-            query = select(
-                TargetStoreMain.fiscal_month,
-                TargetStoreMain.store_code,
-                store_alias.c.Location_ID,
-                store_alias.c.store_name,
-                StaffAttendanceModel.staff_code,
-                StaffAttendanceModel.target_value
-            ).select_from(
-                TargetStoreMain.__table__.join(
-                    StaffAttendanceModel.__table__,
-                    (TargetStoreMain.store_code == StaffAttendanceModel.store_code) &
-                    (TargetStoreMain.fiscal_month == StaffAttendanceModel.fiscal_month)
-                ).join(
-                    store_alias,
-                    store_alias.c.store_code == TargetStoreMain.store_code
-                )
-            ).where(
-                TargetStoreMain.fiscal_month == fiscal_month,
-                StaffAttendanceModel.target_value > 0
-            ).order_by(TargetStoreMain.store_code, StaffAttendanceModel.staff_code)
+            formatted_data = [row async for row in TargetRPTService.iter_rpt_target_by_staff(
+                db, fiscal_month, key_word, status, role_code, has_approved)]
 
-            # 如果有关键字过滤条件
-            if key_word:
-                query = query.where(
-                    TargetStoreMain.store_code.contains(key_word) |
-                    store_alias.c.store_name.contains(key_word)
-                )
+            return {
+                "data": formatted_data,
+                "field_translations": TargetRPTService.target_by_staff_field_translations()
+            }
+        except Exception as e:
+            # 记录并返回错误信息
+            error_msg = f"Error in get_rpt_target_by_staff: {str(e)}"
+            # print(error_msg)  # 在实际应用中应该使用日志记录
+            app_logger.error(error_msg)
+            return {
+                "data": [],
+                "field_translations": [],
+                "error": error_msg
+            }
 
-            if status != 'All':
-                app_logger.debug(f"Applying status filter: {status}")
-                query = query.where(TargetStoreMain.staff_status == status)
+    @staticmethod
+    def target_by_staff_field_translations() -> dict:
+        """员工目标报表的字段翻译"""
+        return {
+            "fiscal_month_Format": {"en": "Fiscal Month (Format)", "zh": "财月 (Format)"},
+            "fiscal_month_id": {"en": "Fiscal Month (ID)", "zh": "财月 (ID)"},
+            "fiscal_month_num": {"en": "Fiscal Month (Num)", "zh": "财月 (Num)"},
+            "store_code": {"en": "Location Code", "zh": "店铺代码"},
+            "Location_ID": {"en": "Location ID", "zh": "店铺ID"},
+            "store_name": {"en": "Location Short Name", "zh": "店铺名称 (Short)"},
+            "Location_Long_Name": {"en": "Location Long Name", "zh": "店铺名称 (Long)"},
+            "staff_code": {"en": "Associate Number", "zh": "员工ID"},
+            "target_value": {"en": "Commission Target Local", "zh": "员工指标"}
+        }
 
-            result = await db.execute(query)
-            target_data = result.all()
+    @staticmethod
+    async def iter_rpt_target_by_staff(db: AsyncSession, fiscal_month: str, key_word: str, status: str, role_code: str,
+                                       has_approved: bool = False, after: tuple = None):
+        """
+        流式产生员工目标报表行，按 (store_code, staff_code) 顺序输出
 
-            # 构建结果数据
-            formatted_data = []
+        Args:
+            db: 数据库会话
+            fiscal_month: 财月
+            key_word: 查询关键字（门店代码或名称）
+            status: 状态过滤
+            role_code: 角色代码
+            has_approved: 用户是否有审批权限
+            after: 上一页最后一行的 (store_code, staff_code)，为空时从头开始
 
-            month_names = {
-                1: 'JAN', 2: 'FEB', 3: 'MAR', 4: 'APR', 5: 'MAY', 6: 'JUN',
-                7: 'JUL', 8: 'AUG', 9: 'SEP', 10: 'OCT', 11: 'NOV', 12: 'DEC'
-            }
+        Yields:
+            dict: 报表行
+        """
+        should_values = await TargetRPTService._check_should_display_target_values(db, fiscal_month, has_approved)
+        store_permission_query = await build_store_permission_query(db, role_code)
+        store_alias = store_permission_query.subquery()
+        # 执行SQL查询逻辑
+        query = select(
+            TargetStoreMain.fiscal_month,
+            TargetStoreMain.store_code,
+            store_alias.c.Location_ID,
+            store_alias.c.store_name,
+            StaffAttendanceModel.staff_code,
+            StaffAttendanceModel.target_value
+        ).select_from(
+            TargetStoreMain.__table__.join(
+                StaffAttendanceModel.__table__,
+                (TargetStoreMain.store_code == StaffAttendanceModel.store_code) &
+                (TargetStoreMain.fiscal_month == StaffAttendanceModel.fiscal_month)
+            ).join(
+                store_alias,
+                store_alias.c.store_code == TargetStoreMain.store_code
+            )
+        ).where(
+            TargetStoreMain.fiscal_month == fiscal_month,
+            StaffAttendanceModel.target_value > 0
+        ).order_by(TargetStoreMain.store_code, StaffAttendanceModel.staff_code)
 
-            for row in target_data:
+        # 如果有关键字过滤条件
+        if key_word:
+            query = query.where(
+                TargetStoreMain.store_code.contains(key_word) |
+                store_alias.c.store_name.contains(key_word)
+            )
+
+        if status != 'All':
+            app_logger.debug(f"Applying status filter: {status}")
+            query = query.where(TargetStoreMain.staff_status == status)
+
+        condition = keyset_after((TargetStoreMain.store_code, StaffAttendanceModel.staff_code), after)
+        if condition is not None:
+            query = query.where(condition)
+
+        month_names = {
+            1: 'JAN', 2: 'FEB', 3: 'MAR', 4: 'APR', 5: 'MAY', 6: 'JUN',
+            7: 'JUL', 8: 'AUG', 9: 'SEP', 10: 'OCT', 11: 'NOV', 12: 'DEC'
+        }
+
+        result = await db.stream(query)
+        try:
+            async for row in result:
                 fiscal_month_parts = row.fiscal_month.split('-')
                 fiscal_year = fiscal_month_parts[0]
                 fiscal_month_num = int(fiscal_month_parts[1])
 
-                formatted_data.append({
+                yield {
                     "fiscal_month_Format": f"FY{fiscal_year} P{fiscal_month_num:02d} ({month_names.get(fiscal_month_num, '')})",
                     "fiscal_month_id": f"{fiscal_year}{fiscal_month_num:02d}",  # 202508 格式
                     "fiscal_month_num": fiscal_month_num,  # 8 格式
@@ -588,34 +632,9 @@ class TargetRPTService:
                     "Location_Long_Name": row.store_name,
                     "staff_code": row.staff_code,
                     "target_value": row.target_value if should_values else 0
-                })
-
-            field_translations = {
-                "fiscal_month_Format": {"en": "Fiscal Month (Format)", "zh": "财月 (Format)"},
-                "fiscal_month_id": {"en": "Fiscal Month (ID)", "zh": "财月 (ID)"},
-                "fiscal_month_num": {"en": "Fiscal Month (Num)", "zh": "财月 (Num)"},
-                "store_code": {"en": "Location Code", "zh": "店铺代码"},
-                "Location_ID": {"en": "Location ID", "zh": "店铺ID"},
-                "store_name": {"en": "Location Short Name", "zh": "店铺名称 (Short)"},
-                "Location_Long_Name": {"en": "Location Long Name", "zh": "店铺名称 (Long)"},
-                "staff_code": {"en": "Associate Number", "zh": "员工ID"},
-                "target_value": {"en": "Commission Target Local", "zh": "员工指标"}
-            }
-
-            return {
-                "data": formatted_data,
-                "field_translations": field_translations
-            }
-        except Exception as e:
-            # 记录并返回错误信息
-            error_msg = f"Error in get_rpt_target_by_staff: {str(e)}"
-            # print(error_msg)  # 在实际应用中应该使用日志记录
-            app_logger.error(error_msg)
-            return {
-                "data": [],
-                "field_translations": [],
-                "error": error_msg
-            }
+                }
+        finally:
+            await result.close()
 
 
 class TargetStoreService:
@@ -634,9 +653,15 @@ class TargetStoreService:
         """
         批量更新 TargetStoreMain 的 target_value
 
+        该财月其余门店的目标清零；不存在的门店目标记录按 StoreModel 的门店类型新建。
+        门店类型一次查询解析，结果按块 INSERT ... ON DUPLICATE KEY UPDATE 写入。
+
         Args:
             db: 数据库会话
             target_updates: 包含 store_code, fiscal_month, target_value 的字典列表
+
+        Returns:
+            list: 写入的 {"store_code", "fiscal_month", "target_value"}，同一门店财月多次出现时以最后一条为准
         """
 
         if not target_updates:
@@ -648,64 +673,58 @@ class TargetStoreService:
         if not fiscal_month:
             raise ValueError("fiscal_month is required in target_updates")
 
-            # 第一步：将指定 fiscal_month 的所有 TargetStoreMain 记录的 target_value 设置为 0
-        await db.execute(
-            select(TargetStoreMain)
-                .where(TargetStoreMain.fiscal_month == fiscal_month)
-                .execution_options(synchronize_session=False)
+        targets = {}
+        for update_data in target_updates:
+            key = (update_data.get('store_code'), update_data.get('fiscal_month'))
+            targets[key] = update_data.get('target_value')
+
+        # 门店目标变化影响该财月全部门店的佣金
+        existing_stores_result = await db.execute(
+            select(TargetStoreMain.store_code).where(TargetStoreMain.fiscal_month == fiscal_month)
         )
+        await CommissionDirtyService.mark_stores(
+            db,
+            [(row.store_code, fiscal_month) for row in existing_stores_result.fetchall()] + list(targets),
+            "target_value"
+        )
+
+        # 第一步：将指定 fiscal_month 的所有 TargetStoreMain 记录的 target_value 设置为 0
         await db.execute(
             update(TargetStoreMain)
                 .where(TargetStoreMain.fiscal_month == fiscal_month)
                 .values(target_value=0)
         )
 
-        updated_targets = []
-
-        for update_data in target_updates:
-            store_code = update_data.get('store_code')
-            fiscal_month = update_data.get('fiscal_month')
-            target_value = update_data.get('target_value')
-
-            # 查询现有记录
-            result = await db.execute(select(TargetStoreMain).where(
-                TargetStoreMain.store_code == store_code,
-                TargetStoreMain.fiscal_month == fiscal_month
-            ))
-            target_store = result.scalar_one_or_none()
+        # 新建记录使用的门店类型（已存在的记录不修改 store_type）
+        store_codes = sorted({store_code for store_code, _ in targets})
+        store_types = {}
+        for i in range(0, len(store_codes), TARGET_UPSERT_CHUNK):
+            result_store = await db.execute(
+                select(StoreModel.store_code, StoreModel.store_type)
+                    .where(StoreModel.store_code.in_(store_codes[i:i + TARGET_UPSERT_CHUNK]))
+            )
+            store_types.update({row.store_code: row.store_type for row in result_store.fetchall()})
 
-            if target_store:
-                # 更新现有记录
-                target_store.target_value = target_value
-                target_store.updated_at = datetime.now()
-                updated_targets.append(target_store)
-            else:
-                # 创建新记录
-                store_type = None
-                result_store = await db.execute(
-                    select(StoreModel.store_type)
-                        .where(StoreModel.store_code == store_code)
-                )
-                store_data = result_store.fetchone()
-                if store_data:
-                    store_type = store_data.store_type
-
-                new_target = TargetStoreMain(
-                    store_code=store_code,
-                    fiscal_month=fiscal_month,
-                    target_value=target_value,
-                    store_type=store_type
-                )
-                db.add(new_target)
-                updated_targets.append(new_target)
+        rows = [
+            {
+                "store_code": store_code,
+                "fiscal_month": month,
+                "target_value": target_value,
+                "store_type": store_types.get(store_code)
+            }
+            for (store_code, month), target_value in targets.items()
+        ]
+        now = datetime.now()
+        for i in range(0, len(rows), TARGET_UPSERT_CHUNK):
+            stmt = insert(TargetStoreMain).values(rows[i:i + TARGET_UPSERT_CHUNK])
+            stmt = stmt.on_duplicate_key_update(target_value=stmt.inserted.target_value, updated_at=now)
+            await db.execute(stmt)
 
         await db.commit()
+        app_logger.info(f"batch_update_target_value: fiscal_month {fiscal_month}, {len(rows)} store targets written")
 
-        # 刷新所有对象以获取数据库生成的值
-        for target in updated_targets:
-            await db.refresh(target)
-
-        return updated_targets
+        return [{"store_code": row["store_code"], "fiscal_month": row["fiscal_month"],
+                 "target_value": row["target_value"]} for row in rows]
 
     @staticmethod
     async def update_target_store(db: AsyncSession, store_code: str, fiscal_month: str,
@@ -765,6 +784,10 @@ class TargetStoreService:
                 target_store.store_submit_by = role_code
                 target_store.store_submit_at = now
 
+        if any(key in target_dict and target_dict[key] != getattr(target_store, key)
+               for key in ('target_value', 'sales_value', 'store_type')):
+            await CommissionDirtyService.mark(db, store_code, fiscal_month, None, "target_store")
+
         # 更新其他字段
         for key, value in target_dict.items():
             setattr(target_store, key, value)
@@ -781,7 +804,7 @@ class TargetStoreService:
     async def get_all_target_stores_by_key(role_code: str, fiscal_month: str, key_word: str, db: AsyncSession,
                                            has_approved: bool = False):
 
-        store_permission_query = build_store_permission_query(role_code)
+        store_permission_query = await build_store_permission_query(db, role_code)
         store_alias = store_permission_query.subquery()
 
         query = select(
@@ -813,17 +836,8 @@ class TargetStoreService:
         target_stores = result.all()
 
         should_values = True
-        date_range_result = await db.execute(
-            select(
-                func.min(DimensionDayWeek.actual_date).label('min_date'),
-                func.max(DimensionDayWeek.actual_date).label('max_date')
-            )
-                .where(DimensionDayWeek.fiscal_month == fiscal_month)
-        )
-        date_range = date_range_result.fetchone()
-        min_date = None
-        if date_range and date_range.min_date:
-            min_date = date_range.min_date
+        calendar = await FiscalCalendar.get(db)
+        min_date, _ = calendar.date_range([fiscal_month])
 
         app_logger.debug(f"min_date values: {min_date}")
         if min_date and min_date.date() > datetime.now().date():
@@ -1112,19 +1126,9 @@ class TargetStoreDailyService:
         target_daily = result.all()
 
         should_values = True
-        date_range_result = await db.execute(
-            select(
-                func.min(DimensionDayWeek.actual_date).label('min_date'),
-                func.max(DimensionDayWeek.actual_date).label('max_date')
-            )
-                .where(DimensionDayWeek.fiscal_month == fiscal_month)
-        )
-        date_range = date_range_result.fetchone()
-        min_date = None
-        fiscal_period = None
-        if date_range and date_range.min_date:
-            min_date = date_range.min_date
-            fiscal_period = f"{date_range.min_date.strftime('%Y-%m-%d')} to {date_range.max_date.strftime('%Y-%m-%d')}"
+        calendar = await FiscalCalendar.get(db)
+        min_date, _ = calendar.date_range([fiscal_month])
+        fiscal_period = calendar.fiscal_period([fiscal_month]) or None
 
         app_logger.debug(f"min_date values: {min_date}")
         if min_date and min_date.date() > datetime.now().date():
@@ -1169,117 +1173,141 @@ class TargetStoreDailyService:
         return {"data": data, "header_info": header_info, "MonthEnd": month_end_value}
 
     @staticmethod
-    async def update_target_monthly_percentage(db: AsyncSession, store_code: str, fiscal_month: str):
+    def build_monthly_percentages(calendar, daily_rows, week_percentages: dict) -> list:
         """
-        更新门店日目标数据的 monthly_percentage 字段
+        按周拆分和财历在内存中计算日目标的 monthly_percentage
+
+        monthly_percentage = 每日百分比 * 所在周百分比 / 100；日期不在该财月、没有周拆分或没有每日百分比时为 0
 
         Args:
-            db: 数据库会话
-            store_code: 门店代码
-            fiscal_month: 财务月份
+            calendar: FiscalCalendarSnapshot
+            daily_rows: 含 store_code, fiscal_month, target_date, percentage 的日目标行
+            week_percentages: (store_code, fiscal_month, week_number) -> 周百分比
 
         Returns:
-            list: 更新的记录列表
+            list: 可直接写入 TargetStoreDaily 的字典列表
         """
-        # 获取该门店该财月的所有日目标数据
-        result = await db.execute(select(TargetStoreDaily).where(
-            TargetStoreDaily.store_code == store_code,
-            TargetStoreDaily.fiscal_month == fiscal_month
-        ))
-        target_store_dailies = result.scalars().all()
-
-        if not target_store_dailies:
-            return []
+        rows = []
+        for row in daily_rows:
+            monthly_percentage = 0
+            week_number = calendar.week_number(row.target_date, row.fiscal_month)
+            if week_number is not None:
+                weekly_percentage = week_percentages.get((row.store_code, row.fiscal_month, week_number))
+                if weekly_percentage is not None:
+                    monthly_percentage = row.percentage * weekly_percentage / 100 if row.percentage else 0
+            rows.append({
+                "store_code": row.store_code,
+                "fiscal_month": row.fiscal_month,
+                "target_date": row.target_date,
+                "monthly_percentage": monthly_percentage
+            })
+        return rows
 
-        updated_targets = []
+    @staticmethod
+    async def rebuild_monthly_percentages(db: AsyncSession, fiscal_month: str, store_codes: list = None) -> int:
+        """
+        重新生成一个财月（全部门店或指定门店）日目标的 monthly_percentage
 
-        for target_store_daily in target_store_dailies:
-            target_date = target_store_daily.target_date
-            daily_percentage = target_store_daily.percentage
+        日目标和周拆分各一次查询，计算在内存中完成，结果按块 INSERT ... ON DUPLICATE KEY UPDATE 写入并提交一次。
 
-            # 获取日期对应的周数
-            day_week_result = await db.execute(
-                select(DimensionDayWeek.week_number)
-                    .where(
-                    DimensionDayWeek.fiscal_month == fiscal_month,
-                    DimensionDayWeek.actual_date == target_date
-                )
-            )
-            day_week_data = day_week_result.fetchone()
+        Args:
+            db: 数据库会话
+            fiscal_month: 财务月份
+            store_codes: 门店列表，为 None 时处理该财月全部门店
 
-            monthly_percentage = 0
-            if day_week_data:
-                week_number = day_week_data.week_number
+        Returns:
+            int: 更新的日目标行数
+        """
+        daily_query = select(
+            TargetStoreDaily.store_code,
+            TargetStoreDaily.fiscal_month,
+            TargetStoreDaily.target_date,
+            TargetStoreDaily.percentage
+        ).where(TargetStoreDaily.fiscal_month == fiscal_month)
+        week_query = select(
+            TargetStoreWeek.store_code,
+            TargetStoreWeek.fiscal_month,
+            TargetStoreWeek.week_number,
+            TargetStoreWeek.percentage
+        ).where(TargetStoreWeek.fiscal_month == fiscal_month)
+        if store_codes is not None:
+            daily_query = daily_query.where(TargetStoreDaily.store_code.in_(store_codes))
+            week_query = week_query.where(TargetStoreWeek.store_code.in_(store_codes))
+
+        daily_rows = (await db.execute(daily_query)).fetchall()
+        if not daily_rows:
+            return 0
 
-                # 获取该周的百分比
-                week_result = await db.execute(
-                    select(TargetStoreWeek.percentage)
-                        .where(
-                        TargetStoreWeek.store_code == store_code,
-                        TargetStoreWeek.fiscal_month == fiscal_month,
-                        TargetStoreWeek.week_number == week_number
-                    )
-                )
-                week_data = week_result.fetchone()
+        week_percentages = {
+            (row.store_code, row.fiscal_month, row.week_number): row.percentage
+            for row in (await db.execute(week_query)).fetchall()
+        }
+        calendar = await FiscalCalendar.get(db)
+        rows = TargetStoreDailyService.build_monthly_percentages(calendar, daily_rows, week_percentages)
+
+        now = datetime.utcnow()
+        for i in range(0, len(rows), TARGET_UPSERT_CHUNK):
+            stmt = insert(TargetStoreDaily).values(rows[i:i + TARGET_UPSERT_CHUNK])
+            stmt = stmt.on_duplicate_key_update(monthly_percentage=stmt.inserted.monthly_percentage, updated_at=now)
+            await db.execute(stmt)
+        await db.commit()
 
-                if week_data:
-                    weekly_percentage = week_data.percentage
-                    # 计算每月百分比 = 每日百分比 * 每周百分比 / 100
-                    monthly_percentage = daily_percentage * weekly_percentage / 100 if daily_percentage else 0
+        app_logger.info(f"rebuild_monthly_percentages: fiscal_month {fiscal_month}, {len(rows)} daily targets written")
+        return len(rows)
 
-            # 更新 monthly_percentage 字段
-            target_store_daily.monthly_percentage = monthly_percentage
-            target_store_daily.updated_at = datetime.utcnow()
-            updated_targets.append(target_store_daily)
+    @staticmethod
+    async def update_target_monthly_percentage(db: AsyncSession, store_code: str, fiscal_month: str):
+        """
+        更新门店日目标数据的 monthly_percentage 字段
 
-        await db.commit()
+        Args:
+            db: 数据库会话
+            store_code: 门店代码
+            fiscal_month: 财务月份
 
-        # 刷新所有对象以获取数据库生成的值
-        for target in updated_targets:
-            await db.refresh(target)
+        Returns:
+            list: 更新的记录列表
+        """
+        updated = await TargetStoreDailyService.rebuild_monthly_percentages(db, fiscal_month, [store_code])
+        if not updated:
+            return []
 
-        return updated_targets
+        result = await db.execute(select(TargetStoreDaily).where(
+            TargetStoreDaily.store_code == store_code,
+            TargetStoreDaily.fiscal_month == fiscal_month
+        ))
+        return result.scalars().all()
 
     @staticmethod
     async def create_target_store_daily(db: AsyncSession,
                                         target_data: TargetStoreDailyCreate, role_code: str = 'system'):
+        """
+        保存门店一个财月的日目标占比
 
-        created_targets = []
-        for day_data in target_data.days:
+        新日期按财历补充 week_number；已存在的日期只更新 percentage。全部日期一次 INSERT ... ON DUPLICATE KEY UPDATE 写入。
 
-            dimension_result = await db.execute(
-                select(DimensionDayWeek.week_number)
-                    .where(
-                    DimensionDayWeek.actual_date == day_data.target_date
-                )
-            )
-            dimension_data = dimension_result.fetchone()
-            week_number = dimension_data.week_number if dimension_data else None
+        Returns:
+            list: 保存后的 TargetStoreDaily 记录
+        """
+        calendar = await FiscalCalendar.get(db)
+        percentages = {day_data.target_date: day_data.percentage for day_data in target_data.days}
+        rows = [
+            {
+                "store_code": target_data.store_code,
+                "fiscal_month": target_data.fiscal_month,
+                "target_date": target_date,
+                "week_number": calendar.week_number(target_date),
+                "percentage": percentage,
+                "creator_code": role_code
+            }
+            for target_date, percentage in percentages.items()
+        ]
 
-            result = await db.execute(select(TargetStoreDaily).where(
-                TargetStoreDaily.store_code == target_data.store_code,
-                TargetStoreDaily.fiscal_month == target_data.fiscal_month,
-                TargetStoreDaily.target_date == day_data.target_date
-            ))
-            existing_target = result.scalar_one_or_none()
-            if existing_target:
-                # 如果存在，更新记录
-                for key, value in day_data.dict().items():
-                    if key not in ['store_code', 'fiscal_month', 'target_date']:  # 不更新主键
-                        setattr(existing_target, key, value)
-                existing_target.updated_at = datetime.now()
-                created_targets.append(existing_target)
-            else:
-                target_store_daily = TargetStoreDaily(
-                    store_code=target_data.store_code,
-                    fiscal_month=target_data.fiscal_month,
-                    target_date=day_data.target_date,
-                    week_number=week_number,
-                    percentage=day_data.percentage,
-                    creator_code=role_code
-                )
-                db.add(target_store_daily)
-                created_targets.append(target_store_daily)
+        now = datetime.now()
+        for i in range(0, len(rows), TARGET_UPSERT_CHUNK):
+            stmt = insert(TargetStoreDaily).values(rows[i:i + TARGET_UPSERT_CHUNK])
+            stmt = stmt.on_duplicate_key_update(percentage=stmt.inserted.percentage, updated_at=now)
+            await db.execute(stmt)
 
         await db.commit()
 
@@ -1291,11 +1319,14 @@ class TargetStoreDailyService:
         )
         await TargetStoreService.update_target_store(db, target_data.store_code, target_data.fiscal_month,
                                                      target_store_update, role_code)
-        # 刷新所有创建的对象以获取数据库生成的值
-        for target in created_targets:
-            await db.refresh(target)
+        if not rows:
+            return []
 
-        return created_targets
+        result = await db.execute(select(TargetStoreDaily).where(
+            TargetStoreDaily.store_code == target_data.store_code,
+            TargetStoreDaily.target_date.in_(list(percentages))
+        ).order_by(TargetStoreDaily.target_date))
+        return result.scalars().all()
 
     @staticmethod
     async def update_target_store_daily(db: AsyncSession, store_code: str, fiscal_month: str, target_date: datetime,
@@ -1372,6 +1403,117 @@ class StaffTargetCalculator:
         app_logger.debug(f"Final staff target values: {staff_target_values}")
         return staff_target_values
 
+    @staticmethod
+    def allocate_store_targets(store_cents: np.ndarray, group_index: np.ndarray, ratio_micros: np.ndarray) -> np.ndarray:
+        """
+        向量化的 calculate_staff_targets：一次处理多个门店的全部员工
+
+        全部使用整数定点运算（门店目标为分，比例为百万分之一），结果与 Decimal 路径一致：
+        员工目标 = 门店目标 × 比例 按 ROUND_HALF_UP 取整，与门店目标的差额加到每个门店第一个目标最大的员工身上；
+        门店目标 <= 0 时该门店员工目标均为 0。
+
+        Args:
+            store_cents: 每个门店的目标值（分）
+            group_index: 每个员工所属门店在 store_cents 中的下标，同一门店的员工必须相邻，且每个门店至少一名员工
+            ratio_micros: 每个员工的比例（百万分之一）
+
+        Returns:
+            np.ndarray: 每个员工的目标值（分）
+        """
+        if not len(ratio_micros):
+            return np.zeros(0, dtype=np.int64)
+
+        # 乘积可能超出 int64 时退回 Python 整数
+        bound = int(np.abs(store_cents).max()) * int(np.abs(ratio_micros).max())
+        dtype = np.int64 if bound < 2 ** 62 else object
+        store_cents = store_cents.astype(dtype)
+        products = store_cents[group_index] * ratio_micros.astype(dtype)
+
+        # 分 × 百万分之一 -> 元，ROUND_HALF_UP（远离零方向）
+        unit, half = 10 ** 8, 10 ** 8 // 2
+        targets = np.where(products < 0, -((half - products) // unit), (products + half) // unit) * 100
+
+        starts = np.flatnonzero(np.r_[True, group_index[1:] != group_index[:-1]])
+        differences = store_cents - np.add.reduceat(targets, starts)
+        maxima = np.maximum.reduceat(targets, starts)
+        candidates = np.flatnonzero(targets == maxima[group_index])
+        _, first = np.unique(group_index[candidates], return_index=True)
+
+        positive = store_cents > 0
+        targets[candidates[first]] += np.where(positive, differences, 0)
+        targets[~positive[group_index]] = 0
+        return targets
+
+    @staticmethod
+    async def redistribute_staff_targets(db: AsyncSession, store_targets: dict) -> int:
+        """
+        按新的门店目标重新分配员工目标（整月批量）
+
+        一次查询读取这些门店全部有比例的员工考勤记录，向量化计算后按主键批量更新 target_value 并提交；
+        没有比例的员工保持原目标。门店目标按 DECIMAL(12,2) 四舍五入到分后参与分配。
+
+        Args:
+            db: 数据库会话
+            store_targets: {(store_code, fiscal_month): 门店目标值}
+
+        Returns:
+            int: 更新的员工记录数
+        """
+        if not store_targets:
+            return 0
+
+        keys = sorted(store_targets)
+        attendances = []
+        for i in range(0, len(keys), TARGET_UPSERT_CHUNK):
+            result = await db.execute(
+                select(StaffAttendanceModel.staff_code, StaffAttendanceModel.store_code,
+                       StaffAttendanceModel.fiscal_month, StaffAttendanceModel.target_value_ratio)
+                .where(
+                    tuple_(StaffAttendanceModel.store_code, StaffAttendanceModel.fiscal_month).in_(
+                        keys[i:i + TARGET_UPSERT_CHUNK]),
+                    StaffAttendanceModel.target_value_ratio.isnot(None)
+                )
+                .order_by(StaffAttendanceModel.store_code, StaffAttendanceModel.fiscal_month,
+                          StaffAttendanceModel.staff_code)
+            )
+            attendances.extend(result.fetchall())
+        if not attendances:
+            return 0
+
+        store_cents = []
+        group_index = np.empty(len(attendances), dtype=np.int64)
+        ratio_micros = np.empty(len(attendances), dtype=np.int64)
+        current = None
+        for i, row in enumerate(attendances):
+            key = (row.store_code, row.fiscal_month)
+            if key != current:
+                current = key
+                target_value = Decimal(str(store_targets[key] or 0))
+                store_cents.append(int(target_value.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP).scaleb(2)))
+            group_index[i] = len(store_cents) - 1
+            ratio_micros[i] = int((Decimal(str(row.target_value_ratio)) * 1000000).to_integral_value(ROUND_HALF_UP))
+
+        targets = StaffTargetCalculator.allocate_store_targets(np.array(store_cents, dtype=np.int64), group_index,
+                                                               ratio_micros)
+
+        now = datetime.now()
+        rows = [
+            {
+                "staff_code": row.staff_code,
+                "store_code": row.store_code,
+                "fiscal_month": row.fiscal_month,
+                "target_value": Decimal(int(target)).scaleb(-2),
+                "updated_at": now
+            }
+            for row, target in zip(attendances, targets.tolist())
+        ]
+        for i in range(0, len(rows), TARGET_UPSERT_CHUNK):
+            await db.execute(update(StaffAttendanceModel), rows[i:i + TARGET_UPSERT_CHUNK])
+        await db.commit()
+
+        app_logger.info(f"redistribute_staff_targets: {len(rows)} staff targets in {len(store_cents)} stores")
+        return len(rows)
+
     @staticmethod
     def calculate_staff_target_from_ratio(store_target_value: Decimal, ratio: Decimal):
         """
@@ -1405,45 +1547,55 @@ class TargetStaffService:
         try:
             app_logger.info(f"Starting get_staff_attendance for fiscal_month={fiscal_month}, store_code={store_code}")
 
-            # Step 1: 获取门店目标与佣金相关信息
-            store_target_record = await TargetStaffService._fetch_store_target_data(db, fiscal_month, store_code)
+            started = time.perf_counter()
+
+            # 门店记录、合并范围汇总使用请求会话；月结状态和员工明细使用一个独立会话与之并发执行。
+            # module 为 "target" 时员工范围就是当前门店财月，三者一起并发；
+            # module 为 "commission" 时员工范围取决于门店记录中的合并门店/财月，分两轮执行。
+            async with SessionLocal() as side_db:
+                async def load_side():
+                    month_end = await CommissionUtil.get_month_end_value(side_db, fiscal_month)
+                    rows = None
+                    if module != "commission":
+                        rows = await TargetStaffService._fetch_staff_rows(
+                            side_db, fiscal_month, [store_code], [fiscal_month], module)
+                    return month_end, rows
+
+                store_target_record, (month_end_value, staff_attendance_data) = await asyncio.gather(
+                    TargetStaffService._fetch_store_target_data(db, fiscal_month, store_code),
+                    load_side()
+                )
 
-            # Step 2: 提取门店相关基础信息
-            store_type, opening_days, store_target_value, store_sales_value, staff_status, store_status, commission_status, \
-            commission_status_details, store_status_details, staff_status_details = \
-                TargetStaffService._extract_store_info(store_target_record)
+                # 提取门店相关基础信息
+                store_type, opening_days, store_target_value, store_sales_value, staff_status, store_status, \
+                commission_status, commission_status_details, store_status_details, staff_status_details = \
+                    TargetStaffService._extract_store_info(store_target_record)
+
+                merged_codes = [store_code]
+                merged_months = [fiscal_month]
+                if module == "commission":
+                    merged_totals = None
+                    if store_target_record:
+                        merged_codes, merged_months = TargetStaffService._merged_scope(
+                            store_target_record, store_code, fiscal_month)
+                        merged_totals, staff_attendance_data = await asyncio.gather(
+                            TargetStaffService._fetch_merged_totals(db, merged_codes, merged_months),
+                            TargetStaffService._fetch_staff_rows(side_db, fiscal_month, merged_codes, merged_months,
+                                                                 module)
+                        )
+                    else:
+                        staff_attendance_data = await TargetStaffService._fetch_staff_rows(
+                            side_db, fiscal_month, merged_codes, merged_months, module)
+
+                    if merged_totals is not None:
+                        store_target_value = merged_totals.total_target_value \
+                            if merged_totals.total_target_value is not None else Decimal('0')
+                        store_sales_value = merged_totals.total_sales_value \
+                            if merged_totals.total_sales_value is not None else Decimal('0')
 
             app_logger.debug(
                 f"get_staff_attendance Store target value: {store_target_value}, sales value: {store_sales_value}")
 
-            merged_codes = [store_code]
-            merged_months = [fiscal_month]
-            if store_target_record and module == "commission":
-                if store_target_record.merged_store_codes:
-                    merged_code = store_target_record.merged_store_codes.split(',')
-                    merged_codes = [code.strip() for code in merged_code]
-
-                if store_target_record.fiscal_period and store_target_record.fiscal_period != fiscal_month:
-                    merged_month = store_target_record.fiscal_period.split(',')
-                    merged_months = [code.strip() for code in merged_month]
-
-                result_merged = await db.execute(
-                    select(
-                        func.sum(TargetStoreMain.target_value).label('total_target_value'),
-                        func.sum(TargetStoreMain.sales_value).label('total_sales_value')
-                    )
-                        .where(
-                        TargetStoreMain.fiscal_month.in_(merged_months),
-                        TargetStoreMain.store_code.in_(merged_codes)
-                    )
-                )
-                merged_data = result_merged.fetchone()
-
-                store_target_value = merged_data.total_target_value if merged_data.total_target_value is not None else Decimal(
-                    '0')
-                store_sales_value = merged_data.total_sales_value if merged_data.total_sales_value is not None else Decimal(
-                    '0')
-
             fiscal_period, min_date = await TargetStaffService._fetch_fiscal_period(db,
                                                                                     merged_months if module == "commission" else [
                                                                                         fiscal_month])
@@ -1456,122 +1608,6 @@ class TargetStaffService:
             if has_approved:
                 should_values = True
 
-            app_logger.debug("Checking if staff attendance data exists")
-            attendance_check_result = await db.execute(
-                select(func.count()).select_from(StaffAttendanceModel)
-                    .where(
-                    StaffAttendanceModel.fiscal_month.in_(merged_months),
-                    StaffAttendanceModel.store_code.in_(merged_codes)
-                )
-            )
-            attendance_exists = attendance_check_result.scalar() > 0
-            app_logger.debug(f"Staff attendance data exists: {attendance_exists}")
-
-            if attendance_exists:
-                # 有数据存在，使用inner join
-                app_logger.debug(f'Querying staff attendance with inner join {merged_codes}, {merged_months}')
-                query = select(
-                    StaffModel.avatar,
-                    StaffModel.staff_code,
-                    StaffModel.first_name,
-                    StaffModel.state,
-                    StaffModel.position.label('staff_position'),
-                    StaffModel.salary_coefficient.label('staff_salary_coefficient'),
-                    StaffAttendanceModel.expected_attendance,
-                    StaffAttendanceModel.actual_attendance,
-                    StaffAttendanceModel.position.label('attendance_position'),
-                    StaffAttendanceModel.salary_coefficient.label('attendance_salary_coefficient'),
-                    StaffAttendanceModel.target_value_ratio,
-                    StaffAttendanceModel.target_value,
-                    StaffAttendanceModel.sales_value,
-                    StaffAttendanceModel.deletable,
-                    StaffAttendanceModel.fiscal_month
-                ).select_from(
-                    StaffModel.__table__.join(
-                        StaffAttendanceModel.__table__,
-                        (StaffModel.staff_code == StaffAttendanceModel.staff_code)
-                    )
-                ).where(
-                    StaffAttendanceModel.store_code.in_(merged_codes),
-                    StaffAttendanceModel.fiscal_month.in_(merged_months)
-                ).order_by(
-                    StaffModel.position.desc(),  # position 倒序
-                    StaffModel.staff_code.asc()  # staff_code 正序
-                )
-
-                # 当module为"target"时，只查询del_flag==0的记录
-                if module == "target":
-                    query = query.where(StaffAttendanceModel.del_flag == 0)
-
-                result = await db.execute(query)
-            else:
-                # 没有数据存在，查询StaffModel单表，但包含当前门店的活跃员工和上个月有考勤记录的员工
-                app_logger.debug("Querying staff model data with previous attendance records")
-
-                # 计算上个月的fiscal_month
-                fiscal_year, fiscal_month_num = map(int, fiscal_month.split('-'))
-                if fiscal_month_num == 1:
-                    previous_fiscal_month = f"{fiscal_year - 1}-12"
-                else:
-                    previous_fiscal_month = f"{fiscal_year}-{fiscal_month_num - 1}"
-
-                staff_query = select(
-                    StaffModel.avatar,
-                    StaffModel.staff_code,
-                    StaffModel.first_name,
-                    StaffModel.state,
-                    StaffModel.position.label('staff_position'),
-                    StaffModel.salary_coefficient.label('staff_salary_coefficient'),
-                    null().label('expected_attendance'),
-                    null().label('actual_attendance'),
-                    null().label('attendance_position'),
-                    null().label('attendance_salary_coefficient'),
-                    null().label('target_value_ratio'),
-                    null().label('target_value'),
-                    null().label('sales_value'),
-                    cast(0, type_=Integer).label('deletable'),
-                    cast(fiscal_month, type_=String).label('fiscal_month')
-                ).where(
-                    or_(
-                        and_(
-                            StaffModel.store_code.in_(merged_codes),
-                            StaffModel.state == 'A',
-                            StaffModel.del_flag == 0
-                        ),
-                        and_(
-                            select(1)
-                                .select_from(StaffAttendanceModel)
-                                .where(
-                                StaffAttendanceModel.staff_code == StaffModel.staff_code,
-                                StaffAttendanceModel.store_code.in_(merged_codes),
-                                StaffAttendanceModel.fiscal_month == previous_fiscal_month,
-                                StaffAttendanceModel.del_flag == 0
-                            )
-                                .exists(),
-                            ~select(1)
-                                .select_from(StaffAttendanceModel)
-                                .where(
-                                StaffAttendanceModel.staff_code == StaffModel.staff_code,
-                                StaffAttendanceModel.store_code.in_(merged_codes),
-                                StaffAttendanceModel.fiscal_month == previous_fiscal_month,
-                                StaffAttendanceModel.del_flag == 1
-                            )
-                                .exists()
-                        )
-                    )
-                ).order_by(
-                    StaffModel.position.desc(),
-                    StaffModel.staff_code.asc()
-                )
-
-                # 编译并记录SQL语句
-                compiled_query = staff_query.compile(compile_kwargs={"literal_binds": True})
-                app_logger.debug(f"SQL Query: {compiled_query}")
-
-                # 执行查询
-                result = await db.execute(staff_query)
-
-            staff_attendance_data = result.all()
             app_logger.debug(f"Retrieved {len(staff_attendance_data)} staff records")
 
             staff_attendance_dict = {}
@@ -1669,9 +1705,6 @@ class TargetStaffService:
             # 转换为列表格式
             staff_attendance_list = list(staff_attendance_dict.values())
 
-            # 获取月结状态
-            month_end_value = await CommissionUtil.get_month_end_value(db, fiscal_month)
-
             result_data = {
                 "data": staff_attendance_list,
                 "header_info": {
@@ -1691,8 +1724,14 @@ class TargetStaffService:
                 "MonthEnd": month_end_value
             }
 
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms > STORE_DETAIL_LATENCY_BUDGET_MS:
+                app_logger.warning(
+                    f"get_staff_attendance over latency budget: fiscal_month={fiscal_month}, store_code={store_code}, "
+                    f"module={module}, elapsed={elapsed_ms:.0f}ms, budget={STORE_DETAIL_LATENCY_BUDGET_MS}ms")
             app_logger.info(
-                f"Successfully completed get_staff_attendance for fiscal_month={fiscal_month}, store_code={store_code}")
+                f"Successfully completed get_staff_attendance for fiscal_month={fiscal_month}, store_code={store_code}, "
+                f"elapsed={elapsed_ms:.0f}ms")
             return result_data
 
         except Exception as e:
@@ -1702,6 +1741,161 @@ class TargetStaffService:
             # return []  # 或者
             raise e
 
+    @staticmethod
+    def _merged_scope(store_target_record, store_code: str, fiscal_month: str):
+        """佣金模块下合并门店/合并财月的范围"""
+        merged_codes = [store_code]
+        merged_months = [fiscal_month]
+        if store_target_record.merged_store_codes:
+            merged_code = store_target_record.merged_store_codes.split(',')
+            merged_codes = [code.strip() for code in merged_code]
+
+        if store_target_record.fiscal_period and store_target_record.fiscal_period != fiscal_month:
+            merged_month = store_target_record.fiscal_period.split(',')
+            merged_months = [code.strip() for code in merged_month]
+        return merged_codes, merged_months
+
+    @staticmethod
+    async def _fetch_merged_totals(db: AsyncSession, merged_codes: list, merged_months: list):
+        """合并范围内的门店目标、销售合计"""
+        result_merged = await db.execute(
+            select(
+                func.sum(TargetStoreMain.target_value).label('total_target_value'),
+                func.sum(TargetStoreMain.sales_value).label('total_sales_value')
+            )
+                .where(
+                TargetStoreMain.fiscal_month.in_(merged_months),
+                TargetStoreMain.store_code.in_(merged_codes)
+            )
+        )
+        return result_merged.fetchone()
+
+    @staticmethod
+    async def _fetch_staff_rows(db: AsyncSession, fiscal_month: str, merged_codes: list, merged_months: list,
+                                module: str) -> list:
+        """
+        门店员工明细行
+
+        有考勤数据时返回员工与考勤的 inner join；没有考勤数据时返回当前门店的在职员工和上个月有考勤记录的员工。
+        先直接查询考勤明细，只有结果为空时才检查考勤数据是否存在，常见情况下只需一次查询。
+        """
+        app_logger.debug(f'Querying staff attendance with inner join {merged_codes}, {merged_months}')
+        query = select(
+            StaffModel.avatar,
+            StaffModel.staff_code,
+            StaffModel.first_name,
+            StaffModel.state,
+            StaffModel.position.label('staff_position'),
+            StaffModel.salary_coefficient.label('staff_salary_coefficient'),
+            StaffAttendanceModel.expected_attendance,
+            StaffAttendanceModel.actual_attendance,
+            StaffAttendanceModel.position.label('attendance_position'),
+            StaffAttendanceModel.salary_coefficient.label('attendance_salary_coefficient'),
+            StaffAttendanceModel.target_value_ratio,
+            StaffAttendanceModel.target_value,
+            StaffAttendanceModel.sales_value,
+            StaffAttendanceModel.deletable,
+            StaffAttendanceModel.fiscal_month
+        ).select_from(
+            StaffModel.__table__.join(
+                StaffAttendanceModel.__table__,
+                (StaffModel.staff_code == StaffAttendanceModel.staff_code)
+            )
+        ).where(
+            StaffAttendanceModel.store_code.in_(merged_codes),
+            StaffAttendanceModel.fiscal_month.in_(merged_months)
+        ).order_by(
+            StaffModel.position.desc(),  # position 倒序
+            StaffModel.staff_code.asc()  # staff_code 正序
+        )
+
+        # 当module为"target"时，只查询del_flag==0的记录
+        if module == "target":
+            query = query.where(StaffAttendanceModel.del_flag == 0)
+
+
+        staff_rows = (await db.execute(query)).all()
+        if staff_rows:
+            return staff_rows
+
+        attendance_check_result = await db.execute(
+            select(func.count()).select_from(StaffAttendanceModel)
+                .where(
+                StaffAttendanceModel.fiscal_month.in_(merged_months),
+                StaffAttendanceModel.store_code.in_(merged_codes)
+            )
+        )
+        if attendance_check_result.scalar() > 0:
+            app_logger.debug("Staff attendance data exists but no staff rows matched")
+            return staff_rows
+
+        # 没有数据存在，查询StaffModel单表，但包含当前门店的活跃员工和上个月有考勤记录的员工
+        app_logger.debug("Querying staff model data with previous attendance records")
+
+        # 计算上个月的fiscal_month
+        fiscal_year, fiscal_month_num = map(int, fiscal_month.split('-'))
+        if fiscal_month_num == 1:
+            previous_fiscal_month = f"{fiscal_year - 1}-12"
+        else:
+            previous_fiscal_month = f"{fiscal_year}-{fiscal_month_num - 1}"
+
+        staff_query = select(
+            StaffModel.avatar,
+            StaffModel.staff_code,
+            StaffModel.first_name,
+            StaffModel.state,
+            StaffModel.position.label('staff_position'),
+            StaffModel.salary_coefficient.label('staff_salary_coefficient'),
+            null().label('expected_attendance'),
+            null().label('actual_attendance'),
+            null().label('attendance_position'),
+            null().label('attendance_salary_coefficient'),
+            null().label('target_value_ratio'),
+            null().label('target_value'),
+            null().label('sales_value'),
+            cast(0, type_=Integer).label('deletable'),
+            cast(fiscal_month, type_=String).label('fiscal_month')
+        ).where(
+            or_(
+                and_(
+                    StaffModel.store_code.in_(merged_codes),
+                    StaffModel.state == 'A',
+                    StaffModel.del_flag == 0
+                ),
+                and_(
+                    select(1)
+                        .select_from(StaffAttendanceModel)
+                        .where(
+                        StaffAttendanceModel.staff_code == StaffModel.staff_code,
+                        StaffAttendanceModel.store_code.in_(merged_codes),
+                        StaffAttendanceModel.fiscal_month == previous_fiscal_month,
+                        StaffAttendanceModel.del_flag == 0
+                    )
+                        .exists(),
+                    ~select(1)
+                        .select_from(StaffAttendanceModel)
+                        .where(
+                        StaffAttendanceModel.staff_code == StaffModel.staff_code,
+                        StaffAttendanceModel.store_code.in_(merged_codes),
+                        StaffAttendanceModel.fiscal_month == previous_fiscal_month,
+                        StaffAttendanceModel.del_flag == 1
+                    )
+                        .exists()
+                )
+            )
+        ).order_by(
+            StaffModel.position.desc(),
+            StaffModel.staff_code.asc()
+        )
+
+        # 编译并记录SQL语句
+        compiled_query = staff_query.compile(compile_kwargs={"literal_binds": True})
+        app_logger.debug(f"SQL Query: {compiled_query}")
+
+        # 执行查询
+        result = await db.execute(staff_query)
+        return result.all()
+
     @staticmethod
     async def _fetch_store_target_data(db: AsyncSession, fiscal_month: str, store_code: str):
         """获取门店的目标和佣金相关信息"""
@@ -1823,39 +2017,23 @@ class TargetStaffService:
     @staticmethod
     async def _fetch_fiscal_period(db: AsyncSession, fiscal_month: list):
         """获取指定财月的时间区间"""
-        date_range_result = await db.execute(
-            select(
-                func.min(DimensionDayWeek.actual_date).label('min_date'),
-                func.max(DimensionDayWeek.actual_date).label('max_date')
-            )
-                .where(DimensionDayWeek.fiscal_month.in_(fiscal_month))
-        )
-        date_range = date_range_result.fetchone()
-        if date_range and date_range.min_date and date_range.max_date:
-            date_range_str = f"{date_range.min_date.strftime('%Y-%m-%d')} to {date_range.max_date.strftime('%Y-%m-%d')}"
-            return date_range_str, date_range.min_date
-        return "", None
+        calendar = await FiscalCalendar.get(db)
+        min_date, _ = calendar.date_range(fiscal_month)
+        return calendar.fiscal_period(fiscal_month), min_date
 
     @staticmethod
     async def _get_opening_days_flag_by_store_type(db: AsyncSession, store_type: str):
 
         try:
             app_logger.info(f"Getting opening days flag for store type: {store_type}")
-            result = await db.execute(
-                select(func.max(CommissionRuleModel.attendance_calculation_logic))
-                    .select_from(
-                    CommissionRuleModel.__table__.join(
-                        CommissionRuleAssignmentModel.__table__,
-                        CommissionRuleModel.rule_code == CommissionRuleAssignmentModel.rule_code
-                    )
-                )
-                    .where(
-                    CommissionRuleModel.attendance_calculation_logic == 1,
-                    CommissionRuleAssignmentModel.store_type == store_type
-                )
+            catalog = await CommissionRuleCatalog.get(db)
+            max_logic = max(
+                (catalog.rules[row.rule_code].attendance_calculation_logic
+                 for row in catalog.assignments
+                 if row.store_type == store_type and row.rule_code in catalog.rules
+                 and catalog.rules[row.rule_code].attendance_calculation_logic == 1),
+                default=None
             )
-
-            max_logic = result.scalar()
             app_logger.info(f"Max logic for store type {store_type}: {max_logic}")
             # 如果查询结果为1，返回1；否则返回0
             return 1 if max_logic == 1 else 0
@@ -2077,6 +2255,10 @@ class TargetStaffService:
                     db.add(target_staff_attendance)
                     created_staff_targets.append(target_staff_attendance)
 
+            # 员工、岗位和员工目标重新分配，整店重算
+            await CommissionDirtyService.mark(db, target_data.store_code, target_data.fiscal_month, None,
+                                              "staff_attendance")
+
             # 提交事务
             await db.commit()
             app_logger.info(f"Committed {len(created_staff_targets)} staff attendance records")
@@ -2130,6 +2312,9 @@ class TargetStaffService:
 
             app_logger.debug(f"Found {len(target_staff)} staff attendance records to process")
 
+            await CommissionDirtyService.mark_staff(db, store_code, fiscal_month, [staff_code],
+                                                    "delete_staff_attendance")
+
             deleted_count = 0
             soft_deleted_count = 0
 
@@ -0,0 +1,189 @@
+# app/utils/excel_reader.py
+import asyncio
+import os
+import tempfile
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from fastapi import UploadFile
+from openpyxl import load_workbook
+
+# 上传文件每次读取的字节数
+UPLOAD_SPOOL_BLOCK_SIZE = 1024 * 1024
+# 每个数据块的行数
+EXCEL_CHUNK_ROWS = 5000
+# 预览默认返回的行数
+EXCEL_PREVIEW_ROWS = 100
+
+
+async def spool_upload(file: UploadFile) -> str:
+    """
+    把上传文件分块写入临时文件，不在内存中保留整个文件
+
+    Args:
+        file: 上传文件
+
+    Returns:
+        str: 临时文件路径，由调用方删除
+    """
+    suffix = os.path.splitext(file.filename or '')[1].lower() or '.xlsx'
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            while True:
+                block = await file.read(UPLOAD_SPOOL_BLOCK_SIZE)
+                if not block:
+                    break
+                spool.write(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def _header_names(header_row) -> List[str]:
+    """与 pandas.read_excel 一致：空表头为 Unnamed: n，重复表头追加 .1、.2"""
+    names = []
+    seen = {}
+    for i, value in enumerate(header_row):
+        name = f"Unnamed: {i}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _cell_value(value):
+    # 与 pandas 的 openpyxl 读取方式一致，整数值的浮点数转为 int
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _chunk_frame(rows: list, columns: List[str], start: int) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=columns, index=range(start, start + len(rows)))
+    # 空单元格统一为 NaN（整列为空时 pandas 会保留 None）
+    return df.mask(df.isna()).infer_objects()
+
+
+def iter_excel_chunks(path: str, chunk_rows: int = EXCEL_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    按块读取第一个工作表，每块是一个 DataFrame
+
+    xlsx 使用 openpyxl 只读模式逐行读取，内存占用与文件大小无关；
+    旧版 xls 无法流式读取，整表读入后再切块。
+    DataFrame 的索引是数据行号（从 0 开始，不含表头），与整表读取时一致。
+
+    Args:
+        path: 文件路径
+        chunk_rows: 每块行数
+
+    Yields:
+        pd.DataFrame: 数据块，空表时产生一个只有表头的 DataFrame
+    """
+    if path.lower().endswith('.xls'):
+        df = pd.read_excel(path)
+        for start in range(0, max(len(df), 1), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header_row = next(rows, None)
+        if header_row is None:
+            yield pd.DataFrame()
+            return
+        columns = _header_names(header_row)
+
+        start = 0
+        buffer = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            buffer.append([_cell_value(value) for value in row[:len(columns)]])
+            if len(buffer) >= chunk_rows:
+                yield _chunk_frame(buffer, columns, start)
+                start += len(buffer)
+                buffer = []
+        if buffer or start == 0:
+            yield _chunk_frame(buffer, columns, start)
+    finally:
+        workbook.close()
+
+
+async def aiter_excel_chunks(path: str, chunk_rows: int = EXCEL_CHUNK_ROWS) -> AsyncIterator[pd.DataFrame]:
+    """iter_excel_chunks 的异步版本，每块在线程中解析，不阻塞事件循环"""
+    chunks = iter_excel_chunks(path, chunk_rows)
+    try:
+        while True:
+            df = await asyncio.to_thread(next, chunks, None)
+            if df is None:
+                return
+            yield df
+    finally:
+        chunks.close()
+
+
+def read_excel_columns(path: str) -> List[str]:
+    """只读取表头"""
+    if path.lower().endswith('.xls'):
+        return list(pd.read_excel(path, nrows=0).columns)
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        header_row = next(workbook.active.iter_rows(values_only=True), None)
+        return _header_names(header_row) if header_row else []
+    finally:
+        workbook.close()
+
+
+def read_excel_preview(path: str, preview_rows: int = EXCEL_PREVIEW_ROWS) -> Tuple[List[str], pd.DataFrame,
+                                                                                     Optional[int], bool]:
+    """
+    读取表头和前 preview_rows 行数据，并给出总行数
+
+    xlsx 的总行数取自工作表 dimension（不含表头），可能包含末尾的空行，因此是估算值；
+    读完全部数据或没有 dimension 信息时，分别返回精确行数或 None。
+
+    Args:
+        path: 文件路径
+        preview_rows: 预览行数
+
+    Returns:
+        tuple: (列名, 预览数据, 总行数, 总行数是否为估算值)
+    """
+    if path.lower().endswith('.xls'):
+        # 旧版 xls 没有可直接读取的行数信息，只能整表读取
+        df = pd.read_excel(path)
+        return list(df.columns), df.head(preview_rows), len(df), False
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.active
+        rows = worksheet.iter_rows(values_only=True)
+        header_row = next(rows, None)
+        if header_row is None:
+            return [], pd.DataFrame(), 0, False
+        columns = _header_names(header_row)
+
+        buffer = []
+        exhausted = True
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            if len(buffer) >= preview_rows:
+                exhausted = False
+                break
+            buffer.append([_cell_value(value) for value in row[:len(columns)]])
+
+        df = _chunk_frame(buffer, columns, 0)
+        if exhausted:
+            return columns, df, len(buffer), False
+        max_row = worksheet.max_row
+        return columns, df, (max_row - 1 if max_row else None), True
+    finally:
+        workbook.close()
@@ -0,0 +1,99 @@
+# app/utils/excel_writer.py
+import os
+import tempfile
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+# 响应流每次读取的字节数
+EXPORT_STREAM_BLOCK_SIZE = 1024 * 1024
+
+_CELL_TYPES = (str, int, float, Decimal, bool, date, datetime, time)
+
+
+def report_columns(rows: List[dict], field_translations: Optional[dict] = None) -> List[str]:
+    """
+    报表列顺序：按字段首次出现的顺序（与 pd.DataFrame(rows) 一致）；没有数据时使用字段翻译中的字段
+
+    Args:
+        rows: 报表数据
+        field_translations: 字段翻译
+
+    Returns:
+        List[str]: 字段名列表
+    """
+    if not rows:
+        return list(field_translations or {})
+    columns = dict.fromkeys(rows[0])
+    for row in rows:
+        if row.keys() != columns.keys():
+            columns.update(dict.fromkeys(row))
+    return list(columns)
+
+
+def _cell_value(value):
+    if value is None or isinstance(value, _CELL_TYPES):
+        # NaN 写成空单元格
+        if isinstance(value, float) and value != value:
+            return None
+        return value
+    return str(value)
+
+
+def write_xlsx(path: str, sheets: Iterable[dict]):
+    """
+    使用 openpyxl 只写模式写入 xlsx，逐行写出，不在内存中保留整个工作表
+
+    Args:
+        path: 输出文件路径
+        sheets: 工作表定义，每个为 dict：
+            name: 工作表名
+            columns: 字段名列表
+            headers: 表头（默认使用字段名）
+            formats: {字段名: number_format}，由报表字段定义决定，不扫描数据；未声明的列使用常规格式
+            rows: 行数据（dict）的可迭代对象
+    """
+    workbook = Workbook(write_only=True)
+    for sheet in sheets:
+        worksheet = workbook.create_sheet(sheet['name'])
+        columns = sheet['columns']
+        worksheet.append(sheet.get('headers') or columns)
+
+        formats: Dict[str, str] = sheet.get('formats') or {}
+        formatted = [(index, formats[column]) for index, column in enumerate(columns) if column in formats]
+        for row in sheet['rows']:
+            values = [_cell_value(row.get(column)) for column in columns]
+            for index, number_format in formatted:
+                cell = WriteOnlyCell(worksheet, value=values[index])
+                cell.number_format = number_format
+                values[index] = cell
+            worksheet.append(values)
+    workbook.save(path)
+
+
+def write_xlsx_tempfile(sheets: Iterable[dict]) -> str:
+    """写入临时文件，返回文件路径，由调用方删除"""
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        write_xlsx(path, sheets)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def iter_file_and_remove(path: str, block_size: int = EXPORT_STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """分块读取文件用于流式响应，读完（或客户端断开）后删除文件"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(path)
@@ -0,0 +1,82 @@
+# app/utils/keyset.py
+import base64
+import json
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(values: Sequence) -> str:
+    """把最后一行的排序键编码为不透明的游标字符串"""
+    return base64.urlsafe_b64encode(json.dumps(list(values), ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[tuple]:
+    """
+    解析游标
+
+    Args:
+        cursor: encode_cursor 生成的游标，为空表示第一页
+        size: 排序键的列数
+
+    Returns:
+        tuple: 排序键取值，cursor 为空时返回 None
+
+    Raises:
+        ValueError: 游标格式错误
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return tuple(values)
+
+
+def keyset_after(columns: Sequence, values: Optional[Sequence]):
+    """
+    构建 (c1, c2, ...) > (v1, v2, ...) 的键集分页条件，展开为 OR/AND 形式以便使用索引
+
+    Args:
+        columns: 排序列（与 ORDER BY 顺序一致，均为升序）
+        values: 上一页最后一行的排序键，为 None 时不加条件
+
+    Returns:
+        条件表达式，values 为 None 时返回 None
+    """
+    if values is None:
+        return None
+    conditions = []
+    for i, column in enumerate(columns):
+        conditions.append(and_(*[columns[j] == values[j] for j in range(i)], column > values[i]))
+    return or_(*conditions)
+
+
+async def take_page(rows: AsyncIterator[dict], limit: int, key_fields: Sequence[str]) -> Tuple[List[dict], Optional[str]]:
+    """
+    从行迭代器中读取一页，读到 limit + 1 行即停止并关闭迭代器（释放数据库游标）
+
+    Args:
+        rows: 按 key_fields 升序产生的行
+        limit: 每页行数
+        key_fields: 行中作为排序键的字段
+
+    Returns:
+        tuple: (本页数据, 下一页游标；没有下一页时为 None)
+    """
+    page = []
+    try:
+        async for row in rows:
+            page.append(row)
+            if len(page) > limit:
+                break
+    finally:
+        await rows.aclose()
+
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, encode_cursor([page[-1][field] for field in key_fields])
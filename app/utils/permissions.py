@@ -1,17 +1,94 @@
-from sqlalchemy import exists, or_, select
+from collections import defaultdict
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from app.models.dimension import RoleOrgJoin, StoreModel
+from app.utils.logger import app_logger
+from app.utils.ttl_cache import TTLCache
+
+# 角色门店权限缓存：最多缓存的角色数和有效期（role_org_join / store 由外部系统维护）
+ROLE_STORE_ACCESS_CACHE_SIZE = 500
+ROLE_STORE_ACCESS_TTL_SECONDS = 300
+
+
+class RoleStoreAccess:
+    """
+    角色 -> 可访问门店集合（frozenset），在内存中预先计算
+
+    规则与原 EXISTS 子查询一致：
+    level_1 必须匹配 manage_channel；level_2/3/4 有配置时必须分别匹配 manage_region / City / store_code，无配置时不限制。
+    role_org_join 或门店维护后调用 invalidate 立即生效，否则最长 ROLE_STORE_ACCESS_TTL_SECONDS 后生效。
+    """
+
+    _cache = TTLCache(ROLE_STORE_ACCESS_CACHE_SIZE, ROLE_STORE_ACCESS_TTL_SECONDS)
+
+    @staticmethod
+    async def store_codes(db: AsyncSession, role_code: str) -> frozenset:
+        """
+        获取角色可访问的门店代码
+
+        Args:
+            db: 数据库会话
+            role_code: 角色代码
 
+        Returns:
+            frozenset: 门店代码集合
+        """
+        store_codes = RoleStoreAccess._cache.get(role_code)
+        if store_codes is not None:
+            return store_codes
 
-def build_store_permission_query(role_code: str):
+        result = await db.execute(
+            select(RoleOrgJoin.org_level, RoleOrgJoin.org_level_value)
+            .where(RoleOrgJoin.role_code == role_code)
+        )
+        levels = defaultdict(set)
+        for row in result.fetchall():
+            levels[row.org_level].add(row.org_level_value)
+
+        if levels['level_1']:
+            query = select(StoreModel.store_code).where(StoreModel.manage_channel.in_(levels['level_1']))
+            for org_level, column in (('level_2', StoreModel.manage_region),
+                                      ('level_3', StoreModel.City),
+                                      ('level_4', StoreModel.store_code)):
+                if levels[org_level]:
+                    query = query.where(column.in_(levels[org_level]))
+            result = await db.execute(query)
+            store_codes = frozenset(row.store_code for row in result.fetchall())
+        else:
+            store_codes = frozenset()
+
+        RoleStoreAccess._cache.set(role_code, store_codes)
+        app_logger.debug(f"Role {role_code} store access loaded: {len(store_codes)} stores")
+        return store_codes
+
+    @staticmethod
+    def invalidate(role_code: str = None):
+        """失效一个角色，role_code 为空时清空全部"""
+        if role_code:
+            RoleStoreAccess._cache.pop(role_code)
+        else:
+            RoleStoreAccess._cache.clear()
+        app_logger.info(f"Role store access invalidated: {role_code or 'all'}")
+
+    @staticmethod
+    def stats() -> dict:
+        return RoleStoreAccess._cache.stats()
+
+
+async def build_store_permission_query(db: AsyncSession, role_code: str):
     """
     构建带数据权限控制的店铺查询
 
     Args:
+        db: 数据库会话
         role_code: 角色代码
 
     Returns:
-        带权限过滤的 StoreModel 查询，只包含 store_code 和 store_name 列
+        带权限过滤（store_code IN 角色门店集合）的 StoreModel 查询
     """
+    store_codes = await RoleStoreAccess.store_codes(db, role_code)
     return (
         select(
             StoreModel.store_code,
@@ -24,54 +101,5 @@ def build_store_permission_query(role_code: str):
             StoreModel.City_Tier,
             StoreModel.manage_channel
         )
-            # level_1 权限检查 (manage_channel)
-            .where(
-            exists().where(
-                RoleOrgJoin.org_level == 'level_1',
-                RoleOrgJoin.org_level_value == StoreModel.manage_channel,
-                RoleOrgJoin.role_code == role_code
-            )
-        )
-            # level_2 权限检查 (manage_region)
-            .where(
-            or_(
-                exists().where(
-                    RoleOrgJoin.org_level == 'level_2',
-                    RoleOrgJoin.org_level_value == StoreModel.manage_region,
-                    RoleOrgJoin.role_code == role_code
-                ),
-                ~exists().where(
-                    RoleOrgJoin.org_level == 'level_2',
-                    RoleOrgJoin.role_code == role_code
-                )
-            )
-        )
-            # level_3 权限检查 (City)
-            .where(
-            or_(
-                exists().where(
-                    RoleOrgJoin.org_level == 'level_3',
-                    RoleOrgJoin.org_level_value == StoreModel.City,
-                    RoleOrgJoin.role_code == role_code
-                ),
-                ~exists().where(
-                    RoleOrgJoin.org_level == 'level_3',
-                    RoleOrgJoin.role_code == role_code
-                )
-            )
-        )
-            # level_4 权限检查 (store_code)
-            .where(
-            or_(
-                exists().where(
-                    RoleOrgJoin.org_level == 'level_4',
-                    RoleOrgJoin.org_level_value == StoreModel.store_code,
-                    RoleOrgJoin.role_code == role_code
-                ),
-                ~exists().where(
-                    RoleOrgJoin.org_level == 'level_4',
-                    RoleOrgJoin.role_code == role_code
-                )
-            )
-        )
+            .where(StoreModel.store_code.in_(sorted(store_codes)))
     )
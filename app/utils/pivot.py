@@ -0,0 +1,73 @@
+# app/utils/pivot.py
+from typing import Hashable, Iterable, List, Tuple
+
+import numpy as np
+
+
+class PivotMatrix:
+    """
+    透视结果：行键、列键（均已排序）和稠密矩阵 values[行, 列]
+    """
+
+    __slots__ = ('row_keys', 'column_keys', 'values')
+
+    def __init__(self, row_keys: List, column_keys: List, values: np.ndarray):
+        self.row_keys = row_keys
+        self.column_keys = column_keys
+        self.values = values
+
+    def rows(self) -> List[list]:
+        """按行返回 Python 对象列表（保留 Decimal 等原始类型）"""
+        return self.values.tolist()
+
+
+def _sorted_positions(index: dict) -> Tuple[List, np.ndarray]:
+    """
+    对首次出现顺序编号的键排序
+
+    Returns:
+        tuple: (排序后的键, 原编号 -> 排序后位置 的映射数组)
+    """
+    keys = sorted(index)
+    positions = np.empty(len(keys), dtype=np.intp)
+    for position, key in enumerate(keys):
+        positions[index[key]] = position
+    return keys, positions
+
+
+def pivot(cells: Iterable[Tuple[Hashable, Hashable, object]], fill_value=0.0) -> PivotMatrix:
+    """
+    一次遍历把 (行键, 列键, 值) 转为稠密的 行 × 列 矩阵，缺失的单元格为 fill_value；
+    同一单元格出现多次时保留最后一个值。行键、列键按自身的自然顺序排序，
+    只对去重后的键排序一次，整体耗时与输入行数成线性关系
+
+    Args:
+        cells: (行键, 列键, 值) 的可迭代对象，键为 None 的调用方应先过滤
+        fill_value: 缺失单元格的填充值
+
+    Returns:
+        PivotMatrix: 透视结果
+    """
+    row_index = {}
+    column_index = {}
+    values = {}
+    for row_key, column_key, value in cells:
+        r = row_index.get(row_key)
+        if r is None:
+            r = row_index[row_key] = len(row_index)
+        c = column_index.get(column_key)
+        if c is None:
+            c = column_index[column_key] = len(column_index)
+        values[(r, c)] = value
+
+    row_keys, row_positions = _sorted_positions(row_index)
+    column_keys, column_positions = _sorted_positions(column_index)
+
+    matrix = np.full((len(row_keys), len(column_keys)), fill_value, dtype=object)
+    if values:
+        coordinates = np.fromiter((i for cell in values for i in cell), dtype=np.intp,
+                                  count=2 * len(values)).reshape(-1, 2)
+        cell_values = np.empty(len(values), dtype=object)
+        cell_values[:] = list(values.values())
+        matrix[row_positions[coordinates[:, 0]], column_positions[coordinates[:, 1]]] = cell_values
+    return PivotMatrix(row_keys, column_keys, matrix)
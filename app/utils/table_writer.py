@@ -0,0 +1,86 @@
+# app/utils/table_writer.py
+import csv
+import io
+import os
+import tempfile
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, Iterator, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# CSV 流式响应每块包含的行数
+CSV_STREAM_ROWS = 2000
+
+
+def _csv_value(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return value
+
+
+def iter_csv_chunks(columns: List[str], headers: List[str], rows: Iterable[dict],
+                    chunk_rows: int = CSV_STREAM_ROWS) -> Iterator[bytes]:
+    """
+    逐块生成 UTF-8 编码的 CSV，用于流式响应
+
+    Args:
+        columns: 字段名列表
+        headers: 表头
+        rows: 行数据（dict）
+        chunk_rows: 每块行数
+
+    Yields:
+        bytes: CSV 数据块
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(headers)
+    count = 0
+    for row in rows:
+        writer.writerow([_csv_value(row.get(column)) for column in columns])
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _arrow_column(values: list):
+    """
+    转换为 Arrow 列：包含 Decimal 的列统一为 decimal128（精度由数据推断），
+    其余由 pyarrow 推断类型，无法推断（类型混杂）时转为字符串
+    """
+    values = [None if isinstance(value, float) and value != value else value for value in values]
+    try:
+        if any(isinstance(value, Decimal) for value in values):
+            values = [value if value is None or isinstance(value, Decimal) else Decimal(str(value))
+                      for value in values]
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, InvalidOperation):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+def write_parquet_tempfile(columns: List[str], headers: List[str], rows: List[dict]) -> str:
+    """
+    按列写入 parquet 临时文件，返回文件路径，由调用方删除
+
+    Args:
+        columns: 字段名列表
+        headers: 列名（写入文件的字段名）
+        rows: 行数据（dict）
+
+    Returns:
+        str: 临时文件路径
+    """
+    table = pa.table([_arrow_column([row.get(column) for row in rows]) for column in columns], names=headers)
+    fd, path = tempfile.mkstemp(suffix='.parquet')
+    os.close(fd)
+    try:
+        pq.write_table(table, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,57 @@
+# app/utils/ttl_cache.py
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    进程内 TTL + LRU 缓存
+
+    条目超过 ttl_seconds 视为过期，条目数超过 max_size 时淘汰最久未使用的条目。
+    只在事件循环线程中使用，不加锁。
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        self._entries[key] = (self._clock() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits, "misses": self.misses}
@@ -6,6 +6,7 @@ from app.routes import target, commission, menu, dimension, excel_upload, report
 
 from datetime import datetime, timedelta
 
+from app.core.python_ssha2_hasher import PasswordVerifyBusy
 from app.core.security import authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 from app.database import get_sqlserver_db
 
@@ -32,7 +33,11 @@ app.include_router(report.router, prefix="/report")
 
 @app.post("/retail_hub_api/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session=Depends(get_sqlserver_db)):
-    user = await authenticate_user(session, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(session, form_data.username, form_data.password)
+    except PasswordVerifyBusy:
+        app_logger.warning(f"Password verification queue is full, login rejected: {form_data.username}")
+        return {"code": 503, "msg": "Too many concurrent logins, please retry"}
     if not user:
         return {"code": 301, "msg": "Incorrect username or password"}
 
@@ -74,6 +79,10 @@ async def init_db():
 
 
 if __name__ == "__main__":
+    # 打包后的可执行文件中，密码校验进程池需要 freeze_support
+    import multiprocessing
+
+    multiprocessing.freeze_support()
     asyncio.run(init_db())
     import uvicorn
 